@@ -8,12 +8,15 @@ from pics_sorter.const import AppConfig
 from .app import get_app
 
 
-logging.basicConfig(level=logging.DEBUG, format='%(asctime)s [%(levelname)s] %(name)s: %(message)s')
 log = logging.getLogger('main')
 
 
 def main():
     app_config = AppConfig()
+    logging.basicConfig(
+        level=app_config.log_level.upper(),
+        format='%(asctime)s [%(levelname)s] %(name)s: %(message)s',
+    )
 
     log.debug(f'app is ok. directory={app_config.static_dir.absolute()}')
     if not app_config.static_dir.exists():
@@ -1,21 +1,43 @@
 import logging
 from functools import partial
-from pathlib import Path
 
+import PIL
 from elo import DRAW, LOSS, rate, WIN
-from fastapi import APIRouter, FastAPI, Request, WebSocket, WebSocketDisconnect
-from fastapi.responses import FileResponse, HTMLResponse
+from fastapi import (
+    APIRouter,
+    Depends,
+    FastAPI,
+    HTTPException,
+    Request,
+    WebSocket,
+)
+from fastapi.responses import (
+    FileResponse,
+    HTMLResponse,
+    JSONResponse,
+    PlainTextResponse,
+    Response,
+)
 from fastapi.staticfiles import StaticFiles
 from pics_sorter.const import AppConfig
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
+from starlette.requests import HTTPConnection
 
+from . import metrics
 from .const import app_ctx
-from .controller import PicsController
-from .models import setup_engine
+from .libraries import Libraries, Library
+from .profiler import Profiler, record
+from .protocol import Connection, PROTOCOL_VERSION, UNSUPPORTED_VERSION
+from .renditions import FORMATS, snap_width, srcset_widths, version
 
 
 DIR = 'pics'
+RENDITION = 'rendition'
+# width of `src` rendition, browser picks from `srcset` when supported
+DEFAULT_WIDTH = 1024
+# browser revalidates renditions after a day
+RENDITION_MAX_AGE = 24 * 3600
 
 
 root = APIRouter()
@@ -24,14 +46,42 @@ for name in ['aiosqlite', 'PIL']:
     logging.getLogger(name).setLevel(logging.INFO)
 
 
-def to_link(url_for, rel_image):
-    return url_for(DIR, path=str(rel_image))
+def mount_name(library_id: str) -> str:
+    return f'{DIR}_{library_id}'
 
 
-def get_links(req: Request, images):
+def to_link(url_for, rel_image, library_id: str):
+    return url_for(mount_name(library_id), path=str(rel_image))
+
+
+def to_rendition(url_for, image, library_id: str, width: int, fmt: str = 'webp'):
+    url = url_for(RENDITION, image_id=str(image.id))
+    v = version(image.fingerprint, image.mtime, image.inode)
+    return f'{url}?library={library_id}&width={width}&format={fmt}&v={v}'
+
+
+def get_renditions(url_for, image, library_id: str) -> dict:
+    if not image.fingerprint:
+        return {'src': to_link(url_for, image.path, library_id), 'srcset': ''}
+    widths = srcset_widths(image.width)
+    srcset = ', '.join(
+        f'{to_rendition(url_for, image, library_id, x)} {real}w' for x, real in widths
+    )
+    return {'src': to_rendition(url_for, image, library_id, DEFAULT_WIDTH), 'srcset': srcset}
+
+
+def get_library(library: str | None = None) -> Library:
+    """library from `library` query param, default one when it is not set"""
+    if found := app_ctx.get()['libraries'].get(library):
+        return found
+    raise HTTPException(404, f'unknown library: {library}')
+
+
+def get_links(req: HTTPConnection, images, library: Library):
     return [
         {
-            'link': to_link(req.app.url_path_for, x.path),
+            **get_renditions(req.app.url_path_for, x, library.id),
+            'link': to_link(req.app.url_path_for, x.path, library.id),
             'path': x.path,
             'id': x.id,
             'elo_rating': x.elo_rating,
@@ -48,19 +98,132 @@ async def index():
     return FileResponse(app_ctx.get()['app_config'].static_dir / 'index.html')
 
 
+@root.get('/metrics')
+async def get_metrics():
+    return PlainTextResponse(
+        metrics.REGISTRY.render(), media_type='text/plain; version=0.0.4; charset=utf-8'
+    )
+
+
+def get_profiler() -> Profiler:
+    if profiler := app_ctx.get()['profiler']:
+        return profiler
+    raise HTTPException(404, 'profiling is disabled, set PROFILE=1')
+
+
+def get_recording(recording_id: int, profiler: Profiler = Depends(get_profiler)):
+    if recording := profiler.get(recording_id):
+        return recording
+    raise HTTPException(404, 'recording not found')
+
+
+@root.get('/api/admin/profiles/')
+async def profiles(profiler: Profiler = Depends(get_profiler)):
+    """slow requests, newest last"""
+    return {
+        'success': True,
+        'threshold_ms': profiler.threshold * 1000,
+        'profiles': [x.summary() for x in profiler.recordings],
+    }
+
+
+@root.get('/api/admin/profiles/{recording_id}')
+async def profile(recording=Depends(get_recording)):
+    queries = [{'statement': x, 'duration': round(d, 6)} for x, d in recording.queries]
+    return {'success': True, **recording.summary(), 'sql': queries}
+
+
+@root.get('/api/admin/profiles/{recording_id}/speedscope')
+async def profile_speedscope(recording=Depends(get_recording)):
+    """open in https://www.speedscope.app"""
+    filename = f'profile-{recording.id}.speedscope.json'
+    return JSONResponse(
+        recording.to_speedscope(),
+        headers={'Content-Disposition': f'attachment; filename="{filename}"'},
+    )
+
+
+@root.get('/api/admin/profiles/{recording_id}/pstats')
+async def profile_pstats(recording=Depends(get_recording)):
+    """`python -m pstats profile.pstats`, `snakeviz profile.pstats`"""
+    return Response(
+        recording.to_pstats(),
+        media_type='application/octet-stream',
+        headers={'Content-Disposition': f'attachment; filename="profile-{recording.id}.pstats"'},
+    )
+
+
+@root.get('/api/libraries/')
+async def libraries():
+    return {
+        'success': True,
+        'libraries': [
+            {'id': x.id, 'indexing': x.controller.indexer.progress.dict()}
+            for x in app_ctx.get()['libraries']
+        ],
+    }
+
+
 @root.get('/api/pics/')
-async def pics(req: Request, is_random:bool = False):
-    controller: PicsController = app_ctx.get()['controller']
-    if is_random:
-        images = await controller.get_random_images(num=3)
-    else:
-        images = await controller.get_relative_images(num=3)
-    image_links = get_links(req, images)
+async def pics(
+    req: Request,
+    is_random: bool = False,
+    session: str | None = None,
+    library: Library = Depends(get_library),
+):
+    controller = library.controller
+    with record(app_ctx.get()['profiler'], f'GET /api/pics/ {library.id}'):
+        images = await controller.next_matchup(session, is_random=is_random)
+        image_links = get_links(req, images, library)
     return {
         'success': True,
+        'library': library.id,
         'images': image_links,
         'same_orientation': controller.same_orientation,
         'settings': controller.settings,
+        'indexing': controller.indexer.progress.dict(),
+    }
+
+
+@root.get('/api/rendition/{image_id}', name=RENDITION)
+async def rendition(
+    image_id: int,
+    width: int = DEFAULT_WIDTH,
+    format: str = 'webp',
+    v: str = '',
+    library: Library = Depends(get_library),
+):
+    """
+    resized image, `v` changes with the file so response can be cached for long
+    not `immutable`: edit that keeps size, head, tail, mtime and inode is not seen
+    """
+    if format not in FORMATS:
+        raise HTTPException(400, f'format should be one of {list(FORMATS)}')
+    controller = library.controller
+    try:
+        path = await controller.rendition(image_id, snap_width(width), format)
+    except (OSError, PIL.UnidentifiedImageError) as e:
+        log.warning(f'Cannot render: {image_id=} {e}')
+        path = None
+    if path is None:
+        raise HTTPException(404, 'image not found')
+    headers = {'Cache-Control': f'public, max-age={RENDITION_MAX_AGE}'} if v else {}
+    return FileResponse(path, headers=headers)
+
+
+@root.get('/api/near_duplicates/')
+async def near_duplicates(
+    req: Request, distance: int = 5, num: int = 50, library: Library = Depends(get_library)
+):
+    controller = library.controller
+    max_distance = controller.phash_index.max_distance
+    if not 0 <= distance <= max_distance:
+        raise HTTPException(400, f'distance should be in [0, {max_distance}]')
+    clusters = await controller.get_near_duplicates(distance, num)
+    return {
+        'success': True,
+        'clusters': [get_links(req, cluster, library) for cluster in clusters],
+        'max_distance': max_distance,
     }
 
 
@@ -73,59 +236,58 @@ async def get_html(req: Request):
 
 @root.websocket('/ws')
 async def ws(sock: WebSocket):
+    library = app_ctx.get()['libraries'].get(sock.query_params.get('library'))
+    if library is None:
+        await sock.close(code=4404)
+        return
+    if sock.query_params.get('v', str(PROTOCOL_VERSION)) != str(PROTOCOL_VERSION):
+        await sock.close(code=UNSUPPORTED_VERSION)
+        return
     await sock.accept()
-    await sock.send_json({'type': 'echo'})
-    controller: PicsController = app_ctx.get()['controller']
-
-    try:
-        while True:
-            msg = await sock.receive_json()
-            event = msg.get('event')
-            if event == 'rate':
-                await controller.rate(msg['winner'], msg['loosers'])
-                await sock.send_json({'event': 'rate_success', 'is_random': msg.get('is_random', False)})
-            elif event == 'hide':
-                await controller.hide(msg['image'])
-                await sock.send_json({'event': 'hide_success', 'is_random': msg.get('is_random', False)})
-            elif event == 'toggle_setting':
-                settings = controller.settings
-                current_value = getattr(settings, msg['name'])
-                setattr(settings, msg['name'], not current_value)
-                await sock.send_json({'event': 'update_settings', 'settings': settings.dict()})
-            elif event == 'toggle_orientation':
-                settings = controller.settings
-                controller.same_orientation = (controller.same_orientation + 1) % 3
-                settings.same_orientation = (settings.same_orientation + 1) % 3
-            elif event == 'restore_last':
-                await controller.restore_last()
-                await sock.send_json({'event': 'restore_success', 'is_random': msg.get('is_random', False)})
-            elif event == 'build_top10':
-                await controller.build_top10()
-            elif event == 'add_extra_count':
-                await controller.image_add_extra_count(msg['image'], msg.get('count', 1))
-                await sock.send_json({'event': 'add_extra_count_success'})
-            elif event == 'touch_restart':
-                # touch app.py == __file__
-                Path(__file__).touch()
-    except WebSocketDisconnect:
-        pass
-
-
-async def close_session(controller: PicsController):
-    await controller.db.commit()
-    await controller.db.close()
+    links = partial(get_links, sock, library=library)
+    await Connection(sock, library, links, app_ctx.get()['profiler']).run()
 
 
 def get_app(app_config: AppConfig) -> FastAPI:
-    db = setup_engine(app_config)
-    from .models import async_session
-
-    controller = PicsController(app_config.pics_dir, async_session)
-    app = FastAPI(on_shutdown=[partial(close_session, controller)], on_startup=[controller.setup])
+    libraries = Libraries(app_config)
+    loop_monitor = metrics.LoopMonitor()
+    on_startup = [libraries.start, loop_monitor.start]
+    on_shutdown = [libraries.stop, loop_monitor.stop]
+    profiler = None
+    if app_config.profile:
+        profiler = Profiler(
+            threshold=app_config.profile_threshold_ms / 1000,
+            interval=app_config.profile_interval_ms / 1000,
+            keep=app_config.profile_keep,
+        )
+        for library in libraries:
+            profiler.instrument(library.db.engine.sync_engine)
+            profiler.instrument(library.db.read_engine.sync_engine)
+        on_startup.append(profiler.start)
+        on_shutdown.append(profiler.stop)
+    app = FastAPI(on_shutdown=on_shutdown, on_startup=on_startup)
+    app.add_middleware(metrics.MetricsMiddleware)
+    metrics.register_libraries(libraries)
 
-    app_ctx.set({'dir': app_config.pics_dir, 'controller': controller, 'app_config': app_config})
+    controller = libraries.default.controller
+    app_ctx.set(
+        {
+            'dir': app_config.pics_dir,
+            'controller': controller,
+            'app_config': app_config,
+            'libraries': libraries,
+            'profiler': profiler,
+        }
+    )
     app.controller = controller
+    app.libraries = libraries
+    app.profiler = profiler
     app.mount('/static', StaticFiles(directory=app_config.static_dir), name='static')
-    app.mount('/pics', StaticFiles(directory=app_config.pics_dir), name=DIR)
+    for library in libraries:
+        app.mount(
+            f'/pics/{library.id}',
+            StaticFiles(directory=library.config.pics_dir),
+            name=mount_name(library.id),
+        )
     app.include_router(root)
     return app
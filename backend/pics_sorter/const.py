@@ -4,9 +4,76 @@ from pathlib import Path
 from pydantic import BaseSettings, Field
 
 
+PICS_SUFFIX = {'.jpg', '.jpeg', '.png', '.gif', '.webp', '.jpg_large'}
+TOP_10_DIR = '0_top10'
+OTHER_DIR = '1_other'
+HIDDEN_DIR = '6_hidden'
+RESTORED_DIR = '5_restored'
+GOOD = '1_good'
+BAD = '9_bad'
+LOWER = '3_lower'
+SORT = 'sort'
+DEFAULT_LIBRARY = 'default'
+# service files inside library, not indexed
+CACHE_DIR = '.cache'
+JOURNAL_DIR = '.journal'
+
+
 class AppConfig(BaseSettings):
     static_dir: Path | None = Field('frontend/pics-sorter/build', env='STATIC_DIR')
     pics_dir: Path | None = Field('.', env='PICS_DIR')
+    index_workers: int | None = Field(None, env='INDEX_WORKERS')
+    # hashlib name or xxhash one (xxh3_128) for duplicates detection
+    hash_algo: str = Field('blake2b', env='HASH_ALGO')
+    # max hamming distance between perceptual hashes of near duplicates
+    phash_max_distance: int = Field(7, env='PHASH_MAX_DISTANCE')
+    # resized images for ui, `pics_dir/.cache/renditions` by default
+    rendition_dir: Path | None = Field(None, env='RENDITION_DIR')
+    rendition_cache_mb: int = Field(1024, env='RENDITION_CACHE_MB')
+    rendition_workers: int | None = Field(2, env='RENDITION_WORKERS')
+    # journal ratings and flush them to db in batches instead of commit per click
+    write_behind: bool = Field(True, env='WRITE_BEHIND')
+    # random mode: `uniform` or `shown` to pick less shown images more often
+    random_weighting: str = Field('uniform', env='RANDOM_WEIGHTING')
+    # relative mode: `pivot` or `uncertainty` to spend votes around top 10% cutoff
+    scheduler: str = Field('pivot', env='SCHEDULER')
+    # pragmas profile from `models.SQLITE_PROFILES`
+    sqlite_profile: str = Field('fast', env='SQLITE_PROFILE')
+    sqlite_cache_mb: int = Field(64, env='SQLITE_CACHE_MB')
+    sqlite_mmap_mb: int = Field(256, env='SQLITE_MMAP_MB')
+    # several libraries in one process as json: {"photos": "/data/photos"}
+    # `pics_dir` is served as `default` library when empty
+    libraries: dict[str, Path] = Field({}, env='LIBRARIES')
+    # index files added, moved or deleted while running: inotify with `watchfiles`
+    # installed, polling of dir mtimes otherwise
+    watch: bool = Field(True, env='WATCH')
+    watch_debounce_ms: int = Field(1000, env='WATCH_DEBOUNCE_MS')
+    watch_poll_interval: float = Field(5.0, env='WATCH_POLL_INTERVAL')
+    # threads walking top level dirs of library on scan, helps on network mounts
+    scan_workers: int = Field(8, env='SCAN_WORKERS')
+    # probe chunks in flight per library, so one library can't take whole shared pool
+    index_concurrency: int = Field(4, env='INDEX_CONCURRENCY')
+    # DEBUG logs every query and rating, keep it for development
+    log_level: str = Field('INFO', env='LOG_LEVEL')
+    # sample stacks of ws events and /api/pics/, keep ones slower than threshold
+    profile: bool = Field(False, env='PROFILE')
+    profile_threshold_ms: int = Field(1000, env='PROFILE_THRESHOLD_MS')
+    profile_interval_ms: float = Field(5, env='PROFILE_INTERVAL_MS')
+    profile_keep: int = Field(50, env='PROFILE_KEEP')
+
+    def library_configs(self) -> dict[str, 'AppConfig']:
+        if not self.libraries:
+            return {DEFAULT_LIBRARY: self}
+        return {
+            name: self.copy(
+                update={
+                    'pics_dir': path,
+                    'rendition_dir': self.rendition_dir and self.rendition_dir / name,
+                    'libraries': {},
+                }
+            )
+            for name, path in self.libraries.items()
+        }
 
 
 app_ctx = ContextVar('app_ctx', default={})
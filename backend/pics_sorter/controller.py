@@ -1,44 +1,47 @@
+import asyncio
 import datetime
 import logging
-import random
+import stat
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
 from contextlib import suppress
-from hashlib import sha1
 from pathlib import Path
 from typing import Callable
 
-import PIL.Image
 import pydantic
 from elo import LOSS, rate, WIN
-from pics_sorter.models import Image
+from fan_tools.python import chunks
+from pics_sorter.models import Image, Match
 from pics_sorter.utils import move
-from sqlalchemy import func, text
+from sqlalchemy import func, insert
 from sqlmodel import select
 from sqlmodel.ext.asyncio.session import AsyncSession
 
-from fan_tools.python import chunks
-
-from .const import app_ctx
+from . import metrics
+from .const import (
+    app_ctx,
+    CACHE_DIR,
+    HIDDEN_DIR,
+    JOURNAL_DIR,
+    OTHER_DIR,
+    RESTORED_DIR,
+    TOP_10_DIR,
+)
+from .events import Broadcast, KeyedLocks
+from .hashing import DEFAULT_ALGO
+from .indexer import FileInfo, Indexer, WRITE_CHUNK
+from .layout import LayoutReconciler
+from .matchups import MatchupQueue, MAX_SESSIONS
+from .phash import from_db, HammingIndex
+from .rating_index import orientation_rank, RatingIndex, to_entry
+from .registry import PathRegistry
+from .renditions import RenditionCache, version
+from .scanner import scan, SCAN_WORKERS
+from .watcher import DEBOUNCE, POLL_INTERVAL, Watcher
+from .write_behind import RatingBuffer
 
 
 log = logging.getLogger('controller')
-PICS_SUFFIX = {'.jpg', '.jpeg', '.png', '.gif', '.webp', '.jpg_large'}
-TOP_10_DIR = '0_top10'
-OTHER_DIR = '1_other'
-HIDDEN_DIR = '6_hidden'
-RESTORED_DIR = '5_restored'
-GOOD = '1_good'
-BAD = '9_bad'
-LOWER = '3_lower'
-SORT = 'sort'
-
-
-def image_get_size(image: Path) -> tuple[int, int, str, str]:
-    """Get image size and orientation"""
-    with PIL.Image.open(image) as img:
-        width, height = img.size
-        orientation = 'landscape' if width > height else 'portrait'
-    sha1_sum = sha1(image.read_bytes()).hexdigest()
-    return width, height, orientation, sha1_sum
 
 
 class Settings(pydantic.BaseModel):
@@ -47,179 +50,421 @@ class Settings(pydantic.BaseModel):
 
 
 class PicsController:
-    def __init__(self, path: Path, db: Callable[[], AsyncSession]):
+    def __init__(
+        self,
+        path: Path,
+        db: Callable[[], AsyncSession],
+        index_workers: int | None = None,
+        hash_algo: str = DEFAULT_ALGO,
+        phash_max_distance: int = 7,
+        renditions: RenditionCache | None = None,
+        write_behind: bool = False,
+        read_db: Callable[[], AsyncSession] | None = None,
+        random_weighting: str = 'uniform',
+        scheduler: str = 'pivot',
+        index_pool: ProcessPoolExecutor | None = None,
+        index_concurrency: int | None = None,
+        watch: bool = False,
+        watch_debounce: float = DEBOUNCE,
+        watch_interval: float = POLL_INTERVAL,
+        scan_workers: int = SCAN_WORKERS,
+    ):
         self.session_maker = db
+        # request path reads, separate pool so they do not wait for writes
+        self.read_session_maker = read_db or db
         self.path = path
-        all_images = list(self.get_images())
-        self.all_images = all_images
-        self.all_images_dict = {str(image.relative_to(self.path)): image for image in all_images}
+        self.scan_workers = scan_workers
+        # files on disk, kept in sync with own moves and watcher events
+        self.files = PathRegistry()
         log.info(f'{db=}')
         self.db: AsyncSession = self.session_maker()
         self.same_orientation = 0
         self.settings = Settings()
-
-        random.shuffle(all_images)
-        self.iterator = iter(all_images)
+        # hub of events pushed to every connection: progress, settings, changed images
+        self.events = Broadcast()
+        # indexing, layout, watcher and commands that move files take turns, scanned tree
+        # stays valid until it is reconciled; taken before image locks
+        self.move_lock = asyncio.Lock()
+        # commands on the same image are serialised, shared by every connection
+        self.image_locks = KeyedLocks()
+        # `db` session is shared, concurrent commands take turns using it
+        self.db_lock = asyncio.Lock()
+        self.indexer = Indexer(
+            self,
+            workers=index_workers,
+            hash_algo=hash_algo,
+            pool=index_pool,
+            concurrency=index_concurrency,
+        )
+        self.indexing: asyncio.Task | None = None
+        self.watcher: Watcher | None = None
+        if watch:
+            self.watcher = Watcher(self, debounce=watch_debounce, interval=watch_interval)
+        self.phash_index = HammingIndex(max_distance=phash_max_distance)
+        self.random_weighting = random_weighting
+        self.scheduler = scheduler
+        self.rating_index = RatingIndex(random_weighting, scheduler)
+        self.matchup_queues: OrderedDict[str, MatchupQueue] = OrderedDict()
+        self.renditions = renditions or RenditionCache(path / CACHE_DIR / 'renditions', 2**30)
+        self.layout = LayoutReconciler(self)
+        # rating updates are journaled and flushed to db in batches
+        self.ratings: RatingBuffer | None = None
+        if write_behind:
+            self.ratings = RatingBuffer(path / JOURNAL_DIR, self.session_maker)
+
+    async def start_indexing(self):
+        """
+        index library in background task, pairs are served from already indexed rows
+        """
+        self.indexing = asyncio.create_task(self.setup())
+        self.indexing.add_done_callback(self.indexing_done)
+        self.layout.start()
+        if self.watcher:
+            # events that come during indexing wait until it is done
+            self.watcher.start()
+
+    async def reindex(self):
+        """full rescan in background, in-memory state is kept"""
+        if not self.indexed:
+            return
+        self.indexing = asyncio.create_task(self.index())
+        self.indexing.add_done_callback(self.indexing_done)
+
+    @property
+    def indexed(self) -> bool:
+        return self.indexing is None or self.indexing.done()
+
+    def indexing_done(self, task: asyncio.Task):
+        if not task.cancelled() and (exc := task.exception()):
+            log.exception('Indexing failed', exc_info=exc)
+            self.indexer.report('failed')
+
+    async def stop_indexing(self):
+        if self.indexing and not self.indexing.done():
+            self.indexing.cancel()
+            with suppress(asyncio.CancelledError):
+                await self.indexing
+        if self.watcher:
+            await self.watcher.stop()
+        await self.layout.stop()
+        self.indexer.close()
+        self.renditions.close()
+        if self.ratings:
+            await self.ratings.close()
+
+    async def flush_ratings(self):
+        """writes that read rows from db must see buffered ratings first"""
+        if self.ratings:
+            await self.ratings.flush()
+            # rows loaded before flush keep old paths in identity map
+            self.db.expunge_all()
+
+    def fresh(self, images: list[Image]) -> list[Image]:
+        if self.ratings:
+            self.ratings.apply(images)
+        return images
 
     async def setup(self):
-        for chunk in chunks(self.all_images, 300):
-            for image in chunk:
-                rel_path = str(image.relative_to(self.path))
-                q = select(Image).filter_by(path=rel_path)
-                image = (await self.db.exec(q)).first()
-                if image is None:
-                    try:
-                        width, height, orientation, sha1_hash = image_get_size(self.path / rel_path)
-                    except PIL.UnidentifiedImageError:
-                        continue
-
-                    q = select(Image).filter_by(sha1_hash=sha1_hash)
-                    duplicate_image = (await self.db.exec(q)).first()
-                    duplicate_exists = False
-                    if duplicate_image:
-                        with suppress(OSError):
-                            duplicate_exists = (self.path / duplicate_image.path).exists()
-
-                    if duplicate_image and not duplicate_exists:
-                        log.info(f'Moved image: {duplicate_image.path} => {rel_path}')
-                        image = duplicate_image
-                        image.path = rel_path
-                    elif duplicate_exists:
-                        image = Image(
-                            path=rel_path,
-                            width=width,
-                            height=height,
-                            orientation=orientation,
-                            sha1_hash=sha1_hash,
-                        )
-                        self.db.add(image)
-                        await self.commit()
-                        log.info(f'Hide duplicated: {rel_path=} vs {duplicate_image.path=}')
-                        await self.hide(rel_path)
-                    else:
-                        image = Image(
-                            path=rel_path,
-                            width=width,
-                            height=height,
-                            orientation=orientation,
-                            sha1_hash=sha1_hash,
-                        )
-                    self.db.add(image)
-                elif not image.sha1_hash:
-                    width, height, orientation, sha1_hash = image_get_size(self.path / image.path)
-                    image.sha1_hash = sha1_hash
+        async with self.move_lock:
+            if self.ratings:
+                # journaled moves must get into db before reindex compares paths
+                await self.ratings.recover()
+                self.ratings.start()
+            await self.run_index()
+
+    async def index(self):
+        async with self.move_lock:
+            await self.run_index()
+
+    async def run_index(self):
+        """caller holds `move_lock`"""
+        # buffered ratings and paths must be in db before rows are compared and reloaded
+        async with self.db_lock:
+            await self.flush_ratings()
+        files = await self.indexer.scan()
+        self.files = PathRegistry(files)
+        await self.indexer.run(files)
+        del files
+        self.indexer.report('cleanup')
+        await self.indexer.reconcile(self.files)
+        progress = self.indexer.progress
+        log.info(
+            f'Indexed: {progress.added} added, {progress.moved} moved, '
+            f'{progress.orphaned} orphaned, {progress.duplicates} duplicates'
+        )
+        await self.load_rating_index()
+        self.indexer.report('phash')
+        await self.load_phash_index()
+        self.indexer.report('done')
 
-            await self.commit()
-        last_id = 0
-        while True:
-            q = select(Image).filter(Image.id >= last_id).order_by(Image.id).limit(300)
-            images = (await self.db.exec(q)).all()
-            for image in images:
-                if image.path not in self.all_images_dict:
-                    log.info(f'Delete image: {image.path}')
-                    await self.db.delete(image)
-            if not images:
-                break
-            last_id += 300
-        await self.commit()
+    async def apply_changes(self, rel_paths: set[str]):
+        """
+        index files changed on disk while server runs, paths that match
+        `files` by stat() are skipped: unchanged or moved by app itself
+        """
+        on_disk = await asyncio.to_thread(self.stat_files, rel_paths)
+        files = []
+        gone = set()
+        for rel_path in rel_paths:
+            info = on_disk.get(rel_path)
+            if info == self.files.get(rel_path):
+                continue
+            if info is None:
+                gone.add(rel_path)
+            else:
+                files.append(info)
+        if not (files or gone):
+            return
+        log.info(f'Changes: {len(files)} files changed, {len(gone)} gone')
+        for rel_path in gone:
+            self.files.remove(rel_path)
+        for info in files:
+            self.files.add(info)
+        written, deleted = await self.indexer.update(files, gone)
+        for image_id in deleted:
+            self.rating_index.remove(image_id)
+            self.phash_index.remove(image_id)
+        q = select(
+            Image.id,
+            Image.path,
+            Image.elo_rating,
+            Image.shown_times,
+            Image.extra_count,
+            Image.hidden,
+            Image.orientation,
+            Image.phash,
+        )
+        rows = []
+        async with self.session_maker() as db:
+            for chunk in chunks(written, WRITE_CHUNK):
+                rows.extend((await db.execute(q.filter(Image.path.in_(chunk)))).all())
+        self.sync(*rows)
+        for row in rows:
+            if row.hidden or row.phash is None:
+                self.phash_index.remove(row.id)
+            else:
+                self.phash_index.add(row.id, from_db(row.phash))
+
+    def stat_files(self, rel_paths) -> dict[str, FileInfo]:
+        result = {}
+        for rel_path in rel_paths:
+            try:
+                st = (self.path / rel_path).stat()
+            except OSError:
+                continue
+            if stat.S_ISREG(st.st_mode):
+                result[rel_path] = FileInfo(rel_path, st.st_size, st.st_mtime, st.st_ino)
+        return result
+
+    def track_move(self, old_path: str, new_path: str):
+        """file renamed by app itself, so watcher does not index it again"""
+        self.files.move(old_path, new_path)
+
+    async def load_rating_index(self):
+        q = select(
+            Image.id,
+            Image.path,
+            Image.elo_rating,
+            Image.shown_times,
+            Image.extra_count,
+            Image.hidden,
+            Image.orientation,
+        )
+        async with self.session_maker() as db:
+            rows = (await db.execute(q)).all()
+        rating_index = RatingIndex(self.random_weighting, self.scheduler)
+        # votes buffered while rows were read
+        rating_index.load(self.fresh([to_entry(x) for x in rows]))
+        self.rating_index = rating_index
+        self.invalidate_matchups()
+
+    def sync(self, *images: Image):
+        """propagate changed rating fields to in-memory indexes"""
+        changed = [self.rating_index.sync(image) for image in images]
+        for queue in self.matchup_queues.values():
+            queue.invalidate(changed)
+
+    def toggle_setting(self, name: str):
+        if name not in Settings.__fields__ or name == 'same_orientation':
+            raise ValueError(f'unknown setting: {name}')
+        setattr(self.settings, name, not getattr(self.settings, name))
+        self.publish_settings()
+
+    def toggle_orientation(self):
+        self.same_orientation = (self.same_orientation + 1) % 3
+        self.settings.same_orientation = self.same_orientation
+        self.invalidate_matchups()
+        self.publish_settings()
+
+    def publish_settings(self):
+        self.events.publish({'event': 'update_settings', 'settings': self.settings.dict()})
+
+    def publish_changed(self, *images: Image):
+        """ratings shown by other connections are updated in place"""
+        changed = [
+            {'id': x.id, 'elo_rating': x.elo_rating, 'extra_count': x.extra_count} for x in images
+        ]
+        self.events.publish({'event': 'images_changed', 'images': changed})
+
+    def matchup_queue(self, session: str) -> MatchupQueue:
+        queue = self.matchup_queues.pop(session, None) or MatchupQueue(self)
+        self.matchup_queues[session] = queue
+        while len(self.matchup_queues) > MAX_SESSIONS:
+            self.matchup_queues.popitem(last=False)
+        return queue
+
+    def invalidate_matchups(self):
+        for queue in self.matchup_queues.values():
+            queue.clear()
+
+    async def next_matchup(self, session: str | None, is_random=False, num=3) -> list[Image]:
+        """
+        next images to compare, taken from session queue that is prepared ahead
+        """
+        if is_random:
+            return await self.get_random_images(num=num)
+        if session is None or not self.rating_index.ready:
+            return await self.get_relative_images(num=num)
+        queue = self.matchup_queue(session)
+        queue.num = num
+        return await self.get_by_ids(list(queue.pop()))
+
+    async def load_phash_index(self):
+        """build near duplicates index in a thread, it takes seconds on big libraries"""
+        q = select(Image.id, Image.phash).filter(~Image.hidden, Image.phash.is_not(None))
+        async with self.session_maker() as db:
+            rows = (await db.execute(q)).all()
+
+        def build():
+            index = HammingIndex(max_distance=self.phash_index.max_distance)
+            for image_id, phash in rows:
+                index.add(image_id, from_db(phash))
+            return index
+
+        self.phash_index = await asyncio.to_thread(build)
+        log.info(f'Phash index: {len(self.phash_index)} images')
 
     def get_images(self):
-        for fpath in self.path.rglob('*'):
-            if fpath.is_file() and fpath.suffix.lower() in PICS_SUFFIX:
-                yield fpath
+        return scan(self.path, self.scan_workers)
 
     async def image_add_extra_count(self, img_path: str, count=1):
-        image = await Image.get_by_path(self.db, img_path)
-        if not image:
-            raise NotImplementedError
-        image.extra_count += count
-        await self.commit()
+        async with self.image_locks.hold([img_path]), self.db_lock:
+            await self.flush_ratings()
+            image = await Image.get_by_path(self.db, img_path)
+            if not image:
+                raise NotImplementedError
+            image.extra_count += count
+            self.sync(image)
+            self.publish_changed(image)
+            await self.commit()
 
     async def get_images_around_pivot(self, db, pivot, num=2):
-        diff = text(f'abs(elo_rating - {pivot.elo_rating})')
-        order_by = [diff, Image.shown_times.asc(), Image.elo_rating.desc()]
-        if self.same_orientation:
-            if self.same_orientation == 1:
-                order_by.append(Image.orientation.asc())
-            else:
-                order_by.append(Image.orientation.desc())
-        q = (
-            select(Image)
-            .filter(Image.extra_count == 0, ~Image.hidden, Image.path != pivot.path)
-            .order_by(*order_by)
-            .limit(num)
+        """nearest ratings below and above pivot, merged as if ordered by abs(diff)"""
+        images = []
+        for up in (True, False):
+            q = Image.around_query(pivot, num, up, self.same_orientation)
+            images.extend((await db.exec(q)).all())
+        images.sort(
+            key=lambda x: (
+                abs(x.elo_rating - pivot.elo_rating),
+                x.shown_times,
+                -x.elo_rating,
+                orientation_rank(self.same_orientation, x.orientation),
+            )
         )
-        images = (await db.exec(q)).all()
-        return images
+        return images[:num]
 
     async def get_random_images(self, num) -> list[Image]:
-        async with self.session_maker() as db:
-            q = (
-                select(Image)
-                .filter(Image.extra_count == 0, ~Image.hidden)
-                .order_by(func.random())
-                .limit(num)
-            )
-            images = (await db.exec(q)).all()
-            return images
+        if self.rating_index.ready:
+            return await self.get_by_ids(self.rating_index.sampler.sample(num))
+        async with self.read_session_maker() as db:
+            ids = (await db.exec(Image.random_ids_query(num))).all()
+        return await self.get_by_ids(ids)
+
+    async def get_by_ids(self, ids: list[int]) -> list[Image]:
+        """images in the same order as `ids`"""
+        async with self.read_session_maker() as db:
+            images = (await db.exec(select(Image).filter(Image.id.in_(ids)))).all()
+        by_id = {image.id: image for image in self.fresh(images)}
+        return [by_id[x] for x in ids if x in by_id]
+
+    async def rendition(self, image_id: int, width: int, fmt: str) -> Path | None:
+        """resized image, original is returned for images without fingerprint yet"""
+        images = await self.get_by_ids([image_id])
+        if not images:
+            return None
+        image = images[0]
+        src = self.path / image.path
+        if not image.fingerprint:
+            return src
+        content = version(image.fingerprint, image.mtime, image.inode)
+        return await self.renditions.get(src, content, width, fmt)
 
     async def get_relative_images(self, num) -> list[Image]:
         """
         if have extra_count = select 1 image
         and select rest with similar elo score and lowest_count
         """
-        async with self.session_maker() as db:
-            q = (
-                select(Image)
-                .filter(Image.extra_count > 0)
-                .order_by(Image.extra_count.desc(), Image.shown_times.asc())
-                .limit(1)
-            )
-            pivot = (await db.exec(q)).all()
-
-            if pivot:
-                pivot = pivot[0]
-            else:
+        if self.rating_index.ready:
+            images = self.rating_index.scheduler.matchup(num, self.same_orientation)
+            return await self.get_by_ids([x.id for x in images])
+
+        # rating index is loaded after indexing
+        async with self.read_session_maker() as db:
+            pivot = (await db.exec(Image.extra_pivot_query())).first()
+            if pivot is None:
                 # select images with lowest shown_times
-                order_by = [Image.shown_times.asc(), Image.elo_rating.desc()]
-                if self.same_orientation:
-                    if self.same_orientation == 1:
-                        order_by.append(Image.orientation.asc())
-                    else:
-                        order_by.append(Image.orientation.desc())
-                q = (
-                    select(Image)
-                    .filter(Image.extra_count == 0, ~Image.hidden)
-                    .order_by(*order_by)
-                    .limit(1)
-                )
-                pivot = (await db.exec(q)).all()[0]
-            images = await self.get_images_around_pivot(db, pivot)
+                pivot = (await db.exec(Image.pivot_query(self.same_orientation))).first()
+                if pivot is None:
+                    # nothing indexed yet
+                    return []
+            images = await self.get_images_around_pivot(db, pivot, num - 1)
             images.append(pivot)
             return images
 
     async def get_duplicated_images(self, num):
+        await self.flush_ratings()
         q = (
-            select(Image.sha1_hash)
+            select(Image.content_hash)
             .filter(~Image.hidden)
             .limit(num)
-            .group_by(Image.sha1_hash)
-            .having(func.count(Image.sha1_hash) > 1)
+            .group_by(Image.content_hash)
+            .having(func.count(Image.content_hash) > 1)
         )
         bad_hashes = [x[0] for x in (await self.db.exec(q)).all()]
         q = (
             select(Image)
-            .filter(~Image.hidden, Image.sha1_hash.in_(bad_hashes))
-            .order_by(Image.sha1_hash)
+            .filter(~Image.hidden, Image.content_hash.in_(bad_hashes))
+            .order_by(Image.content_hash)
             .limit(num)
         )
         images = (await self.db.exec(q)).all()
         return images
 
+    async def get_near_duplicates(self, distance: int, num: int) -> list[list[Image]]:
+        """clusters of visually similar images, biggest first"""
+        clusters = self.phash_index.clusters(distance)[:num]
+        ids = [image_id for cluster in clusters for image_id in cluster]
+        async with self.session_maker() as db:
+            images = (await db.exec(select(Image).filter(Image.id.in_(ids)))).all()
+        by_id = {image.id: image for image in images}
+        return [[by_id[x] for x in cluster if x in by_id] for cluster in clusters]
+
     async def rate(self, winner: str, loosers: list[str]):
         log.debug(f'{winner=} {loosers=}')
-        q = select(Image).filter(Image.path.in_(loosers + [winner]))
-        images = (await self.db.exec(q)).all()
+        async with self.image_locks.hold([winner, *loosers]):
+            if self.ratings is not None and self.rating_index.ready:
+                await self.apply_rating(winner, loosers, buffered=True)
+            else:
+                async with self.db_lock:
+                    await self.apply_rating(winner, loosers, buffered=False)
+
+    async def apply_rating(self, winner: str, loosers: list[str], buffered: bool):
+        if buffered:
+            images = self.rating_index.copy_by_paths([winner, *loosers])
+        else:
+            q = select(Image).filter(Image.path.in_(loosers + [winner]))
+            images = (await self.db.exec(q)).all()
         loosers = []
         winner_obj = None
 
@@ -233,49 +478,71 @@ class PicsController:
                 image.extra_count -= 1
             else:
                 image.shown_times += 1
+        if self.rating_index.ready:
+            # before ratings change, vote is most informative when they are close
+            self.rating_index.scheduler.observe(winner_obj, loosers)
         updates = []
         for looser in loosers:
             updates.append([looser, rate(looser.elo_rating, [(LOSS, winner_obj.elo_rating)])])
         winner_before = winner_obj.elo_rating
 
         new_rating = rate(winner_obj.elo_rating, [(WIN, looser.elo_rating) for looser in loosers])
-        await self.new_elo(winner_obj, new_rating)
+        self.new_elo(winner_obj, new_rating)
         for obj, new_rating in updates:
-            await self.new_elo(obj, new_rating)
+            self.new_elo(obj, new_rating)
         log.debug(f'{winner_before} => {winner_obj.elo_rating=}')
-        await self.commit()
+        self.sync(*images)
+        self.publish_changed(*images)
+        matches = [Match.record(winner_obj.id, [x.id for x in loosers])] if loosers else []
+        if buffered:
+            await self.ratings.add(images, matches)
+        else:
+            if matches:
+                await self.db.execute(insert(Match), matches)
+            await self.commit()
 
-    async def new_elo(self, img, new_rating):
+    def new_elo(self, img, new_rating):
+        """tier dir is updated later by layout reconciler"""
         img.elo_rating = new_rating
-        if img.elo_rating > 1200:
-            if not img.path.startswith((TOP_10_DIR, GOOD)):
-                await self.move(img, GOOD)
-        elif img.elo_rating < 1150:
-            if not img.path.startswith(BAD):
-                await self.move(img, BAD)
-        elif img.elo_rating < 1200:
-            if not img.path.startswith(LOWER):
-                await self.move(img, LOWER)
-        img.updated_at = datetime.datetime.now()
+        self.layout.mark(img.id)
+        if isinstance(img, Image):
+            img.updated_at = datetime.datetime.now()
 
     async def hide(self, path: str):
         """
         TODO: move into 6_hidden directory
         """
-        log.debug(f'Hide: {path=} {app_ctx.get()=}')
-        if image := (await self.db.exec(select(Image).filter_by(path=path))).first():
-            image.hidden = True
-            await self.move(image, HIDDEN_DIR)
+        # path is locked before it is looked up, so layout cannot rename the file meanwhile
+        async with self.move_lock, self.image_locks.hold([path]), self.db_lock:
+            await self.flush_ratings()
+            log.debug(f'Hide: {path=} {app_ctx.get()=}')
+            if image := (await self.db.exec(select(Image).filter_by(path=path))).first():
+                image.hidden = True
+                self.sync(image)
+                self.phash_index.remove(image.id)
+                self.events.publish({'event': 'images_hidden', 'ids': [image.id]})
+                await self.move(image, HIDDEN_DIR)
 
     async def restore_last(self):
-        q = select(Image).filter_by(hidden=True).order_by(Image.updated_at.desc()).limit(1)
-        last = (await self.db.exec(q)).first()
-        if last:
+        async with self.db_lock:
+            await self.flush_ratings()
+            last = (await self.db.exec(Image.last_hidden_query())).first()
+        if last is None:
+            return
+        # locks are taken in the same order as everywhere else
+        async with self.move_lock, self.image_locks.hold([last.path]), self.db_lock:
+            last = await self.db.get(Image, last.id, populate_existing=True)
+            if last is None or not last.hidden:
+                return
             log.debug(f'Restore: {last.path}')
             last.hidden = False
+            self.sync(last)
+            if last.phash is not None:
+                self.phash_index.add(last.id, from_db(last.phash))
             await self.move(last, RESTORED_DIR)
 
     async def move(self, img: Image, dst: str | Path):
+        """caller holds `move_lock`, image lock of `img.path` and `db_lock`"""
         if isinstance(dst, str):
             dst = self.path / dst
             dst.mkdir(exist_ok=True, parents=True)
@@ -287,26 +554,27 @@ class PicsController:
 
         old_path = img.path
         new_path = move(self.path / img.path, dst)
+        metrics.file_moves.inc(dst.name, 'ok')
         img.path = str(new_path.relative_to(self.path))
+        self.track_move(old_path, img.path)
         img.updated_at = datetime.datetime.now()
+        self.sync(img)
         self.db.add(img)
         await self.commit()
         log.debug(f'Moved: {old_path} => {new_path}')
 
     async def commit(self):
+        """session is reused, identity map is dropped as rows are changed by other sessions"""
         await self.db.commit()
-        self.db = self.session_maker()
+        self.db.expunge_all()
 
     async def build_top10(self):
-        top10_new = await Image.get_top_n_query(self.db, n=15)
-        top10_curr = await Image.get_in_dir(self.db, TOP_10_DIR)
-
-        for img in top10_new:
-            if img in top10_curr:
-                continue
-            log.debug(f'Move: {img}')
-            await self.move(img, TOP_10_DIR)
-        for img in top10_curr:
-            if img in top10_new:
-                continue
-            await self.move(img, OTHER_DIR)
+        """top 10% is kept by rating index, only images that entered or left it are moved"""
+        if not self.rating_index.ready:
+            log.warning('Cannot build top10 before indexing is done')
+            return
+        entering, leaving = self.rating_index.top.diff()
+        moves = [(x, TOP_10_DIR) for x in entering]
+        moves.extend((x, OTHER_DIR) for x in leaving)
+        log.debug(f'Top10: {len(moves)} moves')
+        await self.layout.apply(moves)
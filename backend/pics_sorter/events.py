@@ -0,0 +1,68 @@
+import asyncio
+import logging
+from collections import Counter
+from contextlib import asynccontextmanager, contextmanager
+
+
+log = logging.getLogger('events')
+
+
+class Broadcast:
+    """
+    Fan-out of server side events to every subscriber (websocket connection).
+    Slow subscribers lose their oldest events instead of blocking publisher.
+    """
+
+    def __init__(self, maxsize: int = 100):
+        self.maxsize = maxsize
+        self.queues: set[asyncio.Queue] = set()
+
+    @contextmanager
+    def subscribe(self):
+        queue = asyncio.Queue(self.maxsize)
+        self.queues.add(queue)
+        try:
+            yield queue
+        finally:
+            self.queues.discard(queue)
+
+    def publish(self, msg: dict):
+        for queue in self.queues:
+            if queue.full():
+                log.debug(f'Drop event: {queue.get_nowait()}')
+            queue.put_nowait(msg)
+
+
+class KeyedLocks:
+    """
+    Mutual exclusion per key (image path): commands on different images run concurrently,
+    commands on the same image run in arrival order. Keys are taken in sorted order, so
+    commands with overlapping keys cannot deadlock. Locks nobody waits for are dropped.
+    """
+
+    def __init__(self):
+        self.locks: dict[str, asyncio.Lock] = {}
+        self.users: Counter = Counter()
+
+    def __len__(self):
+        return len(self.locks)
+
+    @asynccontextmanager
+    async def hold(self, keys):
+        keys = sorted({x for x in keys if x is not None})
+        self.users.update(keys)
+        held = []
+        try:
+            for key in keys:
+                lock = self.locks.setdefault(key, asyncio.Lock())
+                await lock.acquire()
+                held.append(lock)
+            yield
+        finally:
+            for lock in held:
+                lock.release()
+            for key in keys:
+                self.users[key] -= 1
+                if not self.users[key]:
+                    del self.users[key]
+                    self.locks.pop(key, None)
@@ -0,0 +1,51 @@
+import hashlib
+from pathlib import Path
+
+
+DEFAULT_ALGO = 'blake2b'
+# read buffer for full file hash, memory use does not depend on file size
+BUF_SIZE = 1 << 20
+# bytes from start and end of file used in fingerprint
+EDGE_SIZE = 16 * 1024
+
+
+def new_hasher(algo: str):
+    """
+    hashlib algorithm name or xxhash one (xxh64, xxh3_128...) if `xxhash` is installed
+    """
+    if algo.startswith('xxh'):
+        import xxhash
+
+        return getattr(xxhash, algo)()
+    return hashlib.new(algo)
+
+
+def hash_file(path: Path, algo: str = DEFAULT_ALGO) -> str:
+    """
+    streaming hash of full file content, prefixed with algorithm name
+    so hashes of different algorithms never match
+    """
+    hasher = new_hasher(algo)
+    buf = bytearray(BUF_SIZE)
+    view = memoryview(buf)
+    with open(path, 'rb') as f:
+        while size := f.readinto(buf):
+            hasher.update(view[:size])
+    return f'{algo}:{hasher.hexdigest()}'
+
+
+def fingerprint(path: Path) -> str:
+    """
+    cheap pre-filter for duplicates: file size + first and last EDGE_SIZE bytes
+    only files with the same fingerprint need full hash to be compared
+    """
+    hasher = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as f:
+        size = f.seek(0, 2)
+        hasher.update(size.to_bytes(8, 'little'))
+        f.seek(0)
+        hasher.update(f.read(EDGE_SIZE))
+        if size > EDGE_SIZE:
+            f.seek(max(EDGE_SIZE, size - EDGE_SIZE))
+            hasher.update(f.read(EDGE_SIZE))
+    return hasher.hexdigest()
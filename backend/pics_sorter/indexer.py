@@ -0,0 +1,472 @@
+import asyncio
+import logging
+import multiprocessing
+import time
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+from pathlib import Path
+from typing import NamedTuple, TYPE_CHECKING
+
+import PIL.Image
+import pydantic
+from pics_sorter.models import Image
+from pics_sorter.utils import move
+from sqlalchemy import bindparam, delete, insert, select, update
+from sqlalchemy.engine import Row
+
+from fan_tools.python import chunks
+
+from . import metrics
+from .const import HIDDEN_DIR
+from .hashing import DEFAULT_ALGO, fingerprint, hash_file, new_hasher
+from .phash import dhash, to_db
+
+
+if TYPE_CHECKING:
+    from .controller import PicsController
+    from .registry import PathRegistry
+
+
+log = logging.getLogger('indexer')
+# paths sent to a worker process in one task
+PROBE_CHUNK = 64
+# rows written per transaction
+WRITE_CHUNK = 5000
+# files taken from directory walk between progress updates
+SCAN_CHUNK = 2000
+# min seconds between progress events
+PROGRESS_INTERVAL = 0.5
+
+
+def image_get_size(image: Path) -> tuple[int, int, str, str, int | None]:
+    """Get image size, orientation, content fingerprint and perceptual hash"""
+    with PIL.Image.open(image) as img:
+        width, height = img.size
+        orientation = 'landscape' if width > height else 'portrait'
+        try:
+            phash = dhash(img)
+        except OSError as e:
+            log.debug(f'Cannot decode: {image} {e}')
+            phash = None
+    return width, height, orientation, fingerprint(image), phash
+
+
+class FileInfo(NamedTuple):
+    path: str
+    size: int
+    mtime: float
+    inode: int
+
+
+def manifest(info: FileInfo) -> dict:
+    return {'size': info.size, 'mtime': info.mtime, 'inode': info.inode}
+
+
+def manifest_changed(row: Row, info: FileInfo) -> bool:
+    return (row.size, row.mtime, row.inode) != (info.size, info.mtime, info.inode)
+
+
+def probe_images(root: Path, rel_paths: list[str]) -> list[tuple[str, tuple | None]]:
+    """
+    runs in worker process: decode headers and fingerprint files
+    unreadable/unknown files are returned with `None` info
+    """
+    result = []
+    for rel_path in rel_paths:
+        try:
+            info = image_get_size(root / rel_path)
+        except (PIL.UnidentifiedImageError, OSError) as e:
+            log.debug(f'Cannot probe: {rel_path} {e}')
+            info = None
+        result.append((rel_path, info))
+    return result
+
+
+def hash_images(root: Path, rel_paths: list[str], algo: str) -> list[tuple[str, str | None]]:
+    """runs in worker process: full content hash"""
+    result = []
+    for rel_path in rel_paths:
+        try:
+            result.append((rel_path, hash_file(root / rel_path, algo)))
+        except OSError as e:
+            log.debug(f'Cannot hash: {rel_path} {e}')
+            result.append((rel_path, None))
+    return result
+
+
+class IndexProgress(pydantic.BaseModel):
+    stage: str = 'idle'
+    scanned: int = 0
+    to_probe: int = 0
+    probed: int = 0
+    hashed: int = 0
+    inserted: int = 0
+    updated: int = 0
+    # new rows, rows of renamed files, hidden duplicates and rows of files gone from disk
+    added: int = 0
+    moved: int = 0
+    duplicates: int = 0
+    orphaned: int = 0
+    # probed files per second
+    rate: float = 0
+    started_at: float = 0
+    elapsed: float = 0
+
+    @property
+    def done(self) -> bool:
+        return self.stage in ('idle', 'done', 'failed')
+
+
+class Indexer:
+    """
+    Sync `images` table with files on disk.
+
+    All known rows are fetched in one query. Files with unchanged size/mtime/inode are
+    skipped, renames are matched by inode or by fingerprint. New and changed files are
+    probed in a process pool and written back with bulk inserts/updates.
+    Full content hash is computed only for files with colliding fingerprints.
+    """
+
+    def __init__(
+        self,
+        controller: 'PicsController',
+        workers: int | None = None,
+        hash_algo: str = DEFAULT_ALGO,
+        pool: ProcessPoolExecutor | None = None,
+        concurrency: int | None = None,
+    ):
+        self.controller = controller
+        self.workers = workers
+        new_hasher(hash_algo)
+        self.hash_algo = hash_algo
+        # pool shared between libraries is closed by its owner
+        self._pool = pool
+        self.owns_pool = pool is None
+        # chunks submitted to pool at once, unlimited for own pool
+        self.concurrency = concurrency
+        self.progress = IndexProgress()
+        self._published_at = 0.0
+        # paths duplicates were moved to by `hide` during current run
+        self.hidden: list[str] = []
+
+    @property
+    def path(self) -> Path:
+        return self.controller.path
+
+    @property
+    def pool(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            ctx = multiprocessing.get_context('spawn')
+            self._pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=ctx)
+        return self._pool
+
+    def close(self):
+        if self._pool is not None and self.owns_pool:
+            self._pool.shutdown(cancel_futures=True)
+            self._pool = None
+
+    def report(self, stage: str | None = None, force=False):
+        """publish progress event, throttled unless stage changes"""
+        progress = self.progress
+        if stage:
+            force = force or stage != progress.stage
+            progress.stage = stage
+        now = time.monotonic()
+        if not force and now - self._published_at < PROGRESS_INTERVAL:
+            return
+        self._published_at = now
+        progress.elapsed = now - progress.started_at
+        if progress.elapsed > 0:
+            progress.rate = round(progress.probed / progress.elapsed, 1)
+        self.controller.events.publish({'event': 'index_progress', 'progress': progress.dict()})
+
+    async def scan(self) -> list[FileInfo]:
+        """walk library in a thread to keep event loop responsive"""
+        self.progress = IndexProgress(started_at=time.monotonic())
+        self.report('scan')
+        files = []
+        walk = self.controller.get_images()
+        while batch := await asyncio.to_thread(list, islice(walk, SCAN_CHUNK)):
+            files.extend(batch)
+            self.progress.scanned = len(files)
+            self.report()
+        return files
+
+    async def probe(self, rel_paths: list[str], func=probe_images, *args):
+        """yield probed chunks as soon as worker returns them"""
+        loop = asyncio.get_running_loop()
+        limit = asyncio.Semaphore(self.concurrency or len(rel_paths) or 1)
+
+        async def run(chunk):
+            async with limit:
+                return await loop.run_in_executor(self.pool, func, self.path, chunk, *args)
+
+        tasks = [asyncio.ensure_future(run(x)) for x in chunks(rel_paths, PROBE_CHUNK)]
+        try:
+            for task in asyncio.as_completed(tasks):
+                yield await task
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def hash(self, rel_paths: list[str]) -> dict[str, str]:
+        hashes = {}
+        async for hashed in self.probe(rel_paths, hash_images, self.hash_algo):
+            hashes.update((rel_path, x) for rel_path, x in hashed if x)
+            self.progress.hashed += len(hashed)
+            self.report()
+        return hashes
+
+    async def load_known(self, column=None, values=None) -> dict[str, Row]:
+        """returns {path: row} for every image in db or only for rows with `column` in `values`"""
+        q = select(
+            Image.id,
+            Image.path,
+            Image.fingerprint,
+            Image.content_hash,
+            Image.phash,
+            Image.phash_failed,
+            Image.size,
+            Image.mtime,
+            Image.inode,
+        )
+        async with self.controller.session_maker() as db:
+            if column is None:
+                rows = (await db.execute(q)).all()
+            else:
+                rows = []
+                for chunk in chunks(list(values), WRITE_CHUNK):
+                    rows.extend((await db.execute(q.where(column.in_(chunk)))).all())
+        return {row.path: row for row in rows}
+
+    async def run(self, files: list[FileInfo], gone: set[str] | None = None):
+        """
+        `files` are all files of library, or only changed ones when `gone` paths are
+        given: then rows are loaded only for these paths and for fingerprints of probed
+        files, and renames are matched only against `gone` ones
+        """
+        if gone is None:
+            known = await self.load_known()
+            on_disk = {x.path for x in files}
+            orphans = {path: row for path, row in known.items() if path not in on_disk}
+        else:
+            known = await self.load_known(Image.path, [*(x.path for x in files), *gone])
+            orphans = {path: row for path, row in known.items() if path in gone}
+        by_inode = {(row.inode, row.size, row.mtime): path for path, row in orphans.items()}
+        by_fingerprint = {row.fingerprint: path for path, row in known.items() if row.fingerprint}
+
+        to_update = []
+        to_probe = {}
+        for info in files:
+            row = known.get(info.path)
+            if row is None:
+                if renamed := by_inode.pop((info.inode, info.size, info.mtime), None):
+                    log.info(f'Moved image: {renamed} => {info.path}')
+                    row = orphans.pop(renamed)
+                    to_update.append({'_id': row.id, 'path': info.path})
+                    self.progress.moved += 1
+                    if row.fingerprint:
+                        by_fingerprint[row.fingerprint] = info.path
+                else:
+                    to_probe[info.path] = info
+            elif (
+                not row.fingerprint
+                or (row.phash is None and not row.phash_failed)
+                or (row.size is not None and manifest_changed(row, info))
+            ):
+                to_probe[info.path] = info
+            elif manifest_changed(row, info):
+                # indexed before manifest was stored
+                to_update.append({'_id': row.id, **manifest(info)})
+        log.info(
+            f'Index: {len(files)} files, {len(to_probe)} to probe, {len(to_update)} to update'
+        )
+        self.progress.to_probe = len(to_probe)
+        self.report('probe')
+
+        to_insert = []
+        # fingerprint => [(rel_path, values)] of new files that need full hash
+        collisions = defaultdict(list)
+        async for probed in self.probe(list(to_probe)):
+            self.progress.probed += len(probed)
+            self.report()
+            if gone is not None:
+                fingerprints = {x[3] for _, x in probed if x} - by_fingerprint.keys()
+                for path, row in (await self.load_known(Image.fingerprint, fingerprints)).items():
+                    known.setdefault(path, row)
+                    by_fingerprint.setdefault(row.fingerprint, path)
+            for rel_path, probe_info in probed:
+                if probe_info is None:
+                    continue
+                info = to_probe[rel_path]
+                width, height, orientation, fp, phash = probe_info
+                values = {
+                    'width': width,
+                    'height': height,
+                    'orientation': orientation,
+                    'fingerprint': fp,
+                    'content_hash': None,
+                    'phash': None if phash is None else to_db(phash),
+                    'phash_failed': phash is None,
+                    **manifest(info),
+                }
+                if row := known.get(rel_path):
+                    # changed in place or not fingerprinted yet
+                    to_update.append({'_id': row.id, **values})
+                    continue
+
+                same_path = by_fingerprint.get(fp)
+                if same_path in orphans and orphans[same_path].size in (None, info.size):
+                    log.info(f'Moved image: {same_path} => {rel_path}')
+                    row = orphans.pop(same_path)
+                    to_update.append({'_id': row.id, 'path': rel_path, **manifest(info)})
+                    by_fingerprint[fp] = rel_path
+                    self.progress.moved += 1
+                elif same_path:
+                    collisions[fp].append((rel_path, values))
+                else:
+                    by_fingerprint[fp] = rel_path
+                    to_insert.append({'path': rel_path, 'hidden': False, **values})
+                    self.progress.added += 1
+            if len(to_insert) + len(to_update) >= WRITE_CHUNK:
+                await self.write(to_insert, to_update)
+                to_insert, to_update = [], []
+        await self.write(to_insert, to_update)
+        await self.resolve_collisions(collisions, by_fingerprint, known)
+
+    async def resolve_collisions(
+        self,
+        collisions: dict[str, list[tuple[str, dict]]],
+        by_fingerprint: dict[str, str],
+        known: dict[str, Row],
+    ):
+        """
+        compare full hashes of files with the same fingerprint, hide duplicates
+        """
+        if not collisions:
+            return
+        self.report('hash')
+        hashes = {path: row.content_hash for path, row in known.items() if row.content_hash}
+        to_hash = [
+            path
+            for fp, new_files in collisions.items()
+            for path in [by_fingerprint[fp], *(rel_path for rel_path, _ in new_files)]
+            if path not in hashes
+        ]
+        hashes.update(await self.hash(to_hash))
+
+        to_insert = []
+        to_update = []
+        for fp, new_files in collisions.items():
+            first_path = by_fingerprint[fp]
+            if first_path in to_hash and first_path in hashes:
+                if first_path in known:
+                    key = {'_id': known[first_path].id}
+                else:
+                    key = {'_path': first_path}
+                to_update.append({**key, 'content_hash': hashes[first_path]})
+            seen = {hashes.get(first_path): first_path}
+            for rel_path, values in new_files:
+                content_hash = hashes.get(rel_path)
+                hidden = False
+                if content_hash and content_hash in seen:
+                    log.info(f'Hide duplicated: {rel_path=} vs {seen[content_hash]=}')
+                    rel_path = self.hide(rel_path)
+                    hidden = True
+                    self.progress.duplicates += 1
+                else:
+                    seen[content_hash] = rel_path
+                    self.progress.added += 1
+                to_insert.append(
+                    {**values, 'path': rel_path, 'hidden': hidden, 'content_hash': content_hash}
+                )
+        await self.write(to_insert, to_update)
+
+    def hide(self, rel_path: str) -> str:
+        """move duplicate into hidden dir before it gets into db"""
+        dst = self.path / HIDDEN_DIR
+        dst.mkdir(exist_ok=True)
+        new_path = str(move(self.path / rel_path, dst).relative_to(self.path))
+        metrics.file_moves.inc('duplicate', 'ok')
+        self.controller.track_move(rel_path, new_path)
+        self.hidden.append(new_path)
+        return new_path
+
+    async def update(self, files: list[FileInfo], gone: set[str]) -> tuple[list[str], list[int]]:
+        """
+        index changed files and delete rows of `gone` ones that were not renamed,
+        returns (paths of written rows, ids of deleted rows)
+        """
+        self.progress = IndexProgress(started_at=time.monotonic(), scanned=len(files))
+        self.hidden = []
+        await self.run(files, gone)
+        deleted = await self.delete(gone)
+        self.report('done')
+        return [*(x.path for x in files), *self.hidden], deleted
+
+    async def delete(self, paths: set[str]) -> list[int]:
+        ids = []
+        async with self.controller.session_maker() as db:
+            for chunk in chunks(list(paths), WRITE_CHUNK):
+                q = select(Image.id).where(Image.path.in_(chunk))
+                ids.extend((await db.execute(q)).scalars().all())
+        await self.delete_ids(ids)
+        return ids
+
+    async def reconcile(self, files: 'PathRegistry') -> list[int]:
+        """
+        delete rows of files that are not on disk anymore, returns their ids
+        (id, path) pairs are streamed in one query and checked against `files`
+        """
+        orphans = []
+        q = select(Image.id, Image.path).execution_options(yield_per=WRITE_CHUNK)
+        async with self.controller.session_maker() as db:
+            async for image_id, path in await db.stream(q):
+                if path not in files:
+                    log.debug(f'Orphaned image: {path}')
+                    orphans.append(image_id)
+        await self.delete_ids(orphans)
+        return orphans
+
+    async def delete_ids(self, ids: list[int]):
+        if not ids:
+            return
+        async with self.controller.session_maker() as db:
+            for chunk in chunks(ids, WRITE_CHUNK):
+                await db.execute(delete(Image).where(Image.id.in_(chunk)))
+            await db.commit()
+        self.progress.orphaned += len(ids)
+        self.report()
+
+    async def write(self, to_insert: list[dict], to_update: list[dict]):
+        """
+        bulk insert and update rows in one transaction
+        updates are grouped by set of updated columns, `_id` or `_path` is required
+        """
+        if not (to_insert or to_update):
+            return
+        by_columns = defaultdict(list)
+        for values in to_update:
+            by_columns[tuple(sorted(values))].append(values)
+
+        async with self.controller.session_maker() as db:
+            for columns, rows in by_columns.items():
+                if '_id' in columns:
+                    where = Image.id == bindparam('_id')
+                else:
+                    where = Image.path == bindparam('_path')
+                q = (
+                    update(Image)
+                    .where(where)
+                    .values({x: bindparam(x) for x in columns if not x.startswith('_')})
+                )
+                for chunk in chunks(rows, WRITE_CHUNK):
+                    await db.execute(q, chunk)
+            for chunk in chunks(to_insert, WRITE_CHUNK):
+                await db.execute(insert(Image), chunk)
+            await db.commit()
+        self.progress.inserted += len(to_insert)
+        self.progress.updated += len(to_update)
+        self.report()
+        log.debug(f'Written: inserted={len(to_insert)} updated={len(to_update)}')
@@ -0,0 +1,199 @@
+import asyncio
+import logging
+import time
+from contextlib import suppress
+from pathlib import Path
+from typing import TYPE_CHECKING
+
+from pics_sorter.models import Image
+from pics_sorter.utils import move
+from sqlalchemy import bindparam, update
+
+from . import metrics
+from .const import BAD, GOOD, LOWER, TOP_10_DIR
+from .rating_index import RatedImage, to_entry
+
+
+if TYPE_CHECKING:
+    from .controller import PicsController
+
+
+log = logging.getLogger('layout')
+GOOD_EDGE = 1200
+BAD_EDGE = 1150
+# rating has to cross edge by this margin to move image out of its tier dir
+MARGIN = 10
+# image is moved after it was not rated for this number of seconds
+DEBOUNCE = 5.0
+# image is moved at most once in this number of seconds
+COOLDOWN = 600.0
+INTERVAL = 1.0
+TIERS = (GOOD, LOWER, BAD, TOP_10_DIR)
+
+
+def tier_of(path: str) -> str | None:
+    top, sep, _ = path.partition('/')
+    return top if sep and top in TIERS else None
+
+
+def target_tier(path: str, elo_rating: float, margin: float = MARGIN) -> str | None:
+    """tier dir image should be moved to, `None` keeps it in place"""
+    current = tier_of(path)
+    if current is None:
+        margin = 0
+    zone = GOOD if current == TOP_10_DIR else current
+    good_edge = GOOD_EDGE - margin if zone == GOOD else GOOD_EDGE + margin
+    bad_edge = BAD_EDGE + margin if zone == BAD else BAD_EDGE - margin
+    if elo_rating > good_edge:
+        tier = GOOD
+    elif elo_rating < bad_edge:
+        tier = BAD
+    elif elo_rating < good_edge:
+        tier = LOWER
+    else:
+        return None
+    return None if tier == zone else tier
+
+
+def rename_all(root: Path, moves: list[tuple[str, str]]) -> list[str | None]:
+    """runs in thread: new relative paths, `None` for files that cannot be moved"""
+    result = []
+    for rel_path, dst in moves:
+        dst_dir = root / dst
+        try:
+            dst_dir.mkdir(exist_ok=True)
+            result.append(str(move(root / rel_path, dst_dir).relative_to(root)))
+        except OSError as e:
+            log.warning(f'Cannot move: {rel_path} => {dst} {e}')
+            result.append(None)
+    return result
+
+
+class LayoutReconciler:
+    """
+    Keeps tier dirs (`1_good`, `3_lower`, `9_bad`) in line with ratings in background.
+
+    Rated images are marked dirty, once image was not rated for `debounce` seconds its
+    target dir is computed with hysteresis and all due moves are applied in one batch:
+    renames in a thread, then paths are written in one transaction (or through rating
+    buffer in write-behind mode).
+    """
+
+    def __init__(
+        self,
+        controller: 'PicsController',
+        debounce: float = DEBOUNCE,
+        cooldown: float = COOLDOWN,
+        margin: float = MARGIN,
+    ):
+        self.controller = controller
+        self.debounce = debounce
+        self.cooldown = cooldown
+        self.margin = margin
+        # image id => last time it was rated
+        self.dirty: dict[int, float] = {}
+        # image id => last time it was moved
+        self.moved_at: dict[int, float] = {}
+        self._task: asyncio.Task | None = None
+
+    def mark(self, image_id: int):
+        self.dirty[image_id] = time.monotonic()
+
+    def start(self):
+        self._task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self._task and not self._task.done():
+            self._task.cancel()
+            with suppress(asyncio.CancelledError):
+                await self._task
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(INTERVAL)
+            try:
+                await self.reconcile()
+            except Exception:
+                log.exception('Cannot reconcile layout')
+
+    def due(self, now: float, force: bool) -> list[tuple[RatedImage, str]]:
+        entries = self.controller.rating_index.entries
+        moves = []
+        for image_id, marked_at in list(self.dirty.items()):
+            if not force and now - marked_at < self.debounce:
+                continue
+            if not force and now - self.moved_at.get(image_id, -self.cooldown) < self.cooldown:
+                continue
+            del self.dirty[image_id]
+            entry = entries.get(image_id)
+            if entry is None or entry.hidden:
+                continue
+            if dst := target_tier(entry.path, entry.elo_rating, self.margin):
+                moves.append((entry, dst))
+        return moves
+
+    async def reconcile(self, force=False):
+        """apply moves of images that are due, `force` skips debounce and cooldown"""
+        # marks wait until indexing is done, it compares paths with scanned ones
+        if not self.controller.rating_index.ready or not self.controller.indexed:
+            return
+        moves = self.due(time.monotonic(), force)
+        if moves:
+            await self.apply([(entry.id, dst) for entry, dst in moves])
+
+    async def apply(self, moves: list[tuple[int, str]]):
+        """move images by id into dirs relative to library root"""
+        controller = self.controller
+        # watcher and indexing never see half applied batch of moves
+        async with controller.move_lock:
+            entries = controller.rating_index.entries
+            moves = [(entries[x], dst) for x, dst in moves if x in entries]
+            if not moves:
+                return
+            # same locks as commands that move or rate images take
+            async with controller.image_locks.hold([entry.path for entry, _ in moves]):
+                await self.rename(moves)
+
+    async def rename(self, moves: list[tuple[RatedImage, str]]):
+        controller = self.controller
+        entries = controller.rating_index.entries
+        # hidden, restored or moved by a command that held the lock first
+        moves = [
+            (entry, dst)
+            for entry, dst in moves
+            if (current := entries.get(entry.id))
+            and current.path == entry.path
+            and not current.hidden
+        ]
+        if not moves:
+            return
+        new_paths = await asyncio.to_thread(
+            rename_all, controller.path, [(entry.path, dst) for entry, dst in moves]
+        )
+        now = time.monotonic()
+        if failed := new_paths.count(None):
+            metrics.file_moves.inc('layout', 'failed', amount=failed)
+        moved = []
+        for (entry, _), new_path in zip(moves, new_paths):
+            if new_path is None or new_path == entry.path:
+                continue
+            log.debug(f'Moved: {entry.path} => {new_path}')
+            controller.track_move(entry.path, new_path)
+            # entry could be rated while files were renamed
+            entry = to_entry(controller.rating_index.entries.get(entry.id, entry))
+            entry.path = new_path
+            moved.append(entry)
+            self.moved_at[entry.id] = now
+        if not moved:
+            return
+        metrics.file_moves.inc('layout', 'ok', amount=len(moved))
+        # index first: rate copies entries from it, so it keeps new paths
+        controller.sync(*moved)
+        if controller.ratings:
+            await controller.ratings.add(moved)
+        else:
+            q = update(Image).where(Image.id == bindparam('_id')).values(path=bindparam('path'))
+            async with controller.db_lock:
+                await controller.db.execute(q, [{'_id': x.id, 'path': x.path} for x in moved])
+                await controller.commit()
+        log.info(f'Layout: moved {len(moved)} images')
@@ -0,0 +1,98 @@
+import asyncio
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+from .const import AppConfig, CACHE_DIR
+from .controller import PicsController
+from .models import create_database, Database
+from .renditions import RenditionCache
+
+
+log = logging.getLogger('libraries')
+
+
+class Library:
+    def __init__(self, id: str, config: AppConfig, db: Database, controller: PicsController):
+        self.id = id
+        self.config = config
+        self.db = db
+        self.controller = controller
+
+    def __repr__(self):
+        return f'<Library {self.id} {self.config.pics_dir}>'
+
+
+class Libraries:
+    """
+    All libraries served by one process, each one has own db and controller.
+
+    Process pools for indexing and renditions are shared, every library indexes
+    concurrently with at most `index_concurrency` chunks in the indexing pool.
+    """
+
+    def __init__(self, app_config: AppConfig):
+        self.app_config = app_config
+        ctx = multiprocessing.get_context('spawn')
+        self.index_pool = ProcessPoolExecutor(max_workers=app_config.index_workers, mp_context=ctx)
+        self.rendition_pool = ProcessPoolExecutor(
+            max_workers=app_config.rendition_workers, mp_context=ctx
+        )
+        self.libraries: dict[str, Library] = {}
+        for library_id, config in app_config.library_configs().items():
+            self.libraries[library_id] = self.create(library_id, config)
+
+    def create(self, library_id: str, config: AppConfig) -> Library:
+        db = create_database(config)
+        renditions = RenditionCache(
+            config.rendition_dir or config.pics_dir / CACHE_DIR / 'renditions',
+            config.rendition_cache_mb * 2**20,
+            pool=self.rendition_pool,
+        )
+        controller = PicsController(
+            config.pics_dir,
+            db.session,
+            hash_algo=config.hash_algo,
+            phash_max_distance=config.phash_max_distance,
+            renditions=renditions,
+            write_behind=config.write_behind,
+            read_db=db.read_session,
+            random_weighting=config.random_weighting,
+            scheduler=config.scheduler,
+            index_pool=self.index_pool,
+            index_concurrency=config.index_concurrency,
+            scan_workers=config.scan_workers,
+            watch=config.watch,
+            watch_debounce=config.watch_debounce_ms / 1000,
+            watch_interval=config.watch_poll_interval,
+        )
+        return Library(library_id, config, db, controller)
+
+    @property
+    def default(self) -> Library:
+        return next(iter(self.libraries.values()))
+
+    def get(self, library_id: str | None = None) -> Library | None:
+        if library_id is None:
+            return self.default
+        return self.libraries.get(library_id)
+
+    def __iter__(self):
+        return iter(self.libraries.values())
+
+    async def start(self):
+        for library in self:
+            log.info(f'Start: {library}')
+            await library.controller.start_indexing()
+
+    async def stop(self):
+        await asyncio.gather(*(self.close(x) for x in self))
+        self.index_pool.shutdown(cancel_futures=True)
+        self.rendition_pool.shutdown(cancel_futures=True)
+
+    async def close(self, library: Library):
+        controller = library.controller
+        await controller.stop_indexing()
+        await controller.db.commit()
+        await controller.db.close()
+        await library.db.dispose()
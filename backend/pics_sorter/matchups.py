@@ -0,0 +1,81 @@
+import logging
+from collections import deque
+from typing import NamedTuple, TYPE_CHECKING
+
+from .rating_index import RatedImage
+
+
+if TYPE_CHECKING:
+    from .controller import PicsController
+
+
+log = logging.getLogger('matchups')
+# matchups prepared ahead for every session
+DEPTH = 3
+# sessions with queues, least recently used are dropped
+MAX_SESSIONS = 16
+
+
+class Matchup(NamedTuple):
+    ids: tuple[int, ...]
+    # rating span, changed image rated inside it could be a better neighbour
+    low: float
+    high: float
+
+
+class MatchupQueue:
+    """
+    Upcoming matchups of one client session, computed ahead from rating index.
+
+    Every queued matchup excludes images of the current and previously queued ones,
+    as if they were already shown. Matchups are dropped when a changed image is part
+    of it or its new rating gets into matchup rating span.
+    """
+
+    def __init__(self, controller: 'PicsController', num: int = 3, depth: int = DEPTH):
+        self.controller = controller
+        self.num = num
+        self.depth = depth
+        self.queue: deque[Matchup] = deque()
+        self.current: tuple[int, ...] = ()
+
+    def generate(self, exclude: set[int]) -> Matchup | None:
+        scheduler = self.controller.rating_index.scheduler
+        entries = scheduler.matchup(self.num, self.controller.same_orientation, exclude)
+        if not entries:
+            return None
+        ratings = [x.elo_rating for x in entries]
+        return Matchup(tuple(x.id for x in entries), min(ratings), max(ratings))
+
+    def fill(self):
+        exclude = {*self.current, *(x for matchup in self.queue for x in matchup.ids)}
+        while len(self.queue) < self.depth:
+            if not (matchup := self.generate(exclude)):
+                break
+            self.queue.append(matchup)
+            exclude.update(matchup.ids)
+
+    def pop(self) -> tuple[int, ...]:
+        self.fill()
+        self.current = self.queue.popleft().ids if self.queue else ()
+        self.fill()
+        return self.current
+
+    def clear(self):
+        self.queue.clear()
+
+    def invalidate(self, changed: list[RatedImage]):
+        if any(x.extra_count > 0 for x in changed):
+            # must become pivot of the next matchup
+            self.queue.clear()
+            return
+        ids = {x.id for x in changed}
+        before = len(self.queue)
+        self.queue = deque(
+            matchup
+            for matchup in self.queue
+            if ids.isdisjoint(matchup.ids)
+            and not any(matchup.low <= x.elo_rating <= matchup.high for x in changed)
+        )
+        if dropped := before - len(self.queue):
+            log.debug(f'Invalidated: {dropped} matchups')
@@ -0,0 +1,297 @@
+import asyncio
+import logging
+import re
+import time
+from bisect import bisect_left
+from contextlib import suppress
+from typing import Callable
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+
+log = logging.getLogger('metrics')
+# seconds, request and query latencies are mostly well below 100ms
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+LAG_INTERVAL = 0.5
+TABLE_RE = re.compile(r'\b(?:FROM|INTO|UPDATE|TABLE)\s+"?(\w+)', re.IGNORECASE)
+# statement => label, statements are generated by a handful of queries
+MAX_STATEMENTS = 1000
+INDEX_FIELDS = (
+    'scanned',
+    'probed',
+    'hashed',
+    'inserted',
+    'updated',
+    'added',
+    'moved',
+    'duplicates',
+    'orphaned',
+)
+statements: dict[str, tuple[str, str]] = {}
+
+
+def format_labels(names: tuple[str, ...], values: tuple) -> str:
+    if not names:
+        return ''
+    pairs = ','.join(f'{name}="{value}"' for name, value in zip(names, values))
+    return f'{{{pairs}}}'
+
+
+class Metric:
+    type = ''
+
+    def __init__(self, name: str, help: str, labels: tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+
+    def header(self) -> list[str]:
+        return [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} {self.type}']
+
+    def render(self) -> list[str]:
+        raise NotImplementedError
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def __init__(self, name: str, help: str, labels: tuple[str, ...] = ()):
+        super().__init__(name, help, labels)
+        self.values: dict[tuple, float] = {}
+
+    def inc(self, *labels, amount: float = 1):
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+    def render(self) -> list[str]:
+        return [f'{self.name}{format_labels(self.labels, k)} {v}' for k, v in self.values.items()]
+
+
+class Gauge(Metric):
+    """value is collected on render: `collect` returns {label values: value}"""
+
+    type = 'gauge'
+
+    def __init__(
+        self, name: str, help: str, collect: Callable[[], dict], labels: tuple[str, ...] = ()
+    ):
+        super().__init__(name, help, labels)
+        self.collect = collect
+
+    def render(self) -> list[str]:
+        return [f'{self.name}{format_labels(self.labels, k)} {v}' for k, v in self.collect().items()]
+
+
+class Histogram(Metric):
+    """observe is one bisect and two additions, cheap enough for every query"""
+
+    type = 'histogram'
+
+    def __init__(
+        self, name: str, help: str, labels: tuple[str, ...] = (), buckets: tuple = BUCKETS
+    ):
+        super().__init__(name, help, labels)
+        self.buckets = buckets
+        # label values => [per bucket counts..., +Inf count, sum]
+        self.values: dict[tuple, list] = {}
+
+    def observe(self, value: float, *labels):
+        if (counts := self.values.get(labels)) is None:
+            counts = self.values[labels] = [0] * (len(self.buckets) + 2)
+        counts[bisect_left(self.buckets, value)] += 1
+        counts[-1] += value
+
+    def time(self, *labels):
+        return Timer(self, labels)
+
+    def render(self) -> list[str]:
+        lines = []
+        for labels, counts in self.values.items():
+            total = 0
+            for le, count in zip((*self.buckets, '+Inf'), counts):
+                total += count
+                bucket_labels = format_labels((*self.labels, 'le'), (*labels, le))
+                lines.append(f'{self.name}_bucket{bucket_labels} {total}')
+            labels_str = format_labels(self.labels, labels)
+            lines.append(f'{self.name}_sum{labels_str} {counts[-1]}')
+            lines.append(f'{self.name}_count{labels_str} {total}')
+        return lines
+
+
+class Timer:
+    def __init__(self, histogram: Histogram, labels: tuple):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.started, *self.labels)
+
+
+class Registry:
+    def __init__(self):
+        self.metrics: dict[str, Metric] = {}
+
+    def register(self, metric: Metric):
+        self.metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self.metrics.values():
+            lines.extend(metric.header())
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+http_requests = REGISTRY.register(
+    Histogram(
+        'pics_http_request_duration_seconds',
+        'REST request latency by route',
+        ('method', 'route', 'status'),
+    )
+)
+ws_events = REGISTRY.register(
+    Histogram('pics_ws_event_duration_seconds', 'websocket event handling latency', ('event',))
+)
+sql_queries = REGISTRY.register(
+    Histogram('pics_sql_query_duration_seconds', 'sql query latency', ('operation', 'table'))
+)
+file_moves = REGISTRY.register(
+    Counter('pics_file_moves_total', 'files renamed by sorter', ('reason', 'result'))
+)
+renditions = REGISTRY.register(
+    Counter('pics_rendition_cache_requests_total', 'rendition cache lookups', ('result',))
+)
+loop_lag = REGISTRY.register(
+    Histogram('pics_event_loop_lag_seconds', 'delay of event loop wakeups over schedule')
+)
+
+
+def register_libraries(libraries):
+    """per library values are read from controllers on scrape"""
+    REGISTRY.register(
+        Gauge(
+            'pics_index_files',
+            'counters of current indexing run by progress field',
+            lambda: {
+                (x.id, field): getattr(x.controller.indexer.progress, field)
+                for x in libraries
+                for field in INDEX_FIELDS
+            },
+            ('library', 'field'),
+        )
+    )
+    REGISTRY.register(
+        Gauge(
+            'pics_index_rate',
+            'probed files per second',
+            lambda: {(x.id,): x.controller.indexer.progress.rate for x in libraries},
+            ('library',),
+        )
+    )
+    REGISTRY.register(
+        Gauge(
+            'pics_rendition_cache_bytes',
+            'size of cached renditions',
+            lambda: {(x.id,): x.controller.renditions.total for x in libraries},
+            ('library',),
+        )
+    )
+    REGISTRY.register(
+        Gauge(
+            'pics_ratings_pending',
+            'rating updates waiting for write-behind flush',
+            lambda: {
+                (x.id,): len(x.controller.ratings.pending)
+                for x in libraries
+                if x.controller.ratings
+            },
+            ('library',),
+        )
+    )
+
+
+def statement_label(statement: str) -> tuple[str, str]:
+    """(operation, table) of sql statement"""
+    if (label := statements.get(statement)) is None:
+        operation = statement.split(None, 1)[0].upper() if statement.strip() else ''
+        match = TABLE_RE.search(statement)
+        label = (operation, match.group(1) if match else '')
+        if len(statements) < MAX_STATEMENTS:
+            statements[statement] = label
+    return label
+
+
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info['query_started'].pop()
+    sql_queries.observe(time.perf_counter() - started, *statement_label(statement))
+
+
+def instrument_engine(engine: Engine):
+    """time every query of sync engine, `AsyncEngine.sync_engine` for async ones"""
+    event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+    event.listen(engine, 'after_cursor_execute', after_cursor_execute)
+
+
+class MetricsMiddleware:
+    """
+    latency by route template, so `/api/rendition/{image_id}` is one series,
+    static files are reported by mount name
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            return await self.app(scope, receive, send)
+        started = time.perf_counter()
+        status = 500
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message['type'] == 'http.response.start':
+                status = message['status']
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            if route := scope.get('route'):
+                route = route.path
+            else:
+                route = scope.get('root_path') or 'unknown'
+            http_requests.observe(time.perf_counter() - started, scope['method'], route, status)
+
+
+class LoopMonitor:
+    """sleeps for `interval` and records how late the loop woke it up"""
+
+    def __init__(self, interval: float = LAG_INTERVAL):
+        self.interval = interval
+        self._task: asyncio.Task | None = None
+
+    async def start(self):
+        self._task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self._task and not self._task.done():
+            self._task.cancel()
+            with suppress(asyncio.CancelledError):
+                await self._task
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            started = loop.time()
+            await asyncio.sleep(self.interval)
+            loop_lag.observe(max(loop.time() - started - self.interval, 0))
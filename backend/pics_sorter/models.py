@@ -1,13 +1,16 @@
 import datetime
 import logging
-from typing import AsyncGenerator
+import time
+from typing import AsyncGenerator, NamedTuple
 
 import sqlalchemy
 import sqlalchemy as db
 from pics_sorter.const import AppConfig
+from pics_sorter.metrics import instrument_engine
 from sqlalchemy import func
-from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy.ext.asyncio import AsyncEngine, create_async_engine
 from sqlalchemy.orm import declarative_base, sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool
 from sqlmodel import select
 from sqlmodel.ext.asyncio.session import AsyncSession
 from sqlmodel.main import SQLModel
@@ -16,8 +19,12 @@ from sqlmodel.main import SQLModel
 Base = declarative_base(metadata=SQLModel.metadata)
 
 log = logging.getLogger('models')
+# condition of images that can be picked into a pair
+ELIGIBLE = 'extra_count = 0 AND hidden = 0'
 engine = None
 async_session = None
+read_engine = None
+read_session = None
 
 
 async def get_db() -> AsyncGenerator[AsyncSession, None]:
@@ -27,7 +34,6 @@ async def get_db() -> AsyncGenerator[AsyncSession, None]:
 
 class Image(Base):
     __tablename__ = "images"
-    __table_args__ = {"sqlite_autoincrement": True}
 
     id = db.Column('id', db.Integer, autoincrement=True, primary_key=True)
     path = db.Column(db.String(1024), nullable=False, unique=True)
@@ -41,44 +47,233 @@ class Image(Base):
         server_onupdate=db.func.now(),
         onupdate=datetime.datetime.now(),
     )
-    shown_times = db.Column(db.Integer, nullable=False, default=0, index=True)
-    elo_rating = db.Column(db.Integer, nullable=False, default=1200, index=True)
-    hidden = db.Column(db.Boolean, nullable=False, default=False, index=True)
-    extra_count = db.Column(db.Integer, nullable=False, default=0, server_default='0', index=True)
+    shown_times = db.Column(db.Integer, nullable=False, default=0)
+    elo_rating = db.Column(db.Integer, nullable=False, default=1200)
+    hidden = db.Column(db.Boolean, nullable=False, default=False)
+    extra_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    # legacy, superseded by fingerprint/content_hash
     sha1_hash = db.Column(db.String(40), nullable=True, index=True)
+    # size + head/tail hash, cheap duplicates pre-filter
+    fingerprint = db.Column(db.String(32), nullable=True, index=True)
+    # `algo:hexdigest` of full content, only for files with colliding fingerprint
+    content_hash = db.Column(db.String(160), nullable=True, index=True)
+    # 64 bit dhash stored as signed integer, for near duplicates
+    phash = db.Column(db.BigInteger, nullable=True)
+    # dhash cannot be computed for the file, it is probed again only when file changes
+    phash_failed = db.Column(db.Boolean, nullable=False, default=False, server_default='0')
+    # stat() manifest of the file, used to skip unchanged files on reindex
+    size = db.Column(db.BigInteger, nullable=True)
+    mtime = db.Column(db.Float, nullable=True)
+    inode = db.Column(db.BigInteger, nullable=True)
+
+    # partial indexes shaped to selection queries below, see test_query_plans
+    __table_args__ = (
+        db.Index(
+            'ix_images_pivot',
+            shown_times,
+            elo_rating.desc(),
+            orientation,
+            sqlite_where=db.text(ELIGIBLE),
+        ),
+        db.Index('ix_images_rating', elo_rating, shown_times, sqlite_where=db.text(ELIGIBLE)),
+        db.Index(
+            'ix_images_extra',
+            extra_count.desc(),
+            shown_times,
+            sqlite_where=db.text('extra_count > 0'),
+        ),
+        db.Index('ix_images_visible_rating', elo_rating, sqlite_where=db.text('hidden = 0')),
+        db.Index('ix_images_last_hidden', updated_at, sqlite_where=db.text('hidden = 1')),
+        {"sqlite_autoincrement": True},
+    )
+
+    @classmethod
+    def eligible(cls):
+        """images that can be shown as pair for pivot, same terms as in ELIGIBLE"""
+        return (cls.extra_count == 0, ~cls.hidden)
+
+    @classmethod
+    def orientation_order(cls, same_orientation: int):
+        if same_orientation == 1:
+            return [cls.orientation.asc()]
+        if same_orientation == 2:
+            return [cls.orientation.desc()]
+        return []
+
+    @classmethod
+    def extra_pivot_query(cls):
+        q = select(cls).filter(cls.extra_count > 0)
+        return q.order_by(cls.extra_count.desc(), cls.shown_times.asc()).limit(1)
+
+    @classmethod
+    def pivot_query(cls, same_orientation: int = 0):
+        order_by = [cls.shown_times.asc(), cls.elo_rating.desc()]
+        order_by.extend(cls.orientation_order(same_orientation))
+        return select(cls).filter(*cls.eligible()).order_by(*order_by).limit(1)
+
+    @classmethod
+    def around_query(cls, pivot: 'Image', num: int, up: bool, same_orientation: int = 0):
+        """
+        closest ratings on one side of pivot, range over ix_images_rating
+        instead of ordering all rows by abs(elo_rating - pivot)
+        """
+        if up:
+            side = cls.elo_rating >= pivot.elo_rating
+            order_by = [cls.elo_rating.asc()]
+        else:
+            side = cls.elo_rating < pivot.elo_rating
+            order_by = [cls.elo_rating.desc()]
+        order_by.append(cls.shown_times.asc())
+        order_by.extend(cls.orientation_order(same_orientation))
+        q = select(cls).filter(*cls.eligible(), side, cls.path != pivot.path)
+        return q.order_by(*order_by).limit(num)
+
+    @classmethod
+    def random_ids_query(cls, num: int):
+        """only ids are sorted, rows are fetched by id afterwards"""
+        return select(cls.id).filter(*cls.eligible()).order_by(func.random()).limit(num)
+
+    @classmethod
+    def top_n_query(cls, limit: int):
+        return select(cls).where(~cls.hidden).order_by(cls.elo_rating.desc()).limit(limit)
+
+    @classmethod
+    def last_hidden_query(cls):
+        """`hidden` as literal term, so that it matches ix_images_last_hidden"""
+        return select(cls).filter(cls.hidden).order_by(cls.updated_at.desc()).limit(1)
+
+    @classmethod
+    def in_dir_query(cls, path: str):
+        """
+        `startswith` as range: LIKE can't use index as it is case insensitive in sqlite
+        """
+        upper = path[:-1] + chr(ord(path[-1]) + 1)
+        return select(cls).where(cls.path >= path, cls.path < upper)
 
     @classmethod
     async def get_top_n_query(cls, session: AsyncSession, n=10):
         count = (await session.exec(select(func.count(Image.id)).where(~Image.hidden))).all()[0]
         log.debug(f'{count=}')
-        return (
-            await session.exec(
-                select(Image)
-                .where(~Image.hidden)
-                .order_by(Image.elo_rating.desc())
-                .limit(int(count / 10))
-            )
-        ).all()
+        return (await session.exec(cls.top_n_query(int(count / 10)))).all()
 
     @classmethod
     async def get_in_dir(cls, session: AsyncSession, path: str):
-        return (await session.exec(select(Image).where(Image.path.startswith(path)))).all()
+        return (await session.exec(cls.in_dir_query(path))).all()
 
     @classmethod
     async def get_by_path(cls, session: AsyncSession, path: str) -> 'Image':
         return (await session.exec(select(Image).where(Image.path == path))).first()
 
 
+class Match(Base):
+    """rated matchup, full history allows to recompute ratings under another model"""
+
+    __tablename__ = "matches"
+
+    # microseconds since epoch, unique so journal replay after crash does not duplicate it
+    id = db.Column('id', db.Integer, primary_key=True, autoincrement=False)
+    winner_id = db.Column(db.Integer, nullable=False)
+    # comma separated ids of images that lost to winner
+    loser_ids = db.Column(db.String, nullable=False)
+
+    _last_id = 0
+
+    @classmethod
+    def new_id(cls) -> int:
+        cls._last_id = max(time.time_ns() // 1000, cls._last_id + 1)
+        return cls._last_id
+
+    @classmethod
+    def record(cls, winner_id: int, loser_ids: list[int]) -> dict:
+        return {
+            'id': cls.new_id(),
+            'winner_id': winner_id,
+            'loser_ids': ','.join(map(str, loser_ids)),
+        }
+
+
 def get_connection_string(config: AppConfig, is_async=True):
     if is_async:
         return f'sqlite+aiosqlite:///{config.pics_dir}/db.sqlite'
     return f'sqlite:///{config.pics_dir}/db.sqlite'
 
 
+# pragmas applied to every new connection
+SQLITE_PROFILES = {
+    'default': {},
+    'fast': {
+        # readers do not block writer and writer does not block readers
+        'journal_mode': 'WAL',
+        # with WAL only checkpoints are fsynced, commit stays durable across app crash
+        'synchronous': 'NORMAL',
+        'temp_store': 'MEMORY',
+        'busy_timeout': 5000,
+    },
+}
+
+
+def sqlite_pragmas(config: AppConfig, read_only=False) -> dict:
+    pragmas = dict(SQLITE_PROFILES[config.sqlite_profile])
+    if config.sqlite_profile != 'default':
+        pragmas['cache_size'] = -config.sqlite_cache_mb * 1024
+        pragmas['mmap_size'] = config.sqlite_mmap_mb * 2**20
+    if read_only:
+        pragmas['query_only'] = 'ON'
+    return pragmas
+
+
+def set_pragmas(engine, pragmas: dict):
+    @sqlalchemy.event.listens_for(engine.sync_engine, 'connect')
+    def on_connect(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute(f'PRAGMA {name}={value}')
+        cursor.close()
+
+
+def create_sqlite_engine(config: AppConfig, read_only=False, pool_size=5):
+    engine = create_async_engine(
+        get_connection_string(config),
+        query_cache_size=1200,
+        # keep connections with their page cache, default for file db is NullPool
+        poolclass=AsyncAdaptedQueuePool,
+        pool_size=pool_size,
+    )
+    set_pragmas(engine, sqlite_pragmas(config, read_only=read_only))
+    instrument_engine(engine.sync_engine)
+    return engine
+
+
+class Database(NamedTuple):
+    """
+    `session` for writes and reads that are followed by writes,
+    `read_session` for request path reads, they do not queue behind writers
+    """
+
+    engine: AsyncEngine
+    session: sessionmaker
+    read_engine: AsyncEngine
+    read_session: sessionmaker
+
+    async def dispose(self):
+        await self.engine.dispose()
+        await self.read_engine.dispose()
+
+
+def create_database(config: AppConfig) -> Database:
+    log.info(f'DB path: {get_connection_string(config)} profile={config.sqlite_profile}')
+    engine = create_sqlite_engine(config)
+    read_engine = create_sqlite_engine(config, read_only=True)
+    return Database(
+        engine,
+        sessionmaker(bind=engine, expire_on_commit=False, class_=AsyncSession),
+        read_engine,
+        sessionmaker(bind=read_engine, expire_on_commit=False, class_=AsyncSession),
+    )
+
+
 def setup_engine(config: AppConfig):
-    global engine, async_session
-    db_url = get_connection_string(config)
-    log.info(f'DB path: {db_url}')
-    engine = create_async_engine(db_url, query_cache_size=1200)
-    async_session = sessionmaker(bind=engine, expire_on_commit=False, class_=AsyncSession)
+    """module level engine and sessions of single library"""
+    global engine, async_session, read_engine, read_session
+    engine, async_session, read_engine, read_session = create_database(config)
     return engine
@@ -0,0 +1,166 @@
+import logging
+from collections import defaultdict
+from itertools import combinations
+
+import PIL.Image
+
+
+log = logging.getLogger('phash')
+HASH_BITS = 64
+# dhash compares neighbour pixels of (HASH_SIZE + 1) x HASH_SIZE grayscale thumbnail
+HASH_SIZE = 8
+
+
+def dhash(img: PIL.Image.Image) -> int:
+    """
+    difference hash: survives resize, re-encoding and format conversion
+    """
+    # let jpeg decoder downscale with DCT, much faster than full decode
+    img.draft('L', (HASH_SIZE * 4, HASH_SIZE * 4))
+    small = img.convert('L').resize((HASH_SIZE + 1, HASH_SIZE), PIL.Image.Resampling.LANCZOS)
+    pixels = list(small.getdata())
+    value = 0
+    for row in range(HASH_SIZE):
+        for col in range(HASH_SIZE):
+            offset = row * (HASH_SIZE + 1) + col
+            value = (value << 1) | (pixels[offset] > pixels[offset + 1])
+    return value
+
+
+def to_db(value: int) -> int:
+    """sqlite integers are signed 64 bit"""
+    return value - (1 << HASH_BITS) if value >= 1 << (HASH_BITS - 1) else value
+
+
+def from_db(value: int) -> int:
+    return value + (1 << HASH_BITS) if value < 0 else value
+
+
+class HammingIndex:
+    """
+    Multi-index hashing for 64 bit hashes.
+
+    Hash is split into `blocks` parts, each one has its own exact-match table.
+    If two hashes differ in at most `d` bits, at least one block differs in at most
+    `d // blocks` bits (pigeonhole), so search probes only neighbours of each block
+    value within that radius instead of comparing with every hash.
+
+    Pairs within `max_distance` are collected when hash is added, so clusters for
+    any distance up to `max_distance` are built from these edges without search.
+    """
+
+    def __init__(self, max_distance: int = 7, blocks: int = 4):
+        assert HASH_BITS % blocks == 0
+        self.max_distance = max_distance
+        self.blocks = blocks
+        self.block_bits = HASH_BITS // blocks
+        self.block_mask = (1 << self.block_bits) - 1
+        self.tables: list[dict[int, set[int]]] = [defaultdict(set) for _ in range(blocks)]
+        # hash => ids of images with this hash
+        self.ids: dict[int, set[int]] = defaultdict(set)
+        self.hashes: dict[int, int] = {}
+        # hash => {other hash: distance} for hashes within max_distance
+        self.edges: dict[int, dict[int, int]] = defaultdict(dict)
+        self._masks: dict[int, list[int]] = {}
+        self._clusters: dict[int, list[list[int]]] = {}
+
+    def __len__(self):
+        return len(self.hashes)
+
+    def split(self, value: int):
+        for block in range(self.blocks):
+            yield block, (value >> (block * self.block_bits)) & self.block_mask
+
+    def masks(self, radius: int) -> list[int]:
+        """xor masks flipping up to `radius` bits of a block"""
+        if radius not in self._masks:
+            self._masks[radius] = [
+                sum(1 << bit for bit in bits)
+                for flips in range(radius + 1)
+                for bits in combinations(range(self.block_bits), flips)
+            ]
+        return self._masks[radius]
+
+    def add(self, image_id: int, value: int):
+        if self.hashes.get(image_id) == value:
+            return
+        self.remove(image_id)
+        self.hashes[image_id] = value
+        if not self.ids[value]:
+            for other in self.search_hashes(value, self.max_distance):
+                distance = (other ^ value).bit_count()
+                self.edges[value][other] = distance
+                self.edges[other][value] = distance
+            for block, part in self.split(value):
+                self.tables[block][part].add(value)
+        self.ids[value].add(image_id)
+        self._clusters.clear()
+
+    def remove(self, image_id: int):
+        value = self.hashes.pop(image_id, None)
+        if value is None:
+            return
+        ids = self.ids[value]
+        ids.discard(image_id)
+        if not ids:
+            del self.ids[value]
+            for block, part in self.split(value):
+                table = self.tables[block]
+                table[part].discard(value)
+                if not table[part]:
+                    del table[part]
+            for other in self.edges.pop(value, ()):
+                del self.edges[other][value]
+        self._clusters.clear()
+
+    def search_hashes(self, value: int, distance: int) -> set[int]:
+        masks = self.masks(distance // self.blocks)
+        found = set()
+        for block, part in self.split(value):
+            get = self.tables[block].get
+            for mask in masks:
+                if bucket := get(part ^ mask):
+                    found.update(bucket)
+        return {x for x in found if (x ^ value).bit_count() <= distance}
+
+    def search(self, value: int, distance: int) -> list[tuple[int, int]]:
+        """returns [(image_id, distance)] sorted by distance"""
+        result = [
+            (image_id, (candidate ^ value).bit_count())
+            for candidate in self.search_hashes(value, distance)
+            for image_id in self.ids[candidate]
+        ]
+        return sorted(result, key=lambda x: (x[1], x[0]))
+
+    def clusters(self, distance: int) -> list[list[int]]:
+        """
+        groups of image ids connected by hashes within `distance`, biggest first
+        result is cached until index changes
+        """
+        assert distance <= self.max_distance, f'{distance=} > {self.max_distance=}'
+        if distance in self._clusters:
+            return self._clusters[distance]
+
+        parent = {}
+
+        def find(value):
+            root = parent.setdefault(value, value)
+            while root != parent[root]:
+                root = parent[root]
+            parent[value] = root
+            return root
+
+        for value, others in self.edges.items():
+            for other, other_distance in others.items():
+                if other_distance <= distance:
+                    parent[find(other)] = find(value)
+
+        groups = defaultdict(list)
+        for value, ids in self.ids.items():
+            groups[find(value) if value in parent else value].extend(ids)
+        clusters = sorted(
+            (sorted(x) for x in groups.values() if len(x) > 1), key=lambda x: (-len(x), x[0])
+        )
+        self._clusters[distance] = clusters
+        log.debug(f'Clusters: {distance=} {len(clusters)=}')
+        return clusters
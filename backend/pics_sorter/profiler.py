@@ -0,0 +1,202 @@
+import itertools
+import logging
+import marshal
+import sys
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager, nullcontext
+from contextvars import ContextVar
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+
+log = logging.getLogger('profiler')
+# (filename, first line, function name), same key as in `pstats`
+Frame = tuple[str, int, str]
+MAX_DEPTH = 128
+# queries kept per recording
+MAX_QUERIES = 500
+
+current: ContextVar['Recording | None'] = ContextVar('current_recording', default=None)
+
+
+class Recording:
+    def __init__(self, id: int, name: str):
+        self.id = id
+        self.name = name
+        self.started_at = time.time()
+        self.started = self.last_sample = time.perf_counter()
+        self.duration = 0.0
+        # stacks from root to leaf
+        self.samples: list[tuple[Frame, ...]] = []
+        # seconds since previous sample, thread can't sample while loop holds the GIL
+        self.weights: list[float] = []
+        # (statement, seconds)
+        self.queries: list[tuple[str, float]] = []
+
+    def summary(self) -> dict:
+        return {
+            'id': self.id,
+            'name': self.name,
+            'started_at': self.started_at,
+            'duration': round(self.duration, 4),
+            'samples': len(self.samples),
+            'queries': len(self.queries),
+        }
+
+    def to_speedscope(self) -> dict:
+        """https://www.speedscope.app/file-format-schema.json, `sampled` profile"""
+        frames: dict[Frame, int] = {}
+        samples = [[frames.setdefault(x, len(frames)) for x in stack] for stack in self.samples]
+        return {
+            '$schema': 'https://www.speedscope.app/file-format-schema.json',
+            'name': self.name,
+            'exporter': 'pics_sorter',
+            'shared': {
+                'frames': [{'name': name, 'file': file, 'line': line} for file, line, name in frames]
+            },
+            'profiles': [
+                {
+                    'type': 'sampled',
+                    'name': self.name,
+                    'unit': 'seconds',
+                    'startValue': 0,
+                    'endValue': self.duration,
+                    'samples': samples,
+                    'weights': self.weights,
+                }
+            ],
+        }
+
+    def to_pstats(self) -> bytes:
+        """marshalled stats dict that `pstats.Stats` loads, times are estimated from samples"""
+        # frame => [calls, primitive calls, self time, cumulative time, {caller: [...]}],
+        # calls are numbers of samples the frame was on stack
+        stats: dict[Frame, list] = {}
+        for stack, weight in zip(self.samples, self.weights):
+            for i, frame in enumerate(stack):
+                entry = stats.setdefault(frame, [0, 0, 0.0, 0.0, {}])
+                if frame in stack[:i]:
+                    # recursion, cumulative time is counted once per sample
+                    continue
+                entry[0] += 1
+                entry[1] += 1
+                entry[3] += weight
+                if i:
+                    caller = entry[4].setdefault(stack[i - 1], [0, 0, 0.0, 0.0])
+                    caller[0] += 1
+                    caller[1] += 1
+                    caller[3] += weight
+            if stack:
+                stats[stack[-1]][2] += weight
+                if len(stack) > 1:
+                    caller = stats[stack[-1]][4].setdefault(stack[-2], [0, 0, 0.0, 0.0])
+                    caller[2] += weight
+        return marshal.dumps(
+            {
+                frame: (cc, nc, tt, ct, {k: tuple(v) for k, v in callers.items()})
+                for frame, (cc, nc, tt, ct, callers) in stats.items()
+            }
+        )
+
+
+class Profiler:
+    """
+    Opt-in sampling profiler for slow requests.
+
+    While a request is recorded, a thread samples stack of the event loop thread every
+    `interval` seconds and statements executed from request context are collected.
+    Recordings that took at least `threshold` seconds are kept in a ring buffer of
+    `keep` items, faster ones are dropped. Concurrent requests share the loop thread,
+    so their samples can include frames of each other.
+    """
+
+    def __init__(self, threshold: float = 1.0, interval: float = 0.005, keep: int = 50):
+        self.threshold = threshold
+        self.interval = interval
+        self.recordings: deque[Recording] = deque(maxlen=keep)
+        self.active: set[Recording] = set()
+        self._ids = itertools.count(1)
+        self._thread: threading.Thread | None = None
+        self._target: int | None = None
+        self._wakeup = threading.Event()
+        self._stopped = False
+
+    def start(self):
+        self._target = threading.get_ident()
+        self._stopped = False
+        self._thread = threading.Thread(target=self.run, name='profiler', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopped = True
+        self._wakeup.set()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+
+    def run(self):
+        while not self._stopped:
+            if not self.active:
+                self._wakeup.wait()
+                self._wakeup.clear()
+                continue
+            if frame := sys._current_frames().get(self._target):
+                stack = self.stack(frame)
+                now = time.perf_counter()
+                for recording in list(self.active):
+                    recording.samples.append(stack)
+                    recording.weights.append(now - recording.last_sample)
+                    recording.last_sample = now
+            time.sleep(self.interval)
+
+    @staticmethod
+    def stack(frame) -> tuple[Frame, ...]:
+        stack = []
+        while frame is not None and len(stack) < MAX_DEPTH:
+            code = frame.f_code
+            stack.append((code.co_filename, code.co_firstlineno, code.co_name))
+            frame = frame.f_back
+        return tuple(reversed(stack))
+
+    @contextmanager
+    def record(self, name: str):
+        recording = Recording(next(self._ids), name)
+        token = current.set(recording)
+        self.active.add(recording)
+        self._wakeup.set()
+        try:
+            yield recording
+        finally:
+            self.active.discard(recording)
+            current.reset(token)
+            recording.duration = time.perf_counter() - recording.started
+            if recording.duration >= self.threshold:
+                log.warning(f'Slow request: {recording.summary()}')
+                self.recordings.append(recording)
+
+    def get(self, recording_id: int) -> Recording | None:
+        return next((x for x in self.recordings if x.id == recording_id), None)
+
+    def instrument(self, engine: Engine):
+        event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+        event.listen(engine, 'after_cursor_execute', after_cursor_execute)
+
+
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if current.get() is not None:
+        conn.info.setdefault('profile_started', []).append(time.perf_counter())
+
+
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if (recording := current.get()) is not None and conn.info.get('profile_started'):
+        duration = time.perf_counter() - conn.info['profile_started'].pop()
+        if len(recording.queries) < MAX_QUERIES:
+            recording.queries.append((statement, duration))
+
+
+def record(profiler: Profiler | None, name: str):
+    """no-op when profiling is disabled"""
+    return profiler.record(name) if profiler else nullcontext()
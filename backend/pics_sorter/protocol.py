@@ -0,0 +1,185 @@
+import asyncio
+import logging
+from typing import Callable
+
+from fastapi import WebSocket, WebSocketDisconnect
+
+from . import metrics
+from .libraries import Library
+from .profiler import Profiler, record
+
+
+log = logging.getLogger('protocol')
+PROTOCOL_VERSION = 2
+# close code for clients that speak another version
+UNSUPPORTED_VERSION = 4400
+# known commands, anything else is reported as `unknown` in metrics
+COMMANDS = {
+    'next',
+    'rate',
+    'hide',
+    'toggle_setting',
+    'toggle_orientation',
+    'restore_last',
+    'build_top10',
+    'add_extra_count',
+    'reindex',
+}
+# commands handled at once per connection, reading waits when all of them are busy
+MAX_INFLIGHT = 16
+
+
+class Connection:
+    """
+    One websocket of protocol v2.
+
+    Every command may carry an `id`, its reply (`<command>_success` or `error`) has the
+    same `id`. Commands run concurrently, the controller serialises the ones on the same
+    image by `PicsController.image_locks`, so a slow `build_top10` does not hold back `rate`.
+    Everything else is pushed without `id`: the next matchup after a vote, hide or on
+    request (`next`), and events of the library hub (settings, indexing progress,
+    changed and hidden images) that are shared by every open tab.
+    """
+
+    def __init__(
+        self,
+        sock: WebSocket,
+        library: Library,
+        links: Callable[[list], list[dict]],
+        profiler: Profiler | None = None,
+    ):
+        self.sock = sock
+        self.library = library
+        self.controller = library.controller
+        self.links = links
+        self.profiler = profiler
+        # matchups are prepared ahead per session, tabs without one get their own
+        self.session = sock.query_params.get('session') or f'ws-{id(self)}'
+        self.is_random = False
+        # ids shown by client, a new matchup is pushed when one of them is hidden
+        self.shown: set[int] = set()
+        self.orientation = self.controller.same_orientation
+        self.outbox: asyncio.Queue[dict] = asyncio.Queue()
+        self.inflight = asyncio.Semaphore(MAX_INFLIGHT)
+        self.commands: set[asyncio.Task] = set()
+
+    def hello(self) -> dict:
+        controller = self.controller
+        return {
+            'event': 'hello',
+            'version': PROTOCOL_VERSION,
+            'library': self.library.id,
+            'session': self.session,
+            'commands': sorted(COMMANDS),
+            'settings': controller.settings.dict(),
+            'progress': controller.indexer.progress.dict(),
+        }
+
+    def send(self, msg: dict):
+        self.outbox.put_nowait(msg)
+
+    async def run(self):
+        with self.controller.events.subscribe() as events:
+            self.send(self.hello())
+            tasks = [asyncio.create_task(self.write()), asyncio.create_task(self.listen(events))]
+            try:
+                await self.push_matchup()
+                await self.read()
+            finally:
+                # running commands are finished, their replies are dropped
+                for task in tasks:
+                    task.cancel()
+
+    async def write(self):
+        """the only sender, messages of concurrent commands are not interleaved"""
+        while True:
+            await self.sock.send_json(await self.outbox.get())
+
+    async def read(self):
+        try:
+            while True:
+                msg = await self.sock.receive_json()
+                await self.inflight.acquire()
+                task = asyncio.create_task(self.dispatch(msg))
+                self.commands.add(task)
+                task.add_done_callback(self.command_done)
+        except WebSocketDisconnect:
+            pass
+
+    def command_done(self, task: asyncio.Task):
+        self.commands.discard(task)
+        self.inflight.release()
+
+    async def listen(self, events: asyncio.Queue):
+        while True:
+            msg = await events.get()
+            self.send(msg)
+            try:
+                await self.react(msg)
+            except Exception:
+                log.exception(f'Cannot react: {msg.get("event")}')
+
+    async def react(self, msg: dict):
+        """matchup shown by client is replaced when it is not valid anymore"""
+        event = msg.get('event')
+        if event == 'index_progress':
+            if msg['progress']['stage'] == 'done' and not self.shown:
+                await self.push_matchup()
+        elif event == 'update_settings':
+            if msg['settings']['same_orientation'] != self.orientation:
+                self.orientation = msg['settings']['same_orientation']
+                await self.push_matchup()
+        elif event == 'images_hidden':
+            if not self.shown.isdisjoint(msg['ids']):
+                await self.push_matchup()
+
+    async def push_matchup(self):
+        images = await self.controller.next_matchup(self.session, is_random=self.is_random)
+        self.shown = {x.id for x in images}
+        self.send({'event': 'matchup', 'is_random': self.is_random, 'images': self.links(images)})
+
+    async def dispatch(self, msg: dict):
+        command = msg.get('event')
+        label = command if command in COMMANDS else 'unknown'
+        timer = metrics.ws_events.time(label)
+        try:
+            with timer, record(self.profiler, f'ws {label} {self.library.id}'):
+                if await self.handle(command, msg):
+                    await self.push_matchup()
+            reply = {'event': f'{command}_success'}
+        except Exception as e:
+            log.exception(f'Command failed: {msg}')
+            reply = {'event': 'error', 'command': command, 'error': str(e) or type(e).__name__}
+        if 'id' in msg:
+            reply['id'] = msg['id']
+        self.send(reply)
+
+    async def handle(self, command: str, msg: dict) -> bool:
+        """returns `True` when client needs the next matchup"""
+        controller = self.controller
+        if 'is_random' in msg:
+            self.is_random = bool(msg['is_random'])
+        if command == 'next':
+            return True
+        elif command == 'rate':
+            await controller.rate(msg['winner'], msg['loosers'])
+            return True
+        elif command == 'hide':
+            # every tab that shows it gets the next matchup on `images_hidden`
+            await controller.hide(msg['image'])
+        elif command == 'toggle_setting':
+            controller.toggle_setting(msg['name'])
+        elif command == 'toggle_orientation':
+            controller.toggle_orientation()
+        elif command == 'restore_last':
+            await controller.restore_last()
+            return True
+        elif command == 'build_top10':
+            await controller.build_top10()
+        elif command == 'add_extra_count':
+            await controller.image_add_extra_count(msg['image'], msg.get('count', 1))
+        elif command == 'reindex':
+            await controller.reindex()
+        else:
+            raise ValueError(f'unknown command: {command}')
+        return False
@@ -0,0 +1,330 @@
+import logging
+from itertools import islice
+from math import inf
+
+from sortedcontainers import SortedList
+
+from .const import TOP_10_DIR
+from .sampler import Sampler, WEIGHTS
+from .scheduler import SCHEDULERS
+
+
+log = logging.getLogger('rating_index')
+ORIENTATIONS = ('landscape', 'portrait')
+# `build_top10` moves 1 / TOP_SHARE of visible images into top dir
+TOP_SHARE = 10
+
+
+class RatedImage:
+    __slots__ = (
+        'id',
+        'path',
+        'elo_rating',
+        'shown_times',
+        'extra_count',
+        'hidden',
+        'orientation',
+    )
+
+    def __init__(self, id, path, elo_rating, shown_times, extra_count, hidden, orientation):
+        self.id = id
+        self.path = path
+        self.elo_rating = elo_rating
+        self.shown_times = shown_times
+        self.extra_count = extra_count
+        self.hidden = hidden
+        self.orientation = orientation
+
+    @property
+    def eligible(self) -> bool:
+        return self.extra_count == 0 and not self.hidden
+
+    def __repr__(self):
+        return f'<RatedImage {self.id} {self.path} {self.elo_rating}/{self.shown_times}>'
+
+
+def orientation_rank(same_orientation: int, orientation: str) -> int:
+    """same ordering as `ORDER BY orientation ASC/DESC` in sql queries"""
+    if same_orientation == 1:
+        return ORIENTATIONS.index(orientation)
+    if same_orientation == 2:
+        return -ORIENTATIONS.index(orientation)
+    return 0
+
+
+class TopShare:
+    """
+    Top `1 / share` of visible images by elo_rating, kept up to date on every sync.
+
+    Visible images are ranked in a sorted list, members are always its prefix, so one
+    insert or removal changes membership of at most two images. Images that are in top
+    dir are tracked by path, `diff` compares both sets without queries.
+    """
+
+    def __init__(self, share: int = TOP_SHARE):
+        self.share = share
+        # (-elo_rating, id) of visible images
+        self.ranked = SortedList()
+        self.members: set[int] = set()
+        # images with path in top dir
+        self.placed: set[int] = set()
+
+    @property
+    def limit(self) -> int:
+        return len(self.ranked) // self.share
+
+    def load(self, entries: list[RatedImage]):
+        self.ranked = SortedList(top_key(x) for x in entries if not x.hidden)
+        self.members = {x[-1] for x in self.ranked.islice(0, self.limit)}
+        self.placed = {x.id for x in entries if in_top_dir(x)}
+
+    def add(self, entry: RatedImage):
+        if in_top_dir(entry):
+            self.placed.add(entry.id)
+        if entry.hidden:
+            return
+        key = top_key(entry)
+        size = len(self.members)
+        if self.ranked.bisect_left(key) < size:
+            self.members.add(entry.id)
+            size += 1
+        self.ranked.add(key)
+        self.resize(size)
+
+    def remove(self, entry: RatedImage):
+        self.placed.discard(entry.id)
+        if entry.hidden:
+            return
+        key = top_key(entry)
+        size = len(self.members)
+        if self.ranked.index(key) < size:
+            self.members.remove(entry.id)
+            size -= 1
+        self.ranked.remove(key)
+        self.resize(size)
+
+    def resize(self, size: int):
+        """grow or shrink members prefix of `size` to current limit"""
+        limit = self.limit
+        while size < limit:
+            self.members.add(self.ranked[size][-1])
+            size += 1
+        while size > limit:
+            size -= 1
+            self.members.remove(self.ranked[size][-1])
+
+    def cutoff(self) -> float | None:
+        """rating of the lowest member"""
+        if not (limit := self.limit):
+            return None
+        return -self.ranked[limit - 1][0]
+
+    def diff(self) -> tuple[set[int], set[int]]:
+        """(images to move into top dir, images to move out of it)"""
+        return self.members - self.placed, self.placed - self.members
+
+
+class RatingIndex:
+    """
+    In-memory mirror of rating fields used for matchup selection.
+
+    Eligible images (no extra_count, not hidden) are kept in sorted lists per orientation:
+    by (elo_rating, shown_times) to find neighbours of pivot with bisect and by
+    (shown_times, -elo_rating) to pick pivot. Must be synced after every change of rating
+    fields, see `PicsController.sync`.
+    """
+
+    def __init__(self, weighting: str = 'uniform', scheduler: str = 'pivot'):
+        self.ready = False
+        self.entries: dict[int, RatedImage] = {}
+        self.by_path: dict[str, int] = {}
+        self.by_rating = {x: SortedList() for x in ORIENTATIONS}
+        self.by_shown = {x: SortedList() for x in ORIENTATIONS}
+        # any image with extra_count > 0 is a pivot candidate
+        self.extras = SortedList()
+        # eligible images for random mode
+        self.sampler = Sampler(WEIGHTS[weighting])
+        self.top = TopShare()
+        # picks images for relative mode
+        self.scheduler = SCHEDULERS[scheduler](self)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def load(self, images):
+        """bulk load, sorted lists are built once instead of one insert per image"""
+        entries = [to_entry(x) for x in images]
+        self.entries = {x.id: x for x in entries}
+        self.by_path = {x.path: x.id for x in entries}
+        eligible = [x for x in entries if x.eligible]
+        for orientation in ORIENTATIONS:
+            same = [x for x in eligible if x.orientation == orientation]
+            self.by_rating[orientation] = SortedList(map(rating_key, same))
+            self.by_shown[orientation] = SortedList(map(shown_key, same))
+        self.extras = SortedList(extra_key(x) for x in entries if x.extra_count > 0)
+        self.sampler.load(eligible)
+        self.top.load(entries)
+        self.scheduler.load(entries)
+        self.ready = True
+        log.info(f'Rating index: {len(self.entries)} images')
+
+    def sync(self, image) -> RatedImage:
+        """insert or update entry from any object with rating fields (Image or row)"""
+        self.remove(image.id)
+        entry = to_entry(image)
+        self.entries[entry.id] = entry
+        self.by_path[entry.path] = entry.id
+        if entry.eligible:
+            self.by_rating[entry.orientation].add(rating_key(entry))
+            self.by_shown[entry.orientation].add(shown_key(entry))
+            self.sampler.add(entry)
+        if entry.extra_count > 0:
+            self.extras.add(extra_key(entry))
+        self.top.add(entry)
+        self.scheduler.add(entry)
+        return entry
+
+    def copy_by_paths(self, paths: list[str]) -> list[RatedImage]:
+        """detached copies, changes get into index only with `sync`"""
+        ids = (self.by_path.get(x) for x in paths)
+        return [to_entry(self.entries[x]) for x in ids if x is not None]
+
+    def remove(self, image_id: int):
+        entry = self.entries.pop(image_id, None)
+        if entry is None:
+            return
+        if self.by_path.get(entry.path) == image_id:
+            del self.by_path[entry.path]
+        if entry.eligible:
+            self.by_rating[entry.orientation].remove(rating_key(entry))
+            self.by_shown[entry.orientation].remove(shown_key(entry))
+            self.sampler.remove(image_id)
+        if entry.extra_count > 0:
+            self.extras.remove(extra_key(entry))
+        self.top.remove(entry)
+        self.scheduler.remove(entry)
+
+    def pivot(self, same_orientation: int = 0, exclude=frozenset()) -> RatedImage | None:
+        """
+        image with biggest extra_count or eligible image with lowest shown_times
+        """
+        for key in self.extras:
+            if key[-1] not in exclude:
+                return self.entries[key[-1]]
+        candidates = []
+        for by_shown in self.by_shown.values():
+            for key in by_shown:
+                if key[-1] not in exclude:
+                    candidates.append(self.entries[key[-1]])
+                    break
+        if not candidates:
+            return None
+        return min(
+            candidates,
+            key=lambda x: (
+                x.shown_times,
+                -x.elo_rating,
+                orientation_rank(same_orientation, x.orientation),
+            ),
+        )
+
+    def around(
+        self, pivot: RatedImage, num: int, same_orientation: int = 0, exclude=frozenset()
+    ) -> list[RatedImage]:
+        """
+        eligible images with closest elo_rating, then lowest shown_times
+        """
+        exclude = {pivot.id, *exclude}
+        candidates = []
+        for ratings in self.by_rating.values():
+            candidates.extend(self.nearest(ratings, pivot, num, exclude))
+        candidates.sort(
+            key=lambda x: (
+                abs(x.elo_rating - pivot.elo_rating),
+                x.shown_times,
+                -x.elo_rating,
+                orientation_rank(same_orientation, x.orientation),
+            )
+        )
+        return candidates[:num]
+
+    def nearest(
+        self, ratings: SortedList, pivot: RatedImage, num: int, exclude
+    ) -> list[RatedImage]:
+        """
+        walk groups of equal elo_rating outwards from pivot rating,
+        every group is sorted by shown_times so only its head is taken
+        """
+        down = rating_groups(ratings, pivot.elo_rating, up=False)
+        up = rating_groups(ratings, pivot.elo_rating, up=True)
+        next_down, next_up = next(down, None), next(up, None)
+        result = []
+        while len(result) < num and (next_down or next_up):
+            diff_down = pivot.elo_rating - next_down[0] if next_down else inf
+            diff_up = next_up[0] - pivot.elo_rating if next_up else inf
+            groups = []
+            if diff_down <= diff_up:
+                groups.append(next_down)
+                next_down = next(down, None)
+            if diff_up <= diff_down:
+                groups.append(next_up)
+                next_up = next(up, None)
+            batch = []
+            for _, start, end in groups:
+                keys = (x for x in ratings.islice(start, end) if x[-1] not in exclude)
+                batch.extend(self.entries[x[-1]] for x in islice(keys, num))
+            batch.sort(key=lambda x: (x.shown_times, -x.elo_rating))
+            result.extend(batch)
+        return result[:num]
+
+
+def to_entry(image) -> RatedImage:
+    return RatedImage(
+        image.id,
+        image.path,
+        image.elo_rating,
+        image.shown_times,
+        image.extra_count,
+        image.hidden,
+        image.orientation,
+    )
+
+
+def rating_key(entry: RatedImage):
+    return (entry.elo_rating, entry.shown_times, entry.id)
+
+
+def shown_key(entry: RatedImage):
+    return (entry.shown_times, -entry.elo_rating, entry.id)
+
+
+def extra_key(entry: RatedImage):
+    return (-entry.extra_count, entry.shown_times, entry.id)
+
+
+def top_key(entry: RatedImage):
+    return (-entry.elo_rating, entry.id)
+
+
+def in_top_dir(entry: RatedImage) -> bool:
+    return entry.path.startswith(f'{TOP_10_DIR}/')
+
+
+def rating_groups(ratings: SortedList, elo_rating, up: bool):
+    """
+    yields (elo_rating, start, end) slices of entries with equal rating
+    starting from `elo_rating` upwards or from the closest lower rating downwards
+    """
+    pos = ratings.bisect_left((elo_rating,))
+    if up:
+        while pos < len(ratings):
+            value = ratings[pos][0]
+            end = ratings.bisect_left((value, inf))
+            yield value, pos, end
+            pos = end
+    else:
+        while pos > 0:
+            value = ratings[pos - 1][0]
+            start = ratings.bisect_left((value,))
+            yield value, start, pos
+            pos = start
@@ -0,0 +1,123 @@
+import logging
+from array import array
+
+from .indexer import FileInfo
+
+
+log = logging.getLogger('registry')
+MIN_CAPACITY = 1024
+EMPTY = 0
+
+
+def path_key(path: str) -> int:
+    """64 bit, hashes never leave the process, so randomized `hash` is fine"""
+    return hash(path) or 1
+
+
+def capacity_for(count: int) -> int:
+    """power of 2 with load factor at most 2/3"""
+    capacity = MIN_CAPACITY
+    while count * 3 > capacity * 2:
+        capacity *= 2
+    return capacity
+
+
+class PathRegistry:
+    """
+    Stat() manifest of every image file on disk, for membership checks against `images`.
+
+    Paths are not stored: hash of path is a key of open addressing table (linear probing,
+    backward shift deletion) in typed arrays with size/mtime/inode in parallel arrays.
+    Collisions of 64 bit hashes are negligible for millions of files. It takes 50 to 100
+    bytes per file, depending on table load, instead of about 280 for str path and
+    FileInfo kept in a list and a dict.
+    """
+
+    def __init__(self, files: list[FileInfo] = ()):
+        self.allocate(capacity_for(len(files)))
+        for info in files:
+            self.put(path_key(info.path), info.size, info.mtime, info.inode)
+
+    def __len__(self):
+        return self.count
+
+    def __contains__(self, path: str) -> bool:
+        return self.find(path_key(path)) is not None
+
+    def allocate(self, capacity: int):
+        """empty table, capacity is power of 2"""
+        self.count = 0
+        self.capacity = capacity
+        self.mask = capacity - 1
+        self.keys = array('q', bytes(8 * capacity))
+        self.size = array('q', bytes(8 * capacity))
+        self.mtime = array('d', bytes(8 * capacity))
+        self.inode = array('q', bytes(8 * capacity))
+        self.manifest = (self.size, self.mtime, self.inode)
+
+    def resize(self, capacity: int):
+        keys, manifest = self.keys, self.manifest
+        self.allocate(capacity)
+        for pos, key in enumerate(keys):
+            if key != EMPTY:
+                self.put(key, *(x[pos] for x in manifest))
+
+    def find(self, key: int) -> int | None:
+        keys, mask = self.keys, self.mask
+        pos = key & mask
+        while (found := keys[pos]) != EMPTY:
+            if found == key:
+                return pos
+            pos = (pos + 1) & mask
+        return None
+
+    def put(self, key: int, size: int, mtime: float, inode: int):
+        keys, mask = self.keys, self.mask
+        pos = key & mask
+        while (found := keys[pos]) != key:
+            if found == EMPTY:
+                keys[pos] = key
+                self.count += 1
+                break
+            pos = (pos + 1) & mask
+        self.size[pos] = size
+        self.mtime[pos] = mtime
+        self.inode[pos] = inode
+
+    def get(self, path: str) -> FileInfo | None:
+        if (pos := self.find(path_key(path))) is None:
+            return None
+        return FileInfo(path, self.size[pos], self.mtime[pos], self.inode[pos])
+
+    def add(self, info: FileInfo):
+        """insert or update"""
+        if self.capacity < (capacity := capacity_for(self.count + 1)):
+            self.resize(capacity)
+        self.put(path_key(info.path), info.size, info.mtime, info.inode)
+
+    def remove(self, path: str) -> FileInfo | None:
+        if (info := self.get(path)) is None:
+            return None
+        keys, mask = self.keys, self.mask
+        hole = self.find(path_key(path))
+        pos = hole
+        while True:
+            pos = (pos + 1) & mask
+            if (key := keys[pos]) == EMPTY:
+                break
+            home = key & mask
+            # entry stays if its home is cyclically in (hole, pos]
+            if (hole < pos and hole < home <= pos) or (hole > pos and not pos < home <= hole):
+                continue
+            keys[hole] = key
+            for values in self.manifest:
+                values[hole] = values[pos]
+            hole = pos
+        keys[hole] = EMPTY
+        self.count -= 1
+        return info
+
+    def move(self, old_path: str, new_path: str):
+        """rename keeps size, mtime and inode"""
+        if (info := self.remove(old_path)) is not None:
+            self.add(info._replace(path=new_path))
@@ -0,0 +1,178 @@
+import asyncio
+import hashlib
+import logging
+import multiprocessing
+import os
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import suppress
+from pathlib import Path
+
+import PIL.Image
+import PIL.ImageOps
+
+from . import metrics
+
+
+log = logging.getLogger('renditions')
+# allowed widths, requested width is rounded up to keep number of cached files bounded
+WIDTHS = (320, 640, 1024, 1600, 2048)
+FORMATS = {'webp': 'WEBP', 'jpeg': 'JPEG'}
+QUALITY = 82
+
+
+def snap_width(width: int) -> int:
+    for allowed in WIDTHS:
+        if width <= allowed:
+            return allowed
+    return WIDTHS[-1]
+
+
+def srcset_widths(width: int | None) -> list[tuple[int, int]]:
+    """[(rendition width, real width)] for srcset, real width is smaller for small images"""
+    if not width:
+        return []
+    return [(x, min(x, width)) for x in WIDTHS if x < width] + [
+        (snap_width(width), min(width, WIDTHS[-1]))
+    ]
+
+
+def version(fingerprint: str, mtime: float | None, inode: int | None) -> str:
+    """
+    key of image content for cache and urls: fingerprint does not see changes in the
+    middle of the file, so stat() of the file is mixed in, rename keeps both of them
+    """
+    hasher = hashlib.blake2b(f'{fingerprint}:{mtime}:{inode}'.encode(), digest_size=16)
+    return hasher.hexdigest()
+
+
+def render(src: Path, dst: Path, width: int, fmt: str) -> int:
+    """
+    runs in worker process: resize to `width` (never upscale) and encode
+    returns size of written file
+    """
+    pil_format = FORMATS[fmt]
+    with PIL.Image.open(src) as img:
+        # jpeg decoder can downscale with DCT, most of decode time for big photos
+        img.draft('RGB', (width, width))
+        img = PIL.ImageOps.exif_transpose(img)
+        if img.width > width:
+            height = max(1, round(img.height * width / img.width))
+            img = img.resize((width, height), PIL.Image.Resampling.LANCZOS)
+        if pil_format == 'JPEG' or img.mode not in ('RGB', 'RGBA'):
+            img = img.convert('RGBA' if pil_format == 'WEBP' and 'A' in img.mode else 'RGB')
+        dst.parent.mkdir(parents=True, exist_ok=True)
+        tmp = dst.with_name(f'.{dst.name}.{os.getpid()}')
+        img.save(tmp, pil_format, quality=QUALITY)
+    os.replace(tmp, dst)
+    return dst.stat().st_size
+
+
+class RenditionCache:
+    """
+    Resized copies of images stored on disk by `version` of the image.
+
+    Moved and renamed files (moved to top10 dir) reuse cached files.
+    Files are evicted in least recently used order when total size exceeds `max_bytes`,
+    usage order survives restarts through file mtime.
+    """
+
+    def __init__(
+        self,
+        root: Path,
+        max_bytes: int,
+        workers: int | None = 2,
+        pool: ProcessPoolExecutor | None = None,
+    ):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.workers = workers
+        self.owns_pool = pool is None
+        self.files: OrderedDict[str, int] = OrderedDict()
+        self.total = 0
+        self.loaded = False
+        self._load_lock = asyncio.Lock()
+        self._rendering: dict[str, asyncio.Future] = {}
+        self._pool = pool
+
+    @property
+    def pool(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            ctx = multiprocessing.get_context('spawn')
+            self._pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=ctx)
+        return self._pool
+
+    def close(self):
+        if self._pool is not None and self.owns_pool:
+            self._pool.shutdown(cancel_futures=True)
+            self._pool = None
+
+    def key(self, version: str, width: int, fmt: str) -> str:
+        return f'{version[:2]}/{version}_{width}.{fmt}'
+
+    def scan(self) -> list[tuple[str, int, float]]:
+        found = []
+        for path in self.root.glob('*/*'):
+            with suppress(OSError):
+                st = path.stat()
+                found.append((str(path.relative_to(self.root)), st.st_size, st.st_mtime))
+        return found
+
+    async def load(self):
+        """restore usage order of files cached by previous runs"""
+        async with self._load_lock:
+            if not self.loaded:
+                found = await asyncio.to_thread(self.scan)
+                self.restore(found)
+
+    def restore(self, found: list[tuple[str, int, float]]):
+        for key, size, _ in sorted(found, key=lambda x: x[2]):
+            if key.startswith('.') or '/.' in key:
+                continue
+            self.files[key] = size
+            self.total += size
+        self.loaded = True
+        log.info(f'Rendition cache: {len(self.files)} files {self.total // 2**20}MB')
+        self.evict()
+
+    def touch(self, key: str):
+        self.files.move_to_end(key)
+        with suppress(OSError):
+            os.utime(self.root / key)
+
+    def add(self, key: str, size: int):
+        self.total += size - self.files.pop(key, 0)
+        self.files[key] = size
+        self.evict()
+
+    def evict(self):
+        while self.total > self.max_bytes and len(self.files) > 1:
+            key, size = self.files.popitem(last=False)
+            self.total -= size
+            with suppress(OSError):
+                (self.root / key).unlink()
+            log.debug(f'Evicted: {key}')
+
+    async def get(self, src: Path, version: str, width: int, fmt: str) -> Path:
+        """path of cached rendition, rendered in process pool on miss"""
+        await self.load()
+        key = self.key(version, width, fmt)
+        dst = self.root / key
+        if key in self.files and dst.exists():
+            self.touch(key)
+            metrics.renditions.inc('hit')
+            return dst
+        metrics.renditions.inc('miss')
+
+        # concurrent requests of the same rendition wait for single render
+        if not (future := self._rendering.get(key)):
+            loop = asyncio.get_running_loop()
+            future = loop.run_in_executor(self.pool, render, src, dst, width, fmt)
+            self._rendering[key] = future
+        try:
+            size = await asyncio.shield(future)
+        finally:
+            if self._rendering.get(key) is future:
+                del self._rendering[key]
+        self.add(key, size)
+        return dst
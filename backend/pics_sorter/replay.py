@@ -0,0 +1,208 @@
+"""
+recompute ratings from `matches` history and compare rating models offline
+
+    PICS_DIR=... python -m pics_sorter.replay --model elo --k 10 --model bt
+    PICS_DIR=... python -m pics_sorter.replay --model elo --k 16 --apply
+
+`--apply` writes ratings of the first model into `images`, run it with server stopped
+"""
+import argparse
+import logging
+import time
+from typing import NamedTuple
+
+import elo
+import numpy as np
+from sqlalchemy import bindparam, create_engine, select, update
+
+from .const import AppConfig
+from .models import get_connection_string, Image, Match
+
+
+log = logging.getLogger('replay')
+BT_ITERATIONS = 200
+BT_TOLERANCE = 1e-6
+
+
+class History(NamedTuple):
+    """matches in play order as (winner, loser) pairs of dense image indexes"""
+
+    ids: np.ndarray
+    # pair => match number
+    match: np.ndarray
+    winner: np.ndarray
+    loser: np.ndarray
+
+    @property
+    def num_matches(self) -> int:
+        return int(self.match[-1]) + 1 if len(self.match) else 0
+
+    @classmethod
+    def from_rows(cls, rows) -> 'History':
+        """rows of (winner_id, loser_ids) ordered by match id"""
+        index: dict[int, int] = {}
+        match, winner, loser = [], [], []
+        for num, (winner_id, loser_ids) in enumerate(rows):
+            w = index.setdefault(winner_id, len(index))
+            for loser_id in loser_ids.split(','):
+                match.append(num)
+                winner.append(w)
+                loser.append(index.setdefault(int(loser_id), len(index)))
+        return cls(
+            np.fromiter(index, dtype=np.int64, count=len(index)),
+            np.array(match, dtype=np.int64),
+            np.array(winner, dtype=np.int64),
+            np.array(loser, dtype=np.int64),
+        )
+
+
+class Result(NamedTuple):
+    model: str
+    ids: np.ndarray
+    ratings: np.ndarray
+    # mean -log(P(winner beats loser)) over pairs, predicted before the match for elo
+    log_loss: float
+    seconds: float
+
+    def summary(self) -> dict:
+        return {
+            'model': self.model,
+            'images': len(self.ids),
+            'log_loss': round(self.log_loss, 5),
+            'seconds': round(self.seconds, 3),
+            'min': round(float(self.ratings.min()), 1) if len(self.ratings) else None,
+            'max': round(float(self.ratings.max()), 1) if len(self.ratings) else None,
+        }
+
+
+def expect(rating, other_rating, beta: float = elo.BETA):
+    """same as `elo.expect`, vectorised"""
+    return 1 / (1 + 10 ** ((other_rating - rating) / (2 * beta)))
+
+
+def schedule(history: History) -> np.ndarray:
+    """
+    round of every match: image plays at most once per round and in its own match order,
+    so applying rounds one after another gives the same ratings as sequential replay
+    """
+    last = [0] * len(history.ids)
+    rounds = [0] * history.num_matches
+    winners = history.winner.tolist()
+    losers = history.loser.tolist()
+    starts = np.flatnonzero(np.diff(history.match, prepend=-1)).tolist() + [len(winners)]
+    for num in range(len(starts) - 1):
+        players = [winners[starts[num]], *losers[starts[num] : starts[num + 1]]]
+        round_ = max(last[x] for x in players) + 1
+        for x in players:
+            last[x] = round_
+        rounds[num] = round_
+    return np.array(rounds, dtype=np.int64)
+
+
+def replay_elo(history: History, k: float = elo.K_FACTOR, initial: float = elo.INITIAL):
+    """
+    same updates as `PicsController.rate`: winner is rated against all losers at once,
+    every loser against winner rating before the match
+    """
+    started = time.perf_counter()
+    ratings = np.full(len(history.ids), float(initial))
+    pair_rounds = schedule(history)[history.match]
+    order = np.argsort(pair_rounds, kind='stable')
+    bounds = np.flatnonzero(np.diff(pair_rounds[order])) + 1
+    loss = 0.0
+    for pairs in np.split(order, bounds):
+        w, l = history.winner[pairs], history.loser[pairs]
+        expected = expect(ratings[w], ratings[l])
+        loss -= np.log(expected).sum()
+        delta = k * (1 - expected)
+        np.add.at(ratings, w, delta)
+        # losers are unique within round
+        ratings[l] -= delta
+    return Result(
+        'elo',
+        history.ids,
+        ratings,
+        float(loss / max(len(order), 1)),
+        time.perf_counter() - started,
+    )
+
+
+def fit_bradley_terry(
+    history: History, initial: float = elo.INITIAL, iterations: int = BT_ITERATIONS
+):
+    """
+    maximum likelihood strengths with MM updates (Hunter 2004), order of matches is
+    ignored. Every image gets one virtual win and loss against average image, so
+    unbeaten images stay finite. Strengths are put on elo scale around `initial`.
+    """
+    started = time.perf_counter()
+    n = len(history.ids)
+    w, l = history.winner, history.loser
+    wins = np.bincount(w, minlength=n) + 1.0
+    strength = np.ones(n)
+    for _ in range(iterations):
+        inverse = 1 / (strength[w] + strength[l])
+        games = np.bincount(w, inverse, n) + np.bincount(l, inverse, n) + 2 / (strength + 1)
+        updated = wins / games
+        updated /= np.exp(np.log(updated).mean())
+        converged = np.abs(updated - strength).max() < BT_TOLERANCE
+        strength = updated
+        if converged:
+            break
+    loss = -np.log(strength[w] / (strength[w] + strength[l])).mean() if len(w) else 0.0
+    ratings = initial + 2 * elo.BETA * np.log10(strength)
+    return Result('bt', history.ids, ratings, float(loss), time.perf_counter() - started)
+
+
+MODELS = {'elo': replay_elo, 'bt': fit_bradley_terry}
+
+
+def load_history(config: AppConfig) -> History:
+    engine = create_engine(get_connection_string(config, is_async=False))
+    with engine.connect() as conn:
+        rows = conn.execute(select(Match.winner_id, Match.loser_ids).order_by(Match.id))
+        history = History.from_rows(rows)
+    engine.dispose()
+    return history
+
+
+def apply(config: AppConfig, result: Result):
+    """ratings of images without matches are kept"""
+    engine = create_engine(get_connection_string(config, is_async=False))
+    q = update(Image).where(Image.id == bindparam('_id')).values(elo_rating=bindparam('rating'))
+    rows = [
+        {'_id': int(x), 'rating': round(float(r))} for x, r in zip(result.ids, result.ratings)
+    ]
+    with engine.begin() as conn:
+        if rows:
+            conn.execute(q, rows)
+    engine.dispose()
+    log.info(f'Applied: {result.model} ratings of {len(rows)} images')
+
+
+def main():
+    logging.basicConfig(
+        level=logging.INFO, format='%(asctime)s [%(levelname)s] %(name)s: %(message)s'
+    )
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument('--model', choices=MODELS, action='append')
+    parser.add_argument('--k', type=float, default=elo.K_FACTOR, help='elo K-factor')
+    parser.add_argument('--apply', action='store_true')
+    args = parser.parse_args()
+
+    config = AppConfig()
+    history = load_history(config)
+    log.info(f'History: {history.num_matches} matches, {len(history.ids)} images')
+    results = []
+    for model in args.model or ['elo']:
+        kwargs = {'k': args.k} if model == 'elo' else {}
+        results.append(MODELS[model](history, **kwargs))
+        log.info(f'Replay: {results[-1].summary()}')
+    if args.apply:
+        apply(config, results[0])
+
+
+if __name__ == '__main__':
+    main()
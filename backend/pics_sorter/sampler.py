@@ -0,0 +1,133 @@
+import logging
+import random
+from typing import Callable
+
+
+log = logging.getLogger('sampler')
+# attempts per requested id before falling back to full candidates list
+MAX_ATTEMPTS = 20
+
+
+def by_shown_times(entry) -> float:
+    """images that were shown less are picked more often"""
+    return 1 / (1 + entry.shown_times)
+
+
+WEIGHTS: dict[str, Callable | None] = {
+    'uniform': None,
+    'shown': by_shown_times,
+}
+
+
+class Sampler:
+    """
+    Random ids from dense array, cost does not depend on number of images.
+
+    Ids are kept in a list with {id: position}, removal swaps the last id into freed
+    position. Uniform draw is one `randrange`. With `weight` a Fenwick tree over the same
+    positions is maintained, so weighted draw and update are O(log n).
+    """
+
+    def __init__(self, weight: Callable | None = None, rnd: random.Random | None = None):
+        self.weight = weight
+        self.rnd = rnd or random.Random()
+        self.ids: list[int] = []
+        self.pos: dict[int, int] = {}
+        self.weights: list[float] = []
+        # 1-based Fenwick tree of weights
+        self.tree: list[float] = [0.0]
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __contains__(self, image_id: int):
+        return image_id in self.pos
+
+    def load(self, entries):
+        self.ids = [x.id for x in entries]
+        self.pos = {x: i for i, x in enumerate(self.ids)}
+        if self.weight:
+            self.weights = [self.weight(x) for x in entries]
+            self.tree = [0.0, *self.weights]
+            # O(n) build: every node adds itself to its parent
+            for i in range(1, len(self.tree)):
+                if (parent := i + (i & -i)) < len(self.tree):
+                    self.tree[parent] += self.tree[i]
+
+    def add(self, entry):
+        """insert or update weight"""
+        weight = self.weight(entry) if self.weight else 0.0
+        if (pos := self.pos.get(entry.id)) is not None:
+            if self.weight:
+                self.update(pos, weight - self.weights[pos])
+            return
+        self.pos[entry.id] = len(self.ids)
+        self.ids.append(entry.id)
+        if self.weight:
+            self.weights.append(weight)
+            i = len(self.tree)
+            # node i covers (i - lowbit, i], all of them are already in the tree
+            self.tree.append(weight + self.prefix(i - 1) - self.prefix(i - (i & -i)))
+
+    def remove(self, image_id: int):
+        pos = self.pos.pop(image_id, None)
+        if pos is None:
+            return
+        last_id = self.ids.pop()
+        last_weight = self.weights.pop() if self.weight else 0.0
+        if self.weight:
+            # node n covers (n - lowbit(n), n], every other node ends before n, so none
+            # includes weight n: dropping node n leaves a valid tree of n - 1 weights,
+            # then removed weight at `pos` is replaced by the last one
+            self.tree.pop()
+        if last_id == image_id:
+            return
+        self.ids[pos] = last_id
+        self.pos[last_id] = pos
+        if self.weight:
+            self.update(pos, last_weight - self.weights[pos])
+
+    def update(self, pos: int, delta: float):
+        self.weights[pos] += delta
+        i = pos + 1
+        while i < len(self.tree):
+            self.tree[i] += delta
+            i += i & -i
+
+    def prefix(self, i: int) -> float:
+        """sum of first `i` weights"""
+        total = 0.0
+        while i > 0:
+            total += self.tree[i]
+            i -= i & -i
+        return total
+
+    def find(self, value: float) -> int:
+        """position where prefix sum exceeds `value`"""
+        pos = 0
+        step = 1 << (len(self.tree) - 1).bit_length()
+        while step:
+            if (nxt := pos + step) < len(self.tree) and self.tree[nxt] <= value:
+                pos = nxt
+                value -= self.tree[nxt]
+            step >>= 1
+        return min(pos, len(self.ids) - 1)
+
+    def draw(self) -> int:
+        if self.weight:
+            return self.ids[self.find(self.rnd.random() * self.prefix(len(self.ids)))]
+        return self.ids[self.rnd.randrange(len(self.ids))]
+
+    def sample(self, num: int, exclude=frozenset()) -> list[int]:
+        """`num` distinct ids, fewer if there are not enough images"""
+        if not self.ids:
+            return []
+        found = {}
+        for _ in range(num * MAX_ATTEMPTS):
+            if len(found) == num:
+                return list(found)
+            if (image_id := self.draw()) not in exclude:
+                found[image_id] = None
+        # almost every image is excluded or already found
+        rest = [x for x in self.ids if x not in exclude and x not in found]
+        return [*found, *self.rnd.sample(rest, min(num - len(found), len(rest)))]
@@ -0,0 +1,113 @@
+import logging
+import os
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Iterator
+
+from .const import CACHE_DIR, JOURNAL_DIR, PICS_SUFFIX
+from .indexer import FileInfo
+
+
+log = logging.getLogger('scanner')
+# threads walking top level subtrees, scandir releases the GIL while it waits for fs
+SCAN_WORKERS = 8
+# files put into queue at once by a worker
+BATCH = 256
+# own files in library root
+SKIP_DIRS = {CACHE_DIR, JOURNAL_DIR}
+DB_PREFIX = 'db.sqlite'
+
+
+def is_image(rel_path: str) -> bool:
+    top = rel_path.partition('/')[0]
+    return top not in SKIP_DIRS and os.path.splitext(rel_path)[1].lower() in PICS_SUFFIX
+
+
+def file_info(entry: os.DirEntry, rel_path: str) -> FileInfo | None:
+    if os.path.splitext(entry.name)[1].lower() not in PICS_SUFFIX:
+        return None
+    try:
+        if not entry.is_file():
+            return None
+        st = entry.stat()
+    except OSError:
+        return None
+    return FileInfo(rel_path, st.st_size, st.st_mtime, st.st_ino)
+
+
+def walk(root: str, rel_dir: str, stopped: threading.Event) -> Iterator[list[FileInfo]]:
+    """
+    batches of image files under `rel_dir`, type of entry comes from DirEntry, so only
+    image files are stat()-ed. Symlinks to dirs are not followed, same as `rglob`.
+    """
+    todo = [rel_dir]
+    batch = []
+    while todo and not stopped.is_set():
+        rel_dir = todo.pop()
+        try:
+            it = os.scandir(os.path.join(root, rel_dir))
+        except OSError as e:
+            log.warning(f'Cannot scan: {rel_dir} {e}')
+            continue
+        with it:
+            for entry in it:
+                rel_path = f'{rel_dir}/{entry.name}' if rel_dir else entry.name
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        todo.append(rel_path)
+                        continue
+                except OSError:
+                    continue
+                if info := file_info(entry, rel_path):
+                    batch.append(info)
+                if len(batch) >= BATCH:
+                    yield batch
+                    batch = []
+    if batch:
+        yield batch
+
+
+def scan(root: Path, workers: int = SCAN_WORKERS) -> Iterator[FileInfo]:
+    """
+    image files of library as they are found: files in root first, then top level
+    subtrees walked in parallel threads, own db and cache dirs are skipped
+    """
+    root = str(root)
+    stopped = threading.Event()
+    subtrees = []
+    with os.scandir(root) as it:
+        entries = list(it)
+    for entry in entries:
+        if entry.name in SKIP_DIRS or entry.name.startswith(DB_PREFIX):
+            continue
+        if entry.is_dir(follow_symlinks=False):
+            subtrees.append(entry.name)
+        elif info := file_info(entry, entry.name):
+            yield info
+    if not subtrees:
+        return
+
+    batches = queue.Queue()
+
+    def run(rel_dir: str):
+        try:
+            for batch in walk(root, rel_dir, stopped):
+                batches.put(batch)
+        finally:
+            batches.put(None)
+
+    with ThreadPoolExecutor(min(workers, len(subtrees)), thread_name_prefix='scan') as pool:
+        for rel_dir in subtrees:
+            pool.submit(run, rel_dir)
+        try:
+            running = len(subtrees)
+            while running:
+                if (batch := batches.get()) is None:
+                    running -= 1
+                else:
+                    yield from batch
+        finally:
+            # consumer stopped early, workers return after current dir
+            stopped.set()
@@ -0,0 +1,226 @@
+import heapq
+import logging
+import math
+from collections import defaultdict
+from typing import TYPE_CHECKING
+
+import elo
+from sortedcontainers import SortedList
+
+
+if TYPE_CHECKING:
+    from .rating_index import RatedImage, RatingIndex
+
+
+log = logging.getLogger('scheduler')
+# elo scale: expected score is 1 / (1 + 10 ** (-diff / 400)), see `elo.expect`
+Q = math.log(10) / 400
+# prior deviation of rating of image that was never shown
+SIGMA0 = 350.0
+# error variance elo with fixed K settles at, one vote moves rating by K at most
+STEADY = elo.K_FACTOR / (2 * Q)
+# width of rating bands candidates are bucketed by
+BAND = 25
+# entries with biggest deviation checked in every band
+PER_BAND = 8
+
+
+def expect(rating: float, other_rating: float) -> float:
+    return 1 / (1 + 10 ** ((other_rating - rating) / 400))
+
+
+def misplaced(distance: float, deviation: float) -> float:
+    """probability that image is on the other side of cutoff than its rating says"""
+    return 0.5 * math.erfc(distance / deviation / math.sqrt(2))
+
+
+def gain(diff: float) -> float:
+    """
+    share of pivot error a vote against image `diff` points away removes, up to K * Q,
+    see `UncertaintyScheduler.update`
+    """
+    p = expect(diff, 0)
+    return p * (1 - p)
+
+
+class PivotScheduler:
+    """
+    Pivot is image with extra_count or the least shown one, other images have the
+    closest elo_rating to it.
+    """
+
+    name = 'pivot'
+
+    def __init__(self, rating_index: 'RatingIndex'):
+        self.rating_index = rating_index
+
+    def load(self, entries: list['RatedImage']):
+        pass
+
+    def add(self, entry: 'RatedImage'):
+        pass
+
+    def remove(self, entry: 'RatedImage'):
+        pass
+
+    def observe(self, winner: 'RatedImage', losers: list['RatedImage']):
+        pass
+
+    def matchup(self, num: int, same_orientation: int = 0, exclude=frozenset()):
+        """`num` images to compare, pivot is the last one"""
+        rating_index = self.rating_index
+        pivot = rating_index.pivot(same_orientation, exclude)
+        if pivot is None:
+            return []
+        entries = rating_index.around(pivot, num - 1, same_orientation, exclude)
+        entries.append(pivot)
+        return entries
+
+
+class UncertaintyScheduler(PivotScheduler):
+    """
+    Spends votes where they can change top 10% moved into top dir by `build_top10`.
+
+    Every image has gaussian error around its elo_rating. Elo with fixed K is a slow
+    filter: a vote shrinks error by K * Q * p * (1 - p) share and adds noise of K sized
+    step, so error starts at `SIGMA0` and decays towards `STEADY` over tens of votes.
+    It is tracked per vote, on load it is estimated from shown_times. Pivot is image with
+    the highest probability to be on the wrong side of top 10% cutoff, others maximize
+    expected variance reduction: close rating and high deviation.
+
+    Eligible images are bucketed by rating bands of `BAND` points, each band is sorted by
+    deviation, so only heads of a few bands around cutoff and pivot are checked.
+    """
+
+    name = 'uncertainty'
+
+    def __init__(self, rating_index: 'RatingIndex'):
+        super().__init__(rating_index)
+        # image id => error variance of elo_rating
+        self.variance: dict[int, float] = {}
+        # band => SortedList of (-sigma, id) of eligible images
+        self.bands: dict[int, SortedList] = defaultdict(SortedList)
+        # image id => (band, key) it is stored in bands with
+        self.keys: dict[int, tuple[int, tuple]] = {}
+
+    def sigma(self, entry: 'RatedImage') -> float:
+        return math.sqrt(self.get_variance(entry))
+
+    def get_variance(self, entry: 'RatedImage') -> float:
+        if (variance := self.variance.get(entry.id)) is None:
+            # shown_times votes against close opponents, p = 0.5
+            decay = (1 - elo.K_FACTOR * Q / 4) ** (2 * entry.shown_times)
+            variance = self.variance[entry.id] = STEADY + (SIGMA0**2 - STEADY) * decay
+        return variance
+
+    def load(self, entries: list['RatedImage']):
+        self.variance = {}
+        self.bands = defaultdict(SortedList)
+        self.keys = {}
+        groups = defaultdict(list)
+        for entry in entries:
+            if entry.eligible:
+                key = (-self.sigma(entry), entry.id)
+                band = int(entry.elo_rating // BAND)
+                groups[band].append(key)
+                self.keys[entry.id] = (band, key)
+        for band, keys in groups.items():
+            self.bands[band] = SortedList(keys)
+
+    def add(self, entry: 'RatedImage'):
+        if entry.eligible:
+            key = (-self.sigma(entry), entry.id)
+            band = int(entry.elo_rating // BAND)
+            self.bands[band].add(key)
+            self.keys[entry.id] = (band, key)
+
+    def remove(self, entry: 'RatedImage'):
+        if found := self.keys.pop(entry.id, None):
+            band, key = found
+            self.bands[band].remove(key)
+
+    def observe(self, winner: 'RatedImage', losers: list['RatedImage']):
+        """update errors with vote, ratings are the ones before the vote"""
+        # winner is rated against all losers at once, see `PicsController.rate`
+        total = 0.0
+        for loser in losers:
+            pq = expect(winner.elo_rating, loser.elo_rating)
+            pq *= 1 - pq
+            total += pq
+            self.update(loser, pq)
+        self.update(winner, total)
+
+    def update(self, entry: 'RatedImage', pq: float):
+        k = elo.K_FACTOR
+        variance = self.get_variance(entry) * (1 - k * Q * pq) ** 2 + k**2 * pq
+        self.variance[entry.id] = variance
+
+    def heads(self, band: int, exclude):
+        """eligible entries with the biggest deviation in band"""
+        found = 0
+        for neg_sigma, image_id in self.bands.get(band, ()):
+            if image_id in exclude:
+                continue
+            yield self.rating_index.entries[image_id], -neg_sigma
+            found += 1
+            if found == PER_BAND:
+                return
+
+    def around(self, rating: float):
+        """(band, distance from `rating` to its closest edge), closest bands first"""
+        center = int(rating // BAND)
+        low, high = min(self.bands, default=center), max(self.bands, default=center)
+        down = ((rating - (x + 1) * BAND, x) for x in range(center - 1, low - 1, -1))
+        up = ((x * BAND - rating, x) for x in range(center + 1, high + 1))
+        yield center, 0.0
+        for distance, band in heapq.merge(down, up):
+            yield band, distance
+
+    def pivot(self, exclude) -> 'RatedImage | None':
+        rating_index = self.rating_index
+        for key in rating_index.extras:
+            if key[-1] not in exclude:
+                return rating_index.entries[key[-1]]
+        cutoff = rating_index.top.cutoff()
+        if cutoff is None:
+            return None
+        best, best_score = None, -1.0
+        for band, distance in self.around(cutoff):
+            if misplaced(distance, SIGMA0) <= best_score:
+                break
+            for entry, deviation in self.heads(band, exclude):
+                score = misplaced(abs(entry.elo_rating - cutoff), deviation)
+                if score > best_score:
+                    best, best_score = entry, score
+        return best
+
+    def partners(self, pivot: 'RatedImage', num: int, same_orientation: int, exclude):
+        """
+        the closest ratings, vote is informative only when outcome is uncertain,
+        then the biggest deviation among them, so partner learns from vote as well
+        """
+        scored = []
+        for band, distance in self.around(pivot.elo_rating):
+            if len(scored) >= num and gain(distance) < scored[num - 1][0]:
+                break
+            for entry, deviation in self.heads(band, exclude):
+                if same_orientation and entry.orientation != pivot.orientation:
+                    continue
+                diff = entry.elo_rating - pivot.elo_rating
+                scored.append((gain(diff), deviation, entry.id, entry))
+            scored.sort(key=lambda x: (-x[0], -x[1], x[2]))
+        return [x[-1] for x in scored[:num]]
+
+    def matchup(self, num: int, same_orientation: int = 0, exclude=frozenset()):
+        pivot = self.pivot(exclude)
+        if pivot is None:
+            return []
+        exclude = {pivot.id, *exclude}
+        entries = self.partners(pivot, num - 1, same_orientation, exclude)
+        if same_orientation and len(entries) < num - 1:
+            entries = self.partners(pivot, num - 1, 0, exclude)
+        entries.append(pivot)
+        return entries
+
+
+SCHEDULERS = {x.name: x for x in (PivotScheduler, UncertaintyScheduler)}
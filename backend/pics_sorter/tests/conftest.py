@@ -1,5 +1,8 @@
+import random
 from pathlib import Path
+from types import SimpleNamespace
 
+import PIL.Image
 import pytest
 from fastapi import FastAPI
 from fastapi.testclient import TestClient
@@ -11,8 +14,8 @@ from sqlmodel import SQLModel, create_engine
 
 
 @pytest.fixture
-def app(pics_dir):
-    yield get_app(pics_dir, pics_dir)
+def app(app_config, migrated_db):
+    yield get_app(app_config)
 
 
 @pytest.fixture
@@ -30,8 +33,16 @@ def cli(app: FastAPI):
 
 
 @pytest.fixture
-def app_config(pics_dir):
-    yield AppConfig(static_dir=pics_dir, pics_dir=pics_dir)
+def static_dir(tmp_path):
+    static: Path = tmp_path / 'static'
+    static.mkdir()
+    (static / 'index.html').write_text('<!DOCTYPE html><html><body></body></html>')
+    yield static
+
+
+@pytest.fixture
+def app_config(pics_dir, static_dir):
+    yield AppConfig(static_dir=static_dir, pics_dir=pics_dir)
 
 
 @pytest.fixture
@@ -62,3 +73,36 @@ def async_session(async_engine):
 @pytest.fixture
 def controller(app_config, async_session):
     yield PicsController(app_config.pics_dir, async_session)
+
+
+@pytest.fixture
+def make_image(pics_dir):
+    def _make_image(rel_path: str, size=(40, 30), color='red') -> Path:
+        path = pics_dir / rel_path
+        path.parent.mkdir(parents=True, exist_ok=True)
+        PIL.Image.new('RGB', size, color=color).save(path)
+        return path
+
+    yield _make_image
+
+
+@pytest.fixture
+def make_rows():
+    """rating fields of `num` images, about 5% hidden and 5% with extra count"""
+
+    def _make_rows(num: int, seed=1):
+        rnd = random.Random(seed)
+        return [
+            SimpleNamespace(
+                id=i,
+                path=f'{i}.jpg',
+                elo_rating=rnd.choice([1200, rnd.randrange(1000, 1400)]),
+                shown_times=rnd.randrange(5),
+                extra_count=rnd.choice([0] * 20 + [1]),
+                hidden=rnd.random() < 0.05,
+                orientation=rnd.choice(['landscape', 'portrait']),
+            )
+            for i in range(num)
+        ]
+
+    yield _make_rows
@@ -1,8 +1,82 @@
+import io
+import os
+
+import PIL.Image
+from fastapi import FastAPI
 from fastapi.testclient import TestClient
+from pics_sorter.app import RENDITION_MAX_AGE
 
 
 def test_01_basic(cli: TestClient):
     resp = cli.get('/')
     resp.raise_for_status()
-    data = resp.json()
-    assert len(data['images']) == 8
+    assert resp.headers['content-type'].startswith('text/html')
+
+    # startup did not run, nothing is indexed yet
+    resp = cli.get('/api/pics/')
+    resp.raise_for_status()
+    assert resp.json()['images'] == []
+
+
+def test_02_serve_while_indexing(app: FastAPI, make_image):
+    make_image('a.png')
+    make_image('b.png', color='blue')
+    with TestClient(app) as cli:
+        # served right away, even if indexing is still running
+        resp = cli.get('/api/pics/')
+        resp.raise_for_status()
+        assert resp.json()['success']
+
+        with cli.websocket_connect('/ws') as sock:
+            msg = sock.receive_json()
+            assert (msg['event'], msg['version']) == ('hello', 2)
+            while msg.get('progress', {}).get('stage') != 'done':
+                msg = sock.receive_json()
+                assert msg['event'] in ('index_progress', 'matchup')
+            assert msg['progress']['inserted'] == 2
+
+        resp = cli.get('/api/pics/')
+        assert len(resp.json()['images']) == 2
+
+
+def test_03_renditions(app: FastAPI, make_image):
+    make_image('big.png', size=(1500, 1000))
+    with TestClient(app) as cli:
+        with cli.websocket_connect('/ws') as sock:
+            while sock.receive_json().get('progress', {}).get('stage') != 'done':
+                pass
+
+        image = cli.get('/api/pics/').json()['images'][0]
+        widths = [x.split()[-1] for x in image['srcset'].split(', ')]
+        assert widths == ['320w', '640w', '1024w', '1500w']
+
+        resp = cli.get(image['src'])
+        resp.raise_for_status()
+        assert resp.headers['content-type'] == 'image/webp'
+        assert resp.headers['cache-control'] == f'public, max-age={RENDITION_MAX_AGE}'
+        with PIL.Image.open(io.BytesIO(resp.content)) as img:
+            assert img.size == (1024, 683)
+
+        renditions = app.controller.renditions
+        assert len(renditions.files) == 1
+        # second request is served from cache
+        assert cli.get(image['src']).content == resp.content
+        assert len(renditions.files) == 1
+
+        # file rewritten in place keeps fingerprint, url and cached file still change
+        path = app.controller.path / 'big.png'
+        os.utime(path, (path.stat().st_atime, path.stat().st_mtime + 10))
+        with cli.websocket_connect('/ws') as sock:
+            sock.send_json({'id': 1, 'event': 'reindex'})
+            # `hello` carries progress of the previous run
+            while True:
+                msg = sock.receive_json()
+                if msg['event'] == 'index_progress' and msg['progress']['stage'] == 'done':
+                    break
+        changed = cli.get('/api/pics/').json()['images'][0]
+        assert changed['src'] != image['src']
+        assert cli.get(changed['src']).status_code == 200
+        assert len(renditions.files) == 2
+
+        assert cli.get('/api/rendition/100500').status_code == 404
+        assert cli.get(f'/api/rendition/{image["id"]}?format=bmp').status_code == 400
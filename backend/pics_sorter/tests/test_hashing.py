@@ -0,0 +1,30 @@
+import hashlib
+
+from pics_sorter.hashing import EDGE_SIZE, fingerprint, hash_file
+
+
+def test_01_hash_file(tmp_path):
+    data = bytes(range(256)) * 10000
+    path = tmp_path / 'file.bin'
+    path.write_bytes(data)
+    assert hash_file(path) == f'blake2b:{hashlib.blake2b(data).hexdigest()}'
+    assert hash_file(path, 'sha1') == f'sha1:{hashlib.sha1(data).hexdigest()}'
+
+
+def test_02_fingerprint(tmp_path):
+    data = bytearray(EDGE_SIZE * 4)
+    a = tmp_path / 'a.bin'
+    a.write_bytes(data)
+
+    # middle is not part of fingerprint
+    data[EDGE_SIZE * 2] = 1
+    b = tmp_path / 'b.bin'
+    b.write_bytes(data)
+    assert fingerprint(a) == fingerprint(b)
+
+    data[-1] = 1
+    b.write_bytes(data)
+    assert fingerprint(a) != fingerprint(b)
+
+    b.write_bytes(data + b'\0')
+    assert fingerprint(a) != fingerprint(b)
@@ -0,0 +1,171 @@
+import asyncio
+
+import pytest
+from pics_sorter.const import HIDDEN_DIR, RESTORED_DIR
+from pics_sorter.controller import PicsController
+from pics_sorter.models import Image
+from sqlmodel import select
+
+
+async def get_images(async_session) -> dict[str, Image]:
+    async with async_session() as db:
+        return {x.path: x for x in (await db.exec(select(Image))).all()}
+
+
+async def test_01_index_new(app_config, async_session, make_image):
+    make_image('a.png', size=(40, 30), color='red')
+    make_image('sub/b.jpg', size=(30, 40), color='blue')
+    controller = PicsController(app_config.pics_dir, async_session, index_workers=1)
+    await controller.setup()
+    controller.indexer.close()
+
+    images = await get_images(async_session)
+    # empty pic*.jpg files from pics_dir fixture are skipped
+    assert set(images) == {'a.png', 'sub/b.jpg'}
+    assert images['a.png'].orientation == 'landscape'
+    assert images['sub/b.jpg'].orientation == 'portrait'
+    assert images['sub/b.jpg'].fingerprint
+    # no fingerprint collisions => no full hash
+    assert images['sub/b.jpg'].content_hash is None
+
+
+async def test_02_reindex_known(app_config, async_session, make_image):
+    make_image('a.png')
+    make_image('b.png', color='blue')
+    controller = PicsController(app_config.pics_dir, async_session, index_workers=1)
+    await controller.setup()
+    controller.indexer.close()
+
+    (app_config.pics_dir / 'a.png').rename(app_config.pics_dir / 'moved.png')
+    make_image('dup.png', color='blue')
+    make_image('c.png', color='green')
+    controller = PicsController(app_config.pics_dir, async_session, index_workers=1)
+    await controller.setup()
+    controller.indexer.close()
+
+    images = await get_images(async_session)
+    assert set(images) == {'moved.png', 'b.png', 'c.png', '6_hidden/dup.png'}
+    assert images['6_hidden/dup.png'].hidden
+    assert images['6_hidden/dup.png'].content_hash == images['b.png'].content_hash
+    assert (app_config.pics_dir / '6_hidden/dup.png').exists()
+    assert not (app_config.pics_dir / 'dup.png').exists()
+
+
+async def test_03_already_indexed(app_config, async_session, make_image):
+    for x in app_config.pics_dir.glob('pic*.jpg'):
+        x.unlink()
+    make_image('a.png')
+    controller = PicsController(app_config.pics_dir, async_session, index_workers=1)
+    await controller.setup()
+    controller.indexer.close()
+
+    controller = PicsController(app_config.pics_dir, async_session, index_workers=1)
+    await controller.setup()
+    # nothing to probe => worker pool is never started
+    assert controller.indexer._pool is None
+
+
+async def test_04_manifest(app_config, async_session, make_image):
+    for x in app_config.pics_dir.glob('pic*.jpg'):
+        x.unlink()
+    make_image('a.png')
+    make_image('b.png', color='blue')
+    controller = PicsController(app_config.pics_dir, async_session, index_workers=1)
+    await controller.setup()
+    controller.indexer.close()
+    before = await get_images(async_session)
+
+    # rename is matched by inode without hashing
+    (app_config.pics_dir / 'a.png').rename(app_config.pics_dir / 'renamed.png')
+    controller = PicsController(app_config.pics_dir, async_session, index_workers=1)
+    await controller.setup()
+    assert controller.indexer._pool is None
+    images = await get_images(async_session)
+    assert images['renamed.png'].id == before['a.png'].id
+    assert 'a.png' not in images
+
+    # modified file is probed again
+    make_image('b.png', size=(10, 50), color='blue')
+    controller = PicsController(app_config.pics_dir, async_session, index_workers=1)
+    await controller.setup()
+    controller.indexer.close()
+    images = await get_images(async_session)
+    assert images['b.png'].id == before['b.png'].id
+    assert images['b.png'].orientation == 'portrait'
+    assert images['b.png'].size == (app_config.pics_dir / 'b.png').stat().st_size
+
+
+async def test_05_reconcile(app_config, async_session, make_image):
+    for i in range(6):
+        make_image(f'{i}.png', color=(i * 40, 0, 0))
+    controller = PicsController(app_config.pics_dir, async_session, index_workers=1)
+    await controller.setup()
+    controller.indexer.close()
+    assert controller.indexer.progress.added == 6
+
+    root = app_config.pics_dir
+    for i in (0, 2, 3):
+        (root / f'{i}.png').unlink()
+    (root / '4.png').rename(root / 'moved.png')
+    make_image('dup.png', color=(40, 0, 0))
+    controller = PicsController(app_config.pics_dir, async_session, index_workers=1)
+    await controller.setup()
+    controller.indexer.close()
+
+    progress = controller.indexer.progress
+    assert (progress.added, progress.moved, progress.orphaned, progress.duplicates) == (0, 1, 3, 1)
+    images = await get_images(async_session)
+    assert set(images) == {'1.png', '5.png', 'moved.png', '6_hidden/dup.png'}
+    assert set(controller.rating_index.entries) == {x.id for x in images.values()}
+
+
+async def test_06_broken_phash(app_config, async_session, make_image):
+    for x in app_config.pics_dir.glob('pic*.jpg'):
+        x.unlink()
+    path = make_image('broken.png', size=(64, 48))
+    # header is readable, pixel data is cut
+    path.write_bytes(path.read_bytes()[:-40])
+    controller = PicsController(app_config.pics_dir, async_session, index_workers=1)
+    await controller.setup()
+    controller.indexer.close()
+    image = (await get_images(async_session))['broken.png']
+    assert (image.phash, image.phash_failed) == (None, True)
+
+    # failure is recorded, unchanged file is not probed again
+    controller = PicsController(app_config.pics_dir, async_session, index_workers=1)
+    await controller.setup()
+    assert controller.indexer._pool is None
+
+
+@pytest.mark.parametrize('write_behind', [False, True])
+async def test_07_hide_during_reindex(app_config, async_session, make_image, write_behind):
+    for i in range(3):
+        make_image(f'{i}.png', color=(i * 80, 0, 0))
+    controller = PicsController(
+        app_config.pics_dir, async_session, index_workers=1, write_behind=write_behind
+    )
+    await controller.setup()
+
+    # hide comes right after files are scanned, it waits until indexing is done
+    scan = controller.indexer.scan
+    hiding = []
+
+    async def scan_then_hide():
+        files = await scan()
+        hiding.append(asyncio.create_task(controller.hide('0.png')))
+        await asyncio.sleep(0.1)
+        return files
+
+    controller.indexer.scan = scan_then_hide
+    await controller.reindex()
+    await controller.indexing
+    await hiding[0]
+
+    hidden = (await get_images(async_session))[f'{HIDDEN_DIR}/0.png']
+    assert hidden.hidden
+    assert (app_config.pics_dir / hidden.path).exists()
+    assert controller.rating_index.entries[hidden.id].path == hidden.path
+    await controller.restore_last()
+    await controller.stop_indexing()
+    assert (app_config.pics_dir / RESTORED_DIR / '0.png').exists()
+    assert (await get_images(async_session))[f'{RESTORED_DIR}/0.png'].id == hidden.id
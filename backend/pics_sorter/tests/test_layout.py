@@ -0,0 +1,110 @@
+import asyncio
+
+from pics_sorter.const import BAD, GOOD, HIDDEN_DIR, LOWER, OTHER_DIR, TOP_10_DIR
+from pics_sorter.controller import PicsController
+from pics_sorter.layout import target_tier
+
+
+def test_01_hysteresis():
+    # unsorted images use plain edges
+    assert target_tier('a.jpg', 1200) is None
+    assert target_tier('a.jpg', 1201) == GOOD
+    assert target_tier('a.jpg', 1199) == LOWER
+    assert target_tier('a.jpg', 1149) == BAD
+
+    # rating around the edge does not move image back and forth
+    assert target_tier(f'{GOOD}/a.jpg', 1195) is None
+    assert target_tier(f'{LOWER}/a.jpg', 1205) is None
+    assert target_tier(f'{GOOD}/a.jpg', 1189) == LOWER
+    assert target_tier(f'{LOWER}/a.jpg', 1211) == GOOD
+    assert target_tier(f'{BAD}/a.jpg', 1155) is None
+    assert target_tier(f'{BAD}/a.jpg', 1161) == LOWER
+    assert target_tier(f'{TOP_10_DIR}/a.jpg', 1250) is None
+    assert target_tier(f'{TOP_10_DIR}/a.jpg', 1100) == BAD
+
+
+async def test_02_reconcile(app_config, async_session, make_image):
+    for i in range(10):
+        make_image(f'{i}.png', color=(i * 25, 0, 0))
+    controller = PicsController(app_config.pics_dir, async_session, index_workers=1)
+    await controller.setup()
+    controller.indexer.close()
+
+    images = await controller.get_relative_images(num=3)
+    await controller.rate(images[0].path, [x.path for x in images[1:]])
+    # nothing is moved on request path and before debounce
+    assert all((app_config.pics_dir / x.path).exists() for x in images)
+    await controller.layout.reconcile()
+    assert controller.layout.dirty.keys() == {x.id for x in images}
+
+    await controller.layout.reconcile(force=True)
+    assert not controller.layout.dirty
+    paths = {x.id: x.path for x in await controller.get_by_ids([x.id for x in images])}
+    assert paths[images[0].id].startswith(f'{GOOD}/')
+    assert all(paths[x.id].startswith(f'{LOWER}/') for x in images[1:])
+    assert all((app_config.pics_dir / x).exists() for x in paths.values())
+    assert controller.rating_index.entries[images[0].id].path == paths[images[0].id]
+
+    await controller.build_top10()
+    top = await controller.get_by_ids([images[0].id])
+    assert top[0].path.startswith(f'{TOP_10_DIR}/')
+    entries = controller.rating_index.entries.values()
+    assert sum(x.path.startswith(TOP_10_DIR) for x in entries) == 1
+    assert not any(x.path.startswith(OTHER_DIR) for x in entries)
+    await controller.stop_indexing()
+
+
+async def test_03_hide_during_reconcile(app_config, async_session, make_image):
+    for i in range(3):
+        make_image(f'{i}.png', color=(i * 80, 0, 0))
+    controller = PicsController(app_config.pics_dir, async_session, index_workers=1)
+    await controller.setup()
+    controller.indexer.close()
+    images = await controller.get_relative_images(num=3)
+    await controller.rate(images[0].path, [x.path for x in images[1:]])
+    path = images[0].path
+
+    # hide is first in line for the image lock, reconcile waits behind it
+    async with controller.image_locks.hold([path]):
+        hide = asyncio.create_task(controller.hide(path))
+        await asyncio.sleep(0)
+        reconcile = asyncio.create_task(controller.layout.reconcile(force=True))
+        await asyncio.sleep(0.1)
+        assert not (app_config.pics_dir / GOOD).exists()
+    await asyncio.gather(hide, reconcile)
+
+    [hidden] = await controller.get_by_ids([images[0].id])
+    assert hidden.hidden and hidden.path == f'{HIDDEN_DIR}/{path}'
+    assert (app_config.pics_dir / hidden.path).exists()
+    assert not (app_config.pics_dir / GOOD).exists()
+    # others were moved as usual
+    paths = [x.path for x in await controller.get_by_ids([x.id for x in images[1:]])]
+    assert all(x.startswith(f'{LOWER}/') for x in paths)
+    await controller.stop_indexing()
+
+
+async def test_04_wait_for_indexing(app_config, async_session, make_image):
+    for i in range(3):
+        make_image(f'{i}.png', color=(i * 80, 0, 0))
+    controller = PicsController(app_config.pics_dir, async_session, index_workers=1)
+    await controller.setup()
+    images = await controller.get_relative_images(num=3)
+    await controller.rate(images[0].path, [x.path for x in images[1:]])
+
+    scan = controller.indexer.scan
+
+    async def slow_scan():
+        await asyncio.sleep(0.1)
+        return await scan()
+
+    controller.indexer.scan = slow_scan
+    await controller.reindex()
+    await controller.layout.reconcile(force=True)
+    assert controller.layout.dirty.keys() == {x.id for x in images}
+    assert not (app_config.pics_dir / GOOD).exists()
+
+    await controller.indexing
+    await controller.layout.reconcile(force=True)
+    assert not controller.layout.dirty
+    assert (app_config.pics_dir / GOOD / images[0].path).exists()
+    await controller.stop_indexing()
@@ -0,0 +1,46 @@
+import PIL.Image
+from fastapi.testclient import TestClient
+from pics_sorter.app import get_app
+from pics_sorter.const import AppConfig
+from pics_sorter.models import get_connection_string
+from sqlmodel import create_engine, SQLModel
+
+
+def wait_indexed(cli: TestClient, library: str):
+    with cli.websocket_connect(f'/ws?library={library}') as sock:
+        while sock.receive_json().get('progress', {}).get('stage') != 'done':
+            pass
+
+
+def test_libraries(tmp_path):
+    libraries = {}
+    for name, count in (('a', 2), ('b', 3)):
+        root = libraries[name] = tmp_path / name
+        root.mkdir()
+        for i in range(count):
+            PIL.Image.new('RGB', (40, 30), color=(i * 50, 0, 0)).save(root / f'{name}{i}.png')
+    app_config = AppConfig(static_dir=tmp_path, pics_dir=tmp_path, libraries=libraries)
+    for config in app_config.library_configs().values():
+        engine = create_engine(get_connection_string(config, is_async=False))
+        SQLModel.metadata.create_all(engine)
+
+    with TestClient(get_app(app_config)) as cli:
+        wait_indexed(cli, 'a')
+        wait_indexed(cli, 'b')
+
+        resp = cli.get('/api/libraries/').json()
+        assert [x['id'] for x in resp['libraries']] == ['a', 'b']
+
+        data = cli.get('/api/pics/', params={'library': 'b'}).json()
+        assert data['library'] == 'b'
+        assert {x['path'] for x in data['images']} == {'b0.png', 'b1.png', 'b2.png'}
+        image = data['images'][0]
+        assert image['link'] == f'/pics/b/{image["path"]}'
+        assert cli.get(image['link']).status_code == 200
+        assert cli.get(image['src']).status_code == 200
+
+        # default library is the first one
+        data = cli.get('/api/pics/').json()
+        assert {x['path'] for x in data['images']} == {'a0.png', 'a1.png'}
+
+        assert cli.get('/api/pics/', params={'library': 'c'}).status_code == 404
@@ -0,0 +1,73 @@
+from types import SimpleNamespace
+
+from pics_sorter.controller import PicsController
+from pics_sorter.matchups import MatchupQueue
+from pics_sorter.rating_index import RatingIndex
+
+
+def make_queue(rows, depth=3) -> MatchupQueue:
+    index = RatingIndex()
+    index.load(rows)
+    controller = SimpleNamespace(rating_index=index, same_orientation=0)
+    return MatchupQueue(controller, num=3, depth=depth)
+
+
+def test_01_fill_excludes_queued(make_rows):
+    rows = [x for x in make_rows(200) if x.extra_count == 0]
+    queue = make_queue(rows)
+    current = queue.pop()
+    assert len(current) == 3
+    assert len(queue.queue) == 3
+    ids = [x for matchup in queue.queue for x in matchup.ids]
+    assert len(set(ids)) == len(ids)
+    assert not set(ids) & set(current)
+
+
+def test_02_invalidate(make_rows):
+    rows = [x for x in make_rows(200) if x.extra_count == 0]
+    queue = make_queue(rows)
+    queue.pop()
+    index = queue.controller.rating_index
+    first, *rest = queue.queue
+
+    # image of queued matchup changed
+    row = next(x for x in rows if x.id == first.ids[0])
+    row.shown_times += 1
+    queue.invalidate([index.sync(row)])
+    assert first not in queue.queue
+    assert queue.queue == type(queue.queue)(rest)
+
+    # rating of unrelated image moved inside matchup span
+    matchup = queue.queue[0]
+    row = next(x for x in rows if x.id not in matchup.ids and not x.hidden)
+    row.elo_rating = matchup.low
+    queue.invalidate([index.sync(row)])
+    assert matchup not in queue.queue
+
+    # extra count always goes first
+    row.extra_count = 1
+    changed = index.sync(row)
+    queue.fill()
+    queue.invalidate([changed])
+    assert not queue.queue
+    assert row.id in queue.pop()
+
+
+async def test_03_controller(app_config, async_session, make_image):
+    for i in range(9):
+        make_image(f'{i}.png', color=(i * 25, 0, 0))
+    controller = PicsController(app_config.pics_dir, async_session, index_workers=1)
+    await controller.setup()
+    controller.indexer.close()
+
+    images = await controller.next_matchup('tab')
+    assert len(images) == 3
+    queue = controller.matchup_queues['tab']
+    assert queue.queue
+
+    await controller.rate(images[0].path, [x.path for x in images[1:]])
+    shown = {x.id for x in images}
+    for matchup in queue.queue:
+        assert not shown & set(matchup.ids)
+    images = await controller.next_matchup('tab')
+    assert not shown & {x.id for x in images}
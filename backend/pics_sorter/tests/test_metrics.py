@@ -0,0 +1,55 @@
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from pics_sorter.metrics import Histogram, REGISTRY, statement_label
+
+
+def samples() -> dict[str, float]:
+    lines = REGISTRY.render().splitlines()
+    return {
+        name: float(value)
+        for name, value in (x.rsplit(' ', 1) for x in lines if not x.startswith('#'))
+    }
+
+
+def test_histogram():
+    hist = Histogram('latency', 'help', ('route',), buckets=(0.1, 1.0))
+    for value in (0.05, 0.5, 0.5, 2):
+        hist.observe(value, '/a')
+    assert hist.render() == [
+        'latency_bucket{route="/a",le="0.1"} 1',
+        'latency_bucket{route="/a",le="1.0"} 3',
+        'latency_bucket{route="/a",le="+Inf"} 4',
+        'latency_sum{route="/a"} 3.05',
+        'latency_count{route="/a"} 4',
+    ]
+    assert statement_label('UPDATE images SET path=? WHERE images.id = ?') == ('UPDATE', 'images')
+
+
+def test_metrics_endpoint(app: FastAPI, make_image):
+    make_image('a.png')
+    make_image('b.png', color='blue')
+    # registry is global, counters could be incremented by other tests
+    before = samples()
+    with TestClient(app) as cli:
+        with cli.websocket_connect('/ws') as sock:
+            while sock.receive_json().get('progress', {}).get('stage') != 'done':
+                pass
+            images = cli.get('/api/pics/').json()['images']
+            sock.send_json({'id': 1, 'event': 'rate', 'winner': images[0]['path'], 'loosers': []})
+            # reply comes after pushed events
+            while (msg := sock.receive_json()).get('id') != 1:
+                pass
+            assert msg['event'] == 'rate_success'
+
+        text = cli.get('/metrics').text
+    assert 'pics_event_loop_lag_seconds' in text
+    after = samples()
+
+    def delta(name):
+        return after.get(name, 0) - before.get(name, 0)
+
+    route = '{method="GET",route="/api/pics/",status="200"}'
+    assert delta(f'pics_http_request_duration_seconds_count{route}') == 1
+    assert delta('pics_ws_event_duration_seconds_count{event="rate"}') == 1
+    assert delta('pics_sql_query_duration_seconds_count{operation="SELECT",table="images"}') > 0
+    assert after['pics_index_files{library="default",field="inserted"}'] == 2
@@ -0,0 +1,18 @@
+import pytest
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+
+
+async def test_01_pragmas(async_engine):
+    from pics_sorter.models import read_engine
+
+    async with async_engine.connect() as conn:
+        assert (await conn.execute(text('PRAGMA journal_mode'))).scalar() == 'wal'
+        # NORMAL
+        assert (await conn.execute(text('PRAGMA synchronous'))).scalar() == 1
+        assert (await conn.execute(text('PRAGMA cache_size'))).scalar() == -64 * 1024
+
+    async with read_engine.connect() as conn:
+        assert (await conn.execute(text('SELECT count(*) FROM images'))).scalar() == 0
+        with pytest.raises(OperationalError, match='readonly'):
+            await conn.execute(text("UPDATE images SET path = 'x'"))
@@ -0,0 +1,57 @@
+import random
+
+import PIL.Image
+from pics_sorter.controller import PicsController
+from pics_sorter.phash import dhash, HammingIndex
+
+
+def noise_image(seed: int, size=(64, 48)) -> PIL.Image.Image:
+    rnd = random.Random(seed)
+    img = PIL.Image.new('L', (8, 6))
+    img.putdata([rnd.randrange(256) for _ in range(48)])
+    return img.resize(size, PIL.Image.Resampling.BILINEAR).convert('RGB')
+
+
+def test_01_index_vs_brute_force():
+    rnd = random.Random(1)
+    base = [rnd.getrandbits(64) for _ in range(50)]
+    hashes = base + [x ^ (1 << rnd.randrange(64)) ^ (1 << rnd.randrange(64)) for x in base]
+    hashes += [rnd.getrandbits(64) for _ in range(500)]
+    index = HammingIndex(max_distance=7)
+    for image_id, value in enumerate(hashes):
+        index.add(image_id, value)
+
+    for distance in (0, 2, 5, 7):
+        value = hashes[3]
+        expected = sorted(
+            ((i, (x ^ value).bit_count()) for i, x in enumerate(hashes)),
+            key=lambda x: (x[1], x[0]),
+        )
+        expected = [x for x in expected if x[1] <= distance]
+        assert index.search(value, distance) == expected
+
+    clusters = index.clusters(2)
+    assert len(clusters) == 50
+    assert all(len(x) == 2 for x in clusters)
+    index.remove(50)
+    assert len(index.clusters(2)) == 49
+
+
+def test_02_dhash_resize():
+    img = noise_image(1)
+    resized = img.resize((200, 150))
+    other = noise_image(2)
+    assert (dhash(img) ^ dhash(resized)).bit_count() <= 4
+    assert (dhash(img) ^ dhash(other)).bit_count() > 10
+
+
+async def test_03_near_duplicates(app_config, async_session):
+    noise_image(1).save(app_config.pics_dir / 'a.png')
+    noise_image(1, size=(128, 96)).save(app_config.pics_dir / 'a_big.jpg', quality=80)
+    noise_image(2).save(app_config.pics_dir / 'b.png')
+    controller = PicsController(app_config.pics_dir, async_session, index_workers=1)
+    await controller.setup()
+    controller.indexer.close()
+
+    clusters = await controller.get_near_duplicates(distance=5, num=10)
+    assert [sorted(x.path for x in cluster) for cluster in clusters] == [['a.png', 'a_big.jpg']]
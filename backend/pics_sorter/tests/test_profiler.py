@@ -0,0 +1,73 @@
+import json
+import pstats
+import time
+
+from fastapi.testclient import TestClient
+from pics_sorter.app import get_app
+from pics_sorter.profiler import Profiler
+
+
+def busy_loop(seconds: float):
+    until = time.perf_counter() + seconds
+    while time.perf_counter() < until:
+        pass
+
+
+def test_profiler(tmp_path):
+    profiler = Profiler(threshold=0.05, interval=0.001, keep=2)
+    profiler.start()
+    try:
+        with profiler.record('fast'):
+            pass
+        with profiler.record('slow'):
+            busy_loop(0.1)
+    finally:
+        profiler.stop()
+    [recording] = profiler.recordings
+    assert recording.name == 'slow'
+    assert any(stack[-1][2] == 'busy_loop' for stack in recording.samples)
+
+    path = tmp_path / 'profile.pstats'
+    path.write_bytes(recording.to_pstats())
+    stats = pstats.Stats(str(path)).stats
+    [key] = [x for x in stats if x[2] == 'busy_loop']
+    # self time of busy loop is most of the recording
+    assert stats[key][2] > 0.05
+
+    speedscope = recording.to_speedscope()
+    frames = speedscope['shared']['frames']
+    [profile] = speedscope['profiles']
+    assert frames[profile['samples'][-1][-1]]['name'] in ('busy_loop', 'record')
+
+
+def test_slow_requests(app_config, migrated_db, make_image):
+    make_image('a.png')
+    make_image('b.png', color='blue')
+    app = get_app(app_config.copy(update={'profile': True, 'profile_threshold_ms': 0}))
+    with TestClient(app) as cli:
+        with cli.websocket_connect('/ws') as sock:
+            while sock.receive_json().get('progress', {}).get('stage') != 'done':
+                pass
+            images = cli.get('/api/pics/').json()['images']
+            sock.send_json({'id': 1, 'event': 'rate', 'winner': images[0]['path'], 'loosers': []})
+            # reply comes after pushed events
+            while (msg := sock.receive_json()).get('id') != 1:
+                pass
+            assert msg['event'] == 'rate_success'
+
+        names = [x['name'] for x in cli.get('/api/admin/profiles/').json()['profiles']]
+        assert names == ['GET /api/pics/ default', 'ws rate default']
+
+        recording_id = cli.get('/api/admin/profiles/').json()['profiles'][0]['id']
+        detail = cli.get(f'/api/admin/profiles/{recording_id}').json()
+        assert any('FROM images' in x['statement'] for x in detail['sql'])
+
+        resp = cli.get(f'/api/admin/profiles/{recording_id}/speedscope')
+        assert 'attachment' in resp.headers['content-disposition']
+        assert json.loads(resp.content)['profiles'][0]['type'] == 'sampled'
+        assert cli.get(f'/api/admin/profiles/{recording_id}/pstats').status_code == 200
+        assert cli.get('/api/admin/profiles/100500').status_code == 404
+
+
+def test_profiling_disabled(cli: TestClient):
+    assert cli.get('/api/admin/profiles/').status_code == 404
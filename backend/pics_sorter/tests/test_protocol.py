@@ -0,0 +1,83 @@
+import asyncio
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from pics_sorter.events import KeyedLocks
+from starlette.websockets import WebSocketDisconnect
+
+
+def receive(sock, event: str, **match) -> dict:
+    """skip messages until one of `event` with `match` fields comes"""
+    while True:
+        msg = sock.receive_json()
+        if msg['event'] == event and all(msg.get(k) == v for k, v in match.items()):
+            return msg
+
+
+def wait_matchup(sock) -> list[dict]:
+    while not (images := receive(sock, 'matchup')['images']):
+        pass
+    return images
+
+
+async def test_01_keyed_locks():
+    locks = KeyedLocks()
+    order = []
+
+    async def command(name: str, keys: list[str], delay: float):
+        async with locks.hold(keys):
+            order.append(f'{name}+')
+            await asyncio.sleep(delay)
+            order.append(f'{name}-')
+
+    await asyncio.gather(
+        command('a', ['x', 'y'], 0.05),
+        command('b', ['y'], 0),
+        command('c', ['z'], 0.01),
+    )
+    # `b` waits for `a` on `y`, `c` runs along
+    assert order == ['a+', 'c+', 'c-', 'a-', 'b+', 'b-']
+    assert len(locks) == 0
+
+
+def test_02_concurrent_commands(app: FastAPI, make_image):
+    for i in range(3):
+        make_image(f'{i}.png', color=(i * 50, 0, 0))
+
+    async def slow_build_top10():
+        await asyncio.sleep(0.5)
+
+    app.controller.build_top10 = slow_build_top10
+    with TestClient(app) as cli:
+        with cli.websocket_connect('/ws?v=2&session=a') as tab, cli.websocket_connect(
+            '/ws?session=b'
+        ) as other:
+            assert receive(tab, 'hello')['version'] == 2
+            images = wait_matchup(tab)
+            wait_matchup(other)
+
+            tab.send_json({'id': 1, 'event': 'build_top10'})
+            winner, *loosers = [x['path'] for x in images]
+            tab.send_json({'id': 2, 'event': 'rate', 'winner': winner, 'loosers': loosers})
+            # vote is not blocked by slow command sent before it
+            replies = [receive(tab, 'matchup'), tab.receive_json(), tab.receive_json()]
+            assert [x.get('id') for x in replies] == [None, 2, 1]
+            assert [x['event'] for x in replies[1:]] == ['rate_success', 'build_top10_success']
+
+            # state is shared with other tabs
+            changed = receive(other, 'images_changed')['images']
+            assert {x['id'] for x in changed} == {x['id'] for x in images}
+            tab.send_json({'id': 3, 'event': 'toggle_setting', 'name': 'nav'})
+            assert receive(other, 'update_settings')['settings']['nav'] is False
+            assert receive(tab, 'toggle_setting_success')['id'] == 3
+
+            tab.send_json({'id': 4, 'event': 'toggle_setting', 'name': 'unknown'})
+            assert receive(tab, 'error', id=4)['command'] == 'toggle_setting'
+            tab.send_json({'id': 5, 'event': 'fly'})
+            assert receive(tab, 'error', id=5)['error'] == 'unknown command: fly'
+
+        with pytest.raises(WebSocketDisconnect) as e:
+            with cli.websocket_connect('/ws?v=1') as sock:
+                sock.receive_json()
+        assert e.value.code == 4400
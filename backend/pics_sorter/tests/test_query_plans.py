@@ -0,0 +1,76 @@
+from types import SimpleNamespace
+
+import pytest
+from pics_sorter.models import Image
+from pics_sorter.rating_index import orientation_rank
+from sqlalchemy import func, insert, select
+
+
+PIVOT = SimpleNamespace(elo_rating=1200, path='a.jpg')
+
+
+def query_plan(sync_engine, q) -> list[str]:
+    compiled = q.compile(dialect=sync_engine.dialect)
+    params = tuple(compiled.params[x] for x in compiled.positiontup)
+    with sync_engine.connect() as conn:
+        rows = conn.exec_driver_sql(f'EXPLAIN QUERY PLAN {compiled}', params).all()
+    return [row[-1] for row in rows]
+
+
+RATING = ('ix_images_rating', 'ix_images_visible_rating')
+
+
+@pytest.mark.parametrize(
+    'q, indexes',
+    [
+        (Image.extra_pivot_query(), ('ix_images_extra',)),
+        *((Image.pivot_query(x), ('ix_images_pivot',)) for x in (0, 1, 2)),
+        *(
+            (Image.around_query(PIVOT, 2, up, x), RATING)
+            for up in (True, False)
+            for x in (0, 1, 2)
+        ),
+        (Image.top_n_query(10), ('ix_images_visible_rating',)),
+        (select(func.count(Image.id)).where(~Image.hidden), ('ix_images_visible_rating',)),
+        (Image.in_dir_query('0_top10'), ('sqlite_autoindex_images_1',)),
+        (Image.last_hidden_query(), ('ix_images_last_hidden',)),
+    ],
+)
+def test_01_no_full_scans(migrated_db, sync_engine, q, indexes):
+    plan = query_plan(sync_engine, q)
+    assert 'SCAN images' not in plan, plan
+    assert any(index in x for x in plan for index in indexes), plan
+    # whole result sorted in memory means index does not match ORDER BY
+    assert 'USE TEMP B-TREE FOR ORDER BY' not in plan, plan
+
+
+def test_02_random(migrated_db, sync_engine):
+    # ORDER BY random() has to sort all candidates, they are taken from partial index
+    plan = query_plan(sync_engine, Image.random_ids_query(3))
+    assert 'SCAN images' not in plan, plan
+    assert plan[0].startswith('SCAN images USING '), plan
+
+
+async def test_03_around_matches_sort(sync_engine, controller, make_rows):
+    rows = make_rows(300)
+    with sync_engine.begin() as conn:
+        conn.execute(
+            insert(Image), [{**vars(x), 'id': x.id + 1, 'width': 10, 'height': 10} for x in rows]
+        )
+    eligible = [x for x in rows if x.extra_count == 0 and not x.hidden]
+    async with controller.session_maker() as db:
+        for same_orientation in (0, 1, 2):
+            controller.same_orientation = same_orientation
+            for pivot in eligible[:20]:
+
+                def key(x):
+                    return (
+                        abs(x.elo_rating - pivot.elo_rating),
+                        x.shown_times,
+                        -x.elo_rating,
+                        orientation_rank(same_orientation, x.orientation),
+                    )
+
+                expected = sorted((x for x in eligible if x.path != pivot.path), key=key)[:4]
+                found = await controller.get_images_around_pivot(db, pivot, 4)
+                assert [key(x) for x in found] == [key(x) for x in expected]
@@ -0,0 +1,98 @@
+import random
+
+from pics_sorter.const import TOP_10_DIR
+from pics_sorter.controller import PicsController
+from pics_sorter.rating_index import orientation_rank, RatingIndex, to_entry, top_key
+
+
+def test_01_around_vs_sort(make_rows):
+    rows = make_rows(2000)
+    index = RatingIndex()
+    index.load(rows)
+    eligible = [x for x in rows if x.extra_count == 0 and not x.hidden]
+
+    for same_orientation in (0, 1, 2):
+        for pivot in random.Random(2).sample(eligible, 50):
+            pivot = index.entries[pivot.id]
+
+            def key(x):
+                return (
+                    abs(x.elo_rating - pivot.elo_rating),
+                    x.shown_times,
+                    -x.elo_rating,
+                    orientation_rank(same_orientation, x.orientation),
+                )
+
+            expected = sorted((x for x in eligible if x.id != pivot.id), key=key)[:5]
+            found = index.around(pivot, 5, same_orientation)
+            assert [key(x) for x in found] == [key(x) for x in expected]
+
+
+def test_02_pivot_and_sync(make_rows):
+    rows = make_rows(500)
+    index = RatingIndex()
+    index.load(rows)
+    extras = [x for x in rows if x.extra_count > 0]
+    expected = min(extras, key=lambda x: (-x.extra_count, x.shown_times, x.id))
+    assert index.pivot().id == expected.id
+
+    for row in extras:
+        row.extra_count = 0
+        index.sync(row)
+    eligible = [x for x in rows if not x.hidden]
+    expected = min(eligible, key=lambda x: (x.shown_times, -x.elo_rating))
+    pivot = index.pivot()
+    assert (pivot.shown_times, pivot.elo_rating) == (expected.shown_times, expected.elo_rating)
+
+    index.remove(pivot.id)
+    assert index.pivot().id != pivot.id
+    assert pivot.id not in {x.id for x in index.around(index.pivot(), 100)}
+
+
+async def test_03_controller(app_config, async_session, make_image):
+    for i in range(6):
+        make_image(f'{i}.png', color=(i * 40, 0, 0))
+    controller = PicsController(app_config.pics_dir, async_session, index_workers=1)
+    await controller.setup()
+    controller.indexer.close()
+    assert controller.rating_index.ready
+
+    images = await controller.get_relative_images(num=3)
+    assert len(images) == 3
+    await controller.rate(images[0].path, [x.path for x in images[1:]])
+    entries = controller.rating_index.entries
+    assert entries[images[0].id].elo_rating > 1200
+    assert all(entries[x.id].shown_times == 1 for x in images)
+
+    # pivot now is one of images that were not shown yet
+    images = await controller.get_relative_images(num=3)
+    assert images[-1].shown_times == 0
+
+
+def test_04_top_share(make_rows):
+    rows = make_rows(1000)
+    for row in rows[:50]:
+        row.path = f'{TOP_10_DIR}/{row.path}'
+    index = RatingIndex()
+    index.load(rows)
+    rnd = random.Random(3)
+
+    def expected():
+        visible = sorted((x for x in index.entries.values() if not x.hidden), key=top_key)
+        return {x.id for x in visible[: len(visible) // 10]}
+
+    assert index.top.members == expected()
+    for _ in range(500):
+        entry = to_entry(rnd.choice(rows))
+        entry.elo_rating = rnd.choice([1200, entry.elo_rating + rnd.randrange(-50, 50)])
+        entry.hidden = rnd.random() < 0.05
+        index.sync(entry)
+        if rnd.random() < 0.05:
+            index.remove(entry.id)
+        assert index.top.members == expected()
+
+    entering, leaving = index.top.diff()
+    placed = {x.id for x in index.entries.values() if x.path.startswith(f'{TOP_10_DIR}/')}
+    assert entering == index.top.members - placed
+    assert leaving == placed - index.top.members
+    assert index.top.cutoff() == min(index.entries[x].elo_rating for x in index.top.members)
@@ -0,0 +1,86 @@
+import random
+import tracemalloc
+
+from pics_sorter.const import HIDDEN_DIR
+from pics_sorter.controller import PicsController
+from pics_sorter.indexer import FileInfo
+from pics_sorter.registry import PathRegistry
+
+
+def make_files(num: int, seed=1) -> list[FileInfo]:
+    rnd = random.Random(seed)
+    dirs = ['', '1_good/', '3_lower/', '9_bad/2023/']
+    return [
+        FileInfo(
+            f'{rnd.choice(dirs)}img_{i:07d}.jpg',
+            rnd.randrange(50_000, 5_000_000),
+            1.7e9 + rnd.random() * 1e7,
+            1_000_000 + i,
+        )
+        for i in range(num)
+    ]
+
+
+def traced(func) -> int:
+    """bytes taken by result of `func`"""
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        result = func()  # noqa: F841
+        return tracemalloc.get_traced_memory()[0] - before
+    finally:
+        tracemalloc.stop()
+
+
+def as_dict(files: list[FileInfo]):
+    """how files were kept before: `all_images` list and `all_images_dict`"""
+    return files, {x.path: x for x in files}
+
+
+def test_01_vs_dict():
+    files = make_files(5000)
+    registry = PathRegistry(files[:1000])
+    expected = {x.path: x for x in files[:1000]}
+    rnd = random.Random(2)
+    for _ in range(20000):
+        info = rnd.choice(files)
+        roll = rnd.random()
+        if roll < 0.4:
+            assert registry.remove(info.path) == expected.pop(info.path, None)
+        elif roll < 0.8:
+            info = info._replace(size=rnd.randrange(10))
+            registry.add(info)
+            expected[info.path] = info
+        else:
+            new_path = f'moved/{info.path}'
+            registry.move(info.path, new_path)
+            if old := expected.pop(info.path, None):
+                expected[new_path] = old._replace(path=new_path)
+    assert len(registry) == len(expected)
+    for info in files:
+        for path in (info.path, f'moved/{info.path}'):
+            assert registry.get(path) == expected.get(path)
+            assert (path in registry) == (path in expected)
+
+
+def test_02_memory():
+    num = 50_000
+    # scanned FileInfo objects are dropped after indexing
+    registry_size = traced(lambda: PathRegistry(make_files(num)))
+    baseline_size = traced(lambda: as_dict(make_files(num)))
+    assert registry_size / num < 100
+    assert registry_size * 2.5 < baseline_size
+
+
+async def test_03_own_moves(app_config, async_session, make_image):
+    make_image('a.png', color='red')
+    make_image('b.png', color='blue')
+    controller = PicsController(app_config.pics_dir, async_session, index_workers=1)
+    await controller.setup()
+    assert 'a.png' in controller.files
+    inode = (app_config.pics_dir / 'a.png').stat().st_ino
+
+    await controller.hide('a.png')
+    assert 'a.png' not in controller.files
+    assert controller.files.get(f'{HIDDEN_DIR}/a.png').inode == inode
+    await controller.stop_indexing()
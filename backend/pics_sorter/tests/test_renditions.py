@@ -0,0 +1,22 @@
+from pics_sorter.renditions import render, RenditionCache
+
+
+async def test_01_lru_eviction(tmp_path, make_image):
+    src = make_image('a.png', size=(800, 600))
+    size = render(src, tmp_path / 'probe.webp', 320, 'webp')
+    cache = RenditionCache(tmp_path / 'cache', max_bytes=size * 2 + 1, workers=1)
+    try:
+        first = await cache.get(src, 'aaaa', 320, 'webp')
+        second = await cache.get(src, 'bbbb', 320, 'webp')
+        # hit moves first one to the end
+        assert await cache.get(src, 'aaaa', 320, 'webp') == first
+        third = await cache.get(src, 'cccc', 320, 'webp')
+    finally:
+        cache.close()
+    assert first.exists() and third.exists()
+    assert not second.exists()
+    assert list(cache.files) == [cache.key('aaaa', 320, 'webp'), cache.key('cccc', 320, 'webp')]
+
+    restored = RenditionCache(tmp_path / 'cache', max_bytes=size * 2 + 1)
+    await restored.load()
+    assert restored.total == cache.total
@@ -0,0 +1,41 @@
+import random
+
+import elo
+import numpy as np
+from pics_sorter.replay import fit_bradley_terry, History, replay_elo
+
+
+def make_history(num_images: int, num_matches: int, seed=0) -> list[tuple[int, str]]:
+    """stronger images (higher id) win more often"""
+    rnd = random.Random(seed)
+    rows = []
+    for _ in range(num_matches):
+        players = rnd.sample(range(1, num_images + 1), rnd.randint(2, 3))
+        winner = max(players, key=lambda x: x * rnd.random())
+        rows.append((winner, ','.join(str(x) for x in players if x != winner)))
+    return rows
+
+
+def test_elo_matches_sequential_rate():
+    rows = make_history(20, 500)
+    expected = {}
+    for winner, loser_ids in rows:
+        losers = [int(x) for x in loser_ids.split(',')]
+        before = {x: expected.get(x, elo.INITIAL) for x in [winner, *losers]}
+        expected[winner] = elo.rate(before[winner], [(elo.WIN, before[x]) for x in losers])
+        for x in losers:
+            expected[x] = elo.rate(before[x], [(elo.LOSS, before[winner])])
+
+    result = replay_elo(History.from_rows(rows))
+    ratings = dict(zip(result.ids.tolist(), result.ratings.tolist()))
+    assert ratings.keys() == expected.keys()
+    assert np.allclose([ratings[x] for x in expected], list(expected.values()))
+
+
+def test_models_rank_by_strength():
+    history = History.from_rows(make_history(10, 3000))
+    for result in (replay_elo(history, k=16), fit_bradley_terry(history)):
+        ranked = result.ids[np.argsort(result.ratings)].tolist()
+        # strongest and weakest are found, neighbours can swap places
+        assert ranked[-1] == 10 and ranked[0] == 1, result.model
+        assert 0 < result.log_loss < np.log(2)
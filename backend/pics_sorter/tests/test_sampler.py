@@ -0,0 +1,50 @@
+import random
+from collections import Counter
+from types import SimpleNamespace
+
+from pics_sorter.sampler import by_shown_times, Sampler
+
+
+def entries(num: int):
+    return [SimpleNamespace(id=i, shown_times=i % 4) for i in range(num)]
+
+
+def test_01_swap_remove():
+    for weight in (None, by_shown_times):
+        sampler = Sampler(weight, random.Random(1))
+        images = entries(100)
+        sampler.load(images[:50])
+        for x in images[50:]:
+            sampler.add(x)
+        for x in images[::3]:
+            sampler.remove(x.id)
+        expected = {x.id for x in images} - {x.id for x in images[::3]}
+        assert set(sampler.ids) == expected
+        assert all(sampler.ids[pos] == x for x, pos in sampler.pos.items())
+        if weight:
+            total = sum(by_shown_times(images[x]) for x in expected)
+            assert abs(sampler.prefix(len(sampler)) - total) < 1e-9
+
+        found = sampler.sample(3, exclude={1, 2})
+        assert len(set(found)) == 3
+        assert set(found) <= expected - {1, 2}
+        # not enough images
+        assert set(sampler.sample(100)) == expected
+
+
+def test_02_weighted():
+    sampler = Sampler(by_shown_times, random.Random(2))
+    images = entries(8)
+    sampler.load(images[:4])
+    for x in images[4:]:
+        sampler.add(x)
+    images[0].shown_times = 9
+    sampler.add(images[0])
+    sampler.remove(images[7].id)
+
+    counts = Counter(sampler.draw() for _ in range(70000))
+    weights = {x.id: by_shown_times(x) for x in images[:7]}
+    total = sum(weights.values())
+    for image_id, weight in weights.items():
+        assert abs(counts[image_id] / 70000 - weight / total) < 0.01
+    assert 7 not in counts
@@ -0,0 +1,29 @@
+import os
+from itertools import islice
+
+from pics_sorter.scanner import scan
+
+
+def test_01_scan(tmp_path):
+    expected = set()
+    for rel_path in ('a.jpg', 'B.PNG', '1_good/c.jpg', '1_good/x/y/z/d.webp', '2/e.gif'):
+        path = tmp_path / rel_path
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(b'x' * len(rel_path))
+        expected.add(rel_path)
+    for rel_path in ('notes.txt', 'db.sqlite', '.cache/renditions/f.jpg', '.journal/g.jpg'):
+        path = tmp_path / rel_path
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.touch()
+    (tmp_path / '1_good' / 'dir.jpg').mkdir()
+    # not followed, same as rglob
+    os.symlink(tmp_path / '1_good', tmp_path / 'link')
+
+    files = list(scan(tmp_path, workers=2))
+    assert {x.path for x in files} == expected
+    for info in files:
+        st = (tmp_path / info.path).stat()
+        assert (info.size, info.mtime, info.inode) == (st.st_size, st.st_mtime, st.st_ino)
+
+    # consumer can stop early
+    assert len(list(islice(scan(tmp_path, workers=1), 3))) == 3
@@ -0,0 +1,83 @@
+import random
+from types import SimpleNamespace
+
+from elo import LOSS, rate, WIN
+from pics_sorter.rating_index import RatingIndex, to_entry
+from pics_sorter.scheduler import UncertaintyScheduler
+
+
+def test_01_matchup(make_rows):
+    rows = make_rows(2000)
+    index = RatingIndex(scheduler='uncertainty')
+    index.load(rows)
+    scheduler = index.scheduler
+    assert isinstance(scheduler, UncertaintyScheduler)
+    eligible = {x.id for x in rows if x.extra_count == 0 and not x.hidden}
+    assert scheduler.keys.keys() == eligible
+
+    # images with extra_count go first
+    extras = [x for x in rows if x.extra_count > 0]
+    exclude = {x.id for x in extras[1:]}
+    entries = scheduler.matchup(3, exclude=exclude)
+    assert len({x.id for x in entries}) == 3
+    assert exclude.isdisjoint(x.id for x in entries)
+    assert entries[-1].extra_count > 0
+
+    exclude = {x.id for x in extras}
+    for same_orientation in (0, 1, 2):
+        entries = scheduler.matchup(3, same_orientation, exclude)
+        assert len({x.id for x in entries}) == 3
+        assert exclude.isdisjoint(x.id for x in entries)
+        assert {x.id for x in entries} <= eligible
+        exclude.update(x.id for x in entries)
+
+    entry = to_entry(index.entries[next(iter(eligible))])
+    entry.hidden = True
+    index.sync(entry)
+    assert entry.id not in scheduler.keys
+    assert entry.id not in index.top.members
+
+
+def simulate(scheduler: str, seed: int, num_images=300, budget=4800, target=0.7) -> int:
+    """votes until elo top 10% shares `target` with top 10% of hidden true strengths"""
+    rnd = random.Random(seed)
+    strengths = [rnd.gauss(0, 200) for _ in range(num_images)]
+    index = RatingIndex(scheduler=scheduler)
+    index.load(
+        SimpleNamespace(
+            id=i,
+            path=f'{i}.jpg',
+            elo_rating=1200,
+            shown_times=0,
+            extra_count=0,
+            hidden=False,
+            orientation='landscape',
+        )
+        for i in range(num_images)
+    )
+    top = num_images // 10
+    best = set(sorted(range(num_images), key=strengths.__getitem__)[-top:])
+    for votes in range(1, budget + 1):
+        first, second = (to_entry(x) for x in index.scheduler.matchup(2))
+        p = 1 / (1 + 10 ** ((strengths[second.id] - strengths[first.id]) / 400))
+        winner, loser = (first, second) if rnd.random() < p else (second, first)
+        index.scheduler.observe(winner, [loser])
+        winner.elo_rating, loser.elo_rating = (
+            rate(winner.elo_rating, [(WIN, loser.elo_rating)]),
+            rate(loser.elo_rating, [(LOSS, winner.elo_rating)]),
+        )
+        for entry in (winner, loser):
+            entry.shown_times += 1
+            index.sync(entry)
+        if votes % 100 == 0:
+            ranked = sorted(index.entries.values(), key=lambda x: (x.elo_rating, x.id))
+            if len(best.intersection(x.id for x in ranked[-top:])) >= target * top:
+                return votes
+    return budget
+
+
+def test_02_fewer_votes():
+    seeds = range(3)
+    pivot = sum(simulate('pivot', seed) for seed in seeds)
+    uncertainty = sum(simulate('uncertainty', seed) for seed in seeds)
+    assert uncertainty < pivot * 0.75
@@ -0,0 +1,144 @@
+import asyncio
+import os
+import shutil
+
+import PIL.Image
+import pytest
+from pics_sorter.const import HIDDEN_DIR
+from pics_sorter.controller import PicsController
+from pics_sorter.models import Image
+from pics_sorter.watcher import Poller, watchfiles
+from sqlmodel import select
+
+
+def test_01_poller(tmp_path):
+    (tmp_path / 'a.jpg').touch()
+    (tmp_path / 'sub').mkdir()
+    (tmp_path / 'sub' / 'b.png').touch()
+    (tmp_path / '.cache').mkdir()
+    poller = Poller(tmp_path)
+    assert poller.poll() == {'a.jpg', 'sub/b.png'}
+    assert poller.poll() == set()
+
+    (tmp_path / 'sub' / 'b.png').rename(tmp_path / 'b.png')
+    (tmp_path / 'sub' / 'deep').mkdir()
+    (tmp_path / 'sub' / 'deep' / 'c.jpg').touch()
+    (tmp_path / '.cache' / 'd.jpg').touch()
+    (tmp_path / 'notes.txt').touch()
+    (tmp_path / 'a.jpg').unlink()
+    assert poller.poll() == {'a.jpg', 'b.png', 'sub/b.png', 'sub/deep/c.jpg'}
+
+    # listed again while dir mtime is recent, rewritten file is found too
+    (tmp_path / 'b.png').write_bytes(b'changed')
+    assert poller.poll() == {'b.png'}
+
+
+async def test_02_apply_changes(app_config, async_session, make_image):
+    for i in range(4):
+        make_image(f'{i}.png', color=(i * 50, 0, 0))
+    controller = PicsController(app_config.pics_dir, async_session, index_workers=1)
+    await controller.setup()
+    by_path = {x.path: x for x in controller.rating_index.entries.values()}
+    assert by_path.keys() == {'0.png', '1.png', '2.png', '3.png'}
+
+    root = app_config.pics_dir
+    make_image('new/4.png', color='blue')
+    # duplicate of existing image is hidden on the way in
+    make_image('5.png', color=(0, 0, 0))
+    (root / 'moved').mkdir()
+    os.rename(root / '1.png', root / 'moved' / '1.png')
+    (root / '2.png').unlink()
+    # own moves are known already
+    await controller.hide('3.png')
+    hidden = f'{HIDDEN_DIR}/3.png', f'{HIDDEN_DIR}/5.png'
+    changed = {'new/4.png', '5.png', '1.png', 'moved/1.png', '2.png', '3.png', hidden[0]}
+    await controller.apply_changes(changed)
+
+    progress = controller.indexer.progress
+    assert (progress.probed, progress.inserted, progress.orphaned) == (2, 2, 1)
+    assert (progress.added, progress.moved, progress.duplicates) == (1, 1, 1)
+    async with async_session() as db:
+        rows = {x.path: x for x in (await db.exec(select(Image))).all()}
+    assert rows.keys() == {'0.png', 'moved/1.png', 'new/4.png', *hidden}
+    assert rows['moved/1.png'].id == by_path['1.png'].id
+    assert rows[hidden[1]].hidden
+
+    entries = controller.rating_index.entries
+    assert entries[rows['moved/1.png'].id].path == 'moved/1.png'
+    assert entries[rows['new/4.png'].id].eligible
+    assert by_path['2.png'].id not in entries
+    assert rows['new/4.png'].id in controller.phash_index.hashes
+    assert by_path['2.png'].id not in controller.phash_index.hashes
+
+    await controller.apply_changes(changed)
+    assert controller.indexer.progress.probed == 2
+    await controller.stop_indexing()
+
+
+@pytest.fixture(params=['inotify', 'poll'])
+def watch_backend(request):
+    if request.param == 'inotify' and watchfiles is None:
+        pytest.skip('watchfiles is not installed')
+    yield request.param
+
+
+async def start_watching(app_config, async_session, backend: str) -> PicsController:
+    controller = PicsController(
+        app_config.pics_dir,
+        async_session,
+        index_workers=1,
+        watch=True,
+        watch_debounce=0.1,
+        watch_interval=0.1,
+    )
+    await controller.setup()
+    controller.watcher.backend = backend
+    controller.watcher.start()
+    await asyncio.sleep(0.3)
+    return controller
+
+
+async def wait_for(check):
+    for _ in range(50):
+        if check():
+            return True
+        await asyncio.sleep(0.1)
+    return check()
+
+
+async def test_03_watch(app_config, async_session, make_image, watch_backend):
+    controller = await start_watching(app_config, async_session, watch_backend)
+    make_image('new.png')
+    assert await wait_for(lambda: 'new.png' in controller.rating_index.by_path)
+    assert 'new.png' in controller.files
+    await controller.stop_indexing()
+
+
+async def test_04_watch_dirs(app_config, async_session, make_image, tmp_path, watch_backend):
+    root = app_config.pics_dir
+    make_image('old/a.png', color='red')
+    make_image('old/deep/b.png', color='blue')
+    controller = await start_watching(app_config, async_session, watch_backend)
+    by_path = controller.rating_index.by_path
+    old_id = by_path['old/deep/b.png']
+
+    # folders moved in and out of library, and renamed inside it as a whole
+    outside = tmp_path / 'outside'
+    for i in range(2):
+        path = outside / 'sub' / f'{i}.png'
+        path.parent.mkdir(parents=True, exist_ok=True)
+        PIL.Image.new('RGB', (40, 30), color=(0, i * 50 + 50, 0)).save(path)
+    os.rename(outside, root / 'moved_in')
+    os.rename(root / 'old', root / 'renamed')
+    expected = {'moved_in/sub/0.png', 'moved_in/sub/1.png', 'renamed/a.png', 'renamed/deep/b.png'}
+    assert await wait_for(lambda: expected <= by_path.keys())
+    assert by_path['renamed/deep/b.png'] == old_id
+    assert 'old/a.png' not in by_path
+
+    shutil.rmtree(root / 'moved_in')
+    assert await wait_for(lambda: 'moved_in/sub/0.png' not in by_path)
+    assert 'moved_in/sub/1.png' not in controller.files
+    async with async_session() as db:
+        paths = set((await db.exec(select(Image.path))).all())
+    assert paths == {'renamed/a.png', 'renamed/deep/b.png'}
+    await controller.stop_indexing()
@@ -0,0 +1,121 @@
+import asyncio
+
+from pics_sorter.controller import PicsController
+from pics_sorter.models import Image, Match
+from pics_sorter.write_behind import RatingBuffer
+from sqlmodel import select
+
+
+async def db_images(async_session) -> dict[int, Image]:
+    async with async_session() as db:
+        return {x.id: x for x in (await db.exec(select(Image))).all()}
+
+
+async def test_01_buffered_rate(app_config, async_session, make_image):
+    for i in range(6):
+        make_image(f'{i}.png', color=(i * 40, 0, 0))
+    controller = PicsController(
+        app_config.pics_dir, async_session, index_workers=1, write_behind=True
+    )
+    await controller.setup()
+    controller.indexer.close()
+    ratings = controller.ratings
+
+    images = await controller.get_relative_images(num=3)
+    await controller.rate(images[0].path, [x.path for x in images[1:]])
+    assert len(ratings.pending) == 3
+    assert ratings.segments()
+
+    # db is not updated yet, but reads see buffered values
+    stored = await db_images(async_session)
+    assert stored[images[0].id].elo_rating == 1200
+    winner = (await controller.get_by_ids([images[0].id]))[0]
+    assert winner.elo_rating > 1200
+    # tier move goes through the buffer too
+    await controller.layout.reconcile(force=True)
+    winner = (await controller.get_by_ids([images[0].id]))[0]
+    assert winner.path.startswith('1_good/')
+    assert (app_config.pics_dir / winner.path).exists()
+
+    await controller.stop_indexing()
+    assert not ratings.pending
+    assert not ratings.segments()
+    stored = await db_images(async_session)
+    assert stored[winner.id].path == winner.path
+    assert stored[winner.id].elo_rating == winner.elo_rating
+    assert all(stored[x.id].shown_times == 1 for x in images)
+    async with async_session() as db:
+        [match] = (await db.exec(select(Match))).all()
+    assert match.winner_id == images[0].id
+    assert match.loser_ids == ','.join(str(x.id) for x in images[1:])
+
+
+async def test_02_recover(app_config, async_session, make_image):
+    make_image('a.png')
+    controller = PicsController(app_config.pics_dir, async_session, index_workers=1)
+    await controller.setup()
+    controller.indexer.close()
+    image = next(iter((await db_images(async_session)).values()))
+
+    journal_dir = app_config.pics_dir / '.journal'
+    crashed = RatingBuffer(journal_dir, async_session)
+    image.elo_rating = 1300
+    await crashed.add([image])
+    image.shown_times = 7
+    match = Match.record(image.id, [100500])
+    await crashed.add([image], [match])
+    crashed.close_segment()
+    with crashed.segment_path(crashed.segment).open('a') as f:
+        f.write('{"id": 1, "elo_')
+
+    restored = RatingBuffer(journal_dir, async_session)
+    await restored.recover()
+    stored = (await db_images(async_session))[image.id]
+    assert (stored.elo_rating, stored.shown_times) == (1300, 7)
+    # replaying already flushed match does not duplicate it
+    await restored.write([], [match])
+    async with async_session() as db:
+        assert len((await db.exec(select(Match))).all()) == 1
+    assert not restored.segments()
+
+
+async def test_03_failed_background_flush(tmp_path, async_session, caplog):
+    failures = []
+
+    def session_maker():
+        if not failures:
+            failures.append(1)
+            raise OSError('database is locked')
+        return async_session()
+
+    ratings = RatingBuffer(tmp_path / 'journal', session_maker, size=1, fsync=False)
+    image = Image(id=1, path='a.png', elo_rating=1210, shown_times=1, extra_count=0)
+    await ratings.add([image])
+    await asyncio.wait([ratings._flush_task])
+    # exception is retrieved and logged, records wait for the next flush
+    assert 'Cannot flush ratings' in caplog.text
+    assert ratings.pending[1]['elo_rating'] == 1210
+    assert ratings.segments()
+    await ratings.close()
+    assert not ratings.pending
+
+
+async def test_04_reindex_keeps_buffered(app_config, async_session, make_image):
+    for i in range(3):
+        make_image(f'{i}.png', color=(i * 40, 0, 0))
+    controller = PicsController(
+        app_config.pics_dir, async_session, index_workers=1, write_behind=True
+    )
+    await controller.setup()
+    images = await controller.get_relative_images(num=3)
+    paths = [x.path for x in images]
+
+    await controller.rate(paths[0], paths[1:])
+    await controller.reindex()
+    await controller.indexing
+    await controller.rate(paths[0], paths[1:])
+    await controller.stop_indexing()
+
+    stored = await db_images(async_session)
+    assert [stored[x.id].shown_times for x in images] == [2, 2, 2]
+    assert stored[images[0].id].elo_rating > 1205
@@ -0,0 +1,217 @@
+import asyncio
+import logging
+import os
+import threading
+import time
+from contextlib import suppress
+from pathlib import Path
+from typing import TYPE_CHECKING
+
+from .scanner import DB_PREFIX, is_image, SKIP_DIRS, walk
+
+
+try:
+    import watchfiles
+except ImportError:
+    watchfiles = None
+
+if TYPE_CHECKING:
+    from .controller import PicsController
+
+
+log = logging.getLogger('watcher')
+# changes are applied once library was quiet for this number of seconds
+DEBOUNCE = 1.0
+# seconds between directory checks of polling backend
+POLL_INTERVAL = 5.0
+# pending paths applied right away, even if events keep coming
+MAX_PENDING = 10000
+TICK = 0.2
+# seconds to wait for inotify thread to notice stop event
+STOP_TIMEOUT = 1.0
+# dirs modified this recently are listed on every poll
+RECENT_NS = 2 * 10**9
+
+
+class Poller:
+    """
+    Fallback without inotify: stat of every known dir per poll, only dirs with changed
+    mtime are listed again. Files rewritten in place keep dir mtime, they are found by
+    full reindex only.
+    """
+
+    def __init__(self, root: Path):
+        self.root = root
+        # rel dir => (mtime_ns, {name: (size, mtime_ns, inode) or None for dirs})
+        self.dirs: dict[str, tuple[int, dict]] = {}
+
+    def listing(self, rel_dir: str) -> dict:
+        entries = {}
+        with os.scandir(self.root / rel_dir) as it:
+            for entry in it:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        if rel_dir or entry.name not in SKIP_DIRS:
+                            entries[entry.name] = None
+                    elif entry.is_file():
+                        st = entry.stat()
+                        entries[entry.name] = (st.st_size, st.st_mtime_ns, st.st_ino)
+                except OSError:
+                    continue
+        return entries
+
+    def poll(self) -> set[str]:
+        """rel paths of files that appeared, disappeared or changed since last poll"""
+        changed = set()
+        now = time.time_ns()
+        todo = list(self.dirs) or ['']
+        seen = set(todo)
+        while todo:
+            rel_dir = todo.pop()
+            old_mtime, old = self.dirs.pop(rel_dir, (None, {}))
+            try:
+                mtime = os.stat(self.root / rel_dir).st_mtime_ns
+                # dir changed within the same mtime tick could be listed too early
+                if mtime == old_mtime and now - mtime > RECENT_NS:
+                    entries = old
+                else:
+                    entries = self.listing(rel_dir)
+                self.dirs[rel_dir] = (mtime, entries)
+            except OSError:
+                # vanished, its subdirs are in todo as well
+                entries = {}
+            prefix = f'{rel_dir}/' if rel_dir else ''
+            for name in old.keys() | entries.keys():
+                if name not in old or name not in entries or old[name] != entries[name]:
+                    changed.add(prefix + name)
+            for name, info in entries.items():
+                if info is None and (sub_dir := prefix + name) not in seen:
+                    seen.add(sub_dir)
+                    todo.append(sub_dir)
+        return {x for x in changed if is_image(x)}
+
+
+class Watcher:
+    """
+    Keeps `images` in sync with files added, moved or deleted while server runs.
+
+    Events come from inotify (`watchfiles`, if installed) or from polling of directory
+    mtimes. They are coalesced by path: after `debounce` seconds without new events
+    every pending path is compared with `PicsController.files` by stat(), so bursts,
+    create+delete pairs and own renames of the app (which update `files` before events
+    arrive) cost nothing. The rest goes to `PicsController.apply_changes`. A dir moved
+    in, out or deleted as a whole gives inotify event of the dir only, it is expanded
+    to image paths under it.
+    """
+
+    def __init__(
+        self,
+        controller: 'PicsController',
+        debounce: float = DEBOUNCE,
+        interval: float = POLL_INTERVAL,
+        backend: str | None = None,
+    ):
+        self.controller = controller
+        self.debounce = debounce
+        self.interval = interval
+        self.backend = backend or ('inotify' if watchfiles else 'poll')
+        self.pending: set[str] = set()
+        # non image paths from inotify: dirs moved in, out or deleted as a whole
+        self.pending_dirs: set[str] = set()
+        self.last_event = 0.0
+        self._tasks: list[asyncio.Task] = []
+        self._stop = asyncio.Event()
+
+    @property
+    def root(self) -> Path:
+        return self.controller.path
+
+    def start(self):
+        log.info(f'Watch: {self.root} with {self.backend}')
+        self._stop.clear()
+        collect = self.inotify() if self.backend == 'inotify' else self.poll()
+        self._tasks = [asyncio.create_task(collect), asyncio.create_task(self.run())]
+
+    async def stop(self):
+        self._stop.set()
+        if self.backend == 'inotify' and self._tasks:
+            # awatch cancelled while its thread still holds rust watcher fails to close it
+            await asyncio.wait(self._tasks[:1], timeout=STOP_TIMEOUT)
+        for task in self._tasks:
+            if not task.done():
+                task.cancel()
+                with suppress(asyncio.CancelledError):
+                    await task
+        self._tasks = []
+
+    def add(self, rel_paths, rel_dirs=()):
+        self.pending.update(rel_paths)
+        self.pending_dirs.update(rel_dirs)
+        self.last_event = time.monotonic()
+
+    async def inotify(self):
+        root = str(self.root)
+        async for changes in watchfiles.awatch(
+            root, stop_event=self._stop, debounce=int(self.debounce * 1000)
+        ):
+            rel_paths = {os.path.relpath(path, root) for _, path in changes}
+            images = {x for x in rel_paths if is_image(x)}
+            # folder moved or deleted as a whole comes as one event of the folder itself
+            rel_dirs = {
+                x
+                for x in rel_paths - images
+                if x != '.' and x.partition('/')[0] not in SKIP_DIRS and not x.startswith(DB_PREFIX)
+            }
+            self.add(images, rel_dirs)
+
+    async def poll(self):
+        poller = Poller(self.root)
+        await asyncio.to_thread(poller.poll)
+        while True:
+            await asyncio.sleep(self.interval)
+            if changed := await asyncio.to_thread(poller.poll):
+                self.add(changed)
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(TICK)
+            if not (self.pending or self.pending_dirs) or not self.controller.indexed:
+                continue
+            quiet = time.monotonic() - self.last_event >= self.debounce
+            if quiet or len(self.pending) >= MAX_PENDING:
+                try:
+                    await self.apply()
+                except Exception:
+                    log.exception('Cannot apply changes')
+
+    async def apply(self):
+        async with self.controller.move_lock:
+            rel_paths, self.pending = self.pending, set()
+            rel_dirs, self.pending_dirs = self.pending_dirs, set()
+            if rel_dirs:
+                rel_paths |= await self.expand(rel_dirs)
+            await self.controller.apply_changes(rel_paths)
+
+    async def expand(self, rel_dirs: set[str]) -> set[str]:
+        """
+        image paths under dirs: files of existing ones are walked, known paths are
+        taken for ones that are gone, so their rows are deleted or matched as moves
+        """
+        found, gone = await asyncio.to_thread(self.walk_dirs, rel_dirs)
+        if gone:
+            prefixes = tuple(f'{x}/' for x in gone)
+            found.update(x for x in self.controller.rating_index.by_path if x.startswith(prefixes))
+        return found
+
+    def walk_dirs(self, rel_dirs: set[str]) -> tuple[set[str], set[str]]:
+        """runs in thread: (image paths under existing dirs, paths that do not exist)"""
+        found, gone = set(), set()
+        stopped = threading.Event()
+        for rel_dir in rel_dirs:
+            path = self.root / rel_dir
+            if path.is_dir():
+                for batch in walk(str(self.root), rel_dir, stopped):
+                    found.update(x.path for x in batch)
+            elif not path.exists():
+                gone.add(rel_dir)
+        return found, gone
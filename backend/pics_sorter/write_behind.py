@@ -0,0 +1,205 @@
+import asyncio
+import datetime
+import json
+import logging
+import os
+import time
+from contextlib import suppress
+from pathlib import Path
+from typing import Callable
+
+from pics_sorter.models import Image, Match
+from sqlalchemy import bindparam, insert, update
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from fan_tools.python import chunks
+
+
+log = logging.getLogger('write_behind')
+# rating fields written by `rate`, records in journal contain all of them
+FIELDS = ('path', 'elo_rating', 'shown_times', 'extra_count')
+FLUSH_INTERVAL = 2.0
+# flush right away when this number of images is pending
+FLUSH_SIZE = 500
+WRITE_CHUNK = 5000
+
+
+class RatingBuffer:
+    """
+    Write-behind buffer for rating updates.
+
+    Every update is appended to a journal segment and fsynced before `add` returns,
+    then applied to sqlite in one transaction per flush, on timer or when enough images
+    are pending. Flush starts a new segment and removes older ones only after commit,
+    so segments left after a crash are replayed by `recover`. Records hold absolute
+    values, not deltas, and matches are inserted with `OR IGNORE` by their id, so
+    replaying already flushed records is harmless.
+    """
+
+    def __init__(
+        self,
+        journal_dir: Path,
+        session_maker: Callable[[], AsyncSession],
+        interval: float = FLUSH_INTERVAL,
+        size: int = FLUSH_SIZE,
+        fsync: bool = True,
+    ):
+        self.journal_dir = journal_dir
+        self.session_maker = session_maker
+        self.interval = interval
+        self.size = size
+        self.fsync = fsync
+        # image id => latest record
+        self.pending: dict[int, dict] = {}
+        # records of flush in progress, still visible to `apply`
+        self.writing: dict[int, dict] = {}
+        # match id => match record
+        self.matches: dict[int, dict] = {}
+        self.segment = 0
+        self._file = None
+        self._append_lock = asyncio.Lock()
+        self._flush_lock = asyncio.Lock()
+        self._timer: asyncio.Task | None = None
+        self._flush_task: asyncio.Task | None = None
+
+    def segments(self) -> list[Path]:
+        if not self.journal_dir.exists():
+            return []
+        return sorted(self.journal_dir.glob('ratings.*.jsonl'), key=lambda x: int(x.stem[8:]))
+
+    def segment_path(self, segment: int) -> Path:
+        return self.journal_dir / f'ratings.{segment}.jsonl'
+
+    async def recover(self):
+        """apply segments left by previous run, must run before images are read from db"""
+        segments = self.segments()
+        if segments:
+            self.segment = int(segments[-1].stem[8:]) + 1
+        for path in segments:
+            with path.open() as f:
+                for line in f:
+                    with suppress(ValueError):
+                        # last line can be partially written on crash
+                        record = json.loads(line)
+                        if 'match' in record:
+                            self.matches[record['match']['id']] = record['match']
+                        else:
+                            self.pending[record['id']] = record
+        if self.pending or self.matches:
+            log.info(
+                f'Recover: {len(self.pending)} images and {len(self.matches)} matches '
+                f'from {len(segments)} segments'
+            )
+        await self.flush()
+
+    def start(self):
+        self._timer = asyncio.create_task(self.flush_periodically())
+
+    async def close(self):
+        for task in (self._timer, self._flush_task):
+            if task and not task.done():
+                task.cancel()
+                with suppress(asyncio.CancelledError):
+                    await task
+        await self.flush()
+        self.close_segment()
+
+    async def flush_periodically(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.flush()
+            except Exception:
+                log.exception('Cannot flush ratings, will retry')
+
+    def close_segment(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def append(self, records: list[dict]):
+        if self._file is None:
+            self.journal_dir.mkdir(parents=True, exist_ok=True)
+            self._file = self.segment_path(self.segment).open('a')
+        self._file.write(''.join(json.dumps(x) + '\n' for x in records))
+        self._file.flush()
+        if self.fsync:
+            os.fsync(self._file.fileno())
+
+    async def add(self, images, matches: list[dict] = ()):
+        """journal current rating fields of `images` and `matches`, db is updated on next flush"""
+        now = time.time()
+        records = [
+            {'id': x.id, **{field: getattr(x, field) for field in FIELDS}, 'updated_at': now}
+            for x in images
+        ]
+        async with self._append_lock:
+            await asyncio.to_thread(self.append, [*records, *({'match': x} for x in matches)])
+            self.pending.update((x['id'], x) for x in records)
+            self.matches.update((x['id'], x) for x in matches)
+        flushing = self._flush_task and not self._flush_task.done()
+        if len(self.pending) >= self.size and not flushing:
+            self._flush_task = asyncio.create_task(self.flush())
+            self._flush_task.add_done_callback(self.flush_done)
+
+    def flush_done(self, task: asyncio.Task):
+        """records of failed flush are back in `pending`, next flush retries them"""
+        if not task.cancelled() and (exc := task.exception()):
+            log.error('Cannot flush ratings, will retry', exc_info=exc)
+
+    def apply(self, images):
+        """overlay pending values on images read from db"""
+        for image in images:
+            if record := self.pending.get(image.id) or self.writing.get(image.id):
+                for field in FIELDS:
+                    setattr(image, field, record[field])
+        return images
+
+    async def flush(self):
+        async with self._flush_lock:
+            async with self._append_lock:
+                batch, self.pending = self.pending, {}
+                matches, self.matches = self.matches, {}
+                self.writing = batch
+                flushed = self.segments()
+                self.close_segment()
+                self.segment += 1
+            if batch or matches:
+                try:
+                    await self.write(list(batch.values()), list(matches.values()))
+                except BaseException:
+                    # newer records win, journal segments are kept
+                    async with self._append_lock:
+                        self.pending = {**batch, **self.pending}
+                        self.matches = {**matches, **self.matches}
+                    raise
+                finally:
+                    self.writing = {}
+            for path in flushed:
+                path.unlink(missing_ok=True)
+
+    async def write(self, records: list[dict], matches: list[dict] = ()):
+        started = time.monotonic()
+        q = (
+            update(Image)
+            .where(Image.id == bindparam('_id'))
+            .values({x: bindparam(x) for x in (*FIELDS, 'updated_at')})
+        )
+        rows = [
+            {
+                '_id': x['id'],
+                **{field: x[field] for field in FIELDS},
+                'updated_at': datetime.datetime.fromtimestamp(x['updated_at']),
+            }
+            for x in records
+        ]
+        async with self.session_maker() as db:
+            for chunk in chunks(rows, WRITE_CHUNK):
+                await db.execute(q, chunk)
+            for chunk in chunks(matches, WRITE_CHUNK):
+                await db.execute(insert(Match).prefix_with('OR IGNORE'), chunk)
+            await db.commit()
+        log.debug(
+            f'Flushed: {len(rows)} images, {len(matches)} matches '
+            f'in {time.monotonic() - started:.3f}s'
+        )
@@ -1,5 +1,4 @@
 import { writable, type Writable } from 'svelte/store'
-import axios from 'axios'
 import ReconnectingWebSocket from 'reconnecting-websocket'
 import type { Image } from './types'
 
@@ -11,20 +10,23 @@ picsStore.subscribe((value) => {
 })
 
 export const settings: Writable<Record<string, any>> = writable({})
+export const indexing: Writable<Record<string, any>> = writable({})
 
-export async function getPics(is_random = false) {
-  const response = await axios.get(`${window.location.origin}/api/pics/`, {params: {is_random}})
-  console.log(response.data)
-  picsStore.set(response.data.images)
-  settings.set(response.data.settings)
-}
+// per tab id, server keeps prepared matchups for it
+const session = Math.random().toString(36).slice(2)
+// `?library=<id>` in page url picks one of libraries served by backend
+const library = new URLSearchParams(window.location.search).get('library') ?? undefined
+// websocket protocol spoken by this client, server closes socket on mismatch
+const PROTOCOL_VERSION = 2
+
+// next matchup is pushed by server, `is_random` is kept for following ones
+export const getPics = (is_random = false) => sendMsg({ event: 'next', is_random })
 
 const MAX_EVENTS = 10
 
 export const events = writable([])
 // add in front and limit to 10
 
-const GET_PICS_EVENTS = ['rate_success', 'hide_success', 'restore_success']
 export const addEvent = (event) => {
   events.update((events) => {
     events.unshift(event)
@@ -32,25 +34,64 @@ export const addEvent = (event) => {
   })
   console.log('Event: ', event)
 
-  if (GET_PICS_EVENTS.includes(event.event)) {
-    getPics(event.is_random)
+  if (event.id !== undefined) {
+    resolveRequest(event)
   }
   switch (event.event) {
+    case 'hello':
+      settings.set(event.settings)
+      indexing.set(event.progress)
+      break
+    case 'matchup':
+      picsStore.set(event.images)
+      break
     case 'update_settings':
-      settings.update(() => event.settings)
+      settings.set(event.settings)
+      break
+    case 'index_progress':
+      indexing.set(event.progress)
+      break
+    case 'images_changed': {
+      // rated in this or another tab
+      const changed = new Map(event.images.map((x) => [x.id, x]))
+      if (_pics.some((pic) => changed.has(pic.id))) {
+        picsStore.set(_pics.map((pic) => ({ ...pic, ...changed.get(pic.id) })))
+      }
       break
+    }
     default:
       break
   }
 }
 
+// request id => callbacks of command waiting for its reply
+const pending = new Map()
+let nextId = 1
+
+const resolveRequest = (event) => {
+  const request = pending.get(event.id)
+  if (request === undefined) return
+  pending.delete(event.id)
+  if (event.event === 'error') {
+    console.error('Command failed: ', event)
+    request.reject(new Error(event.error))
+  } else {
+    request.resolve(event)
+  }
+}
+
 let _ws: ReconnectingWebSocket
 
 export const connectWS = () => {
   if (_ws !== undefined) return
 
   events.subscribe((evts) => (window.evts = evts))
-  _ws = new ReconnectingWebSocket(`ws://${window.location.host}/ws`)
+  const query = new URLSearchParams({
+    v: String(PROTOCOL_VERSION),
+    session,
+    ...(library && { library }),
+  })
+  _ws = new ReconnectingWebSocket(`ws://${window.location.host}/ws?${query}`)
   _ws.addEventListener('message', (event) => {
     addEvent(JSON.parse(event.data))
   })
@@ -59,13 +100,16 @@ export const connectWS = () => {
 export const setWinner = (winner: Image, isRandom: false) => {
   const loosersObjs = _pics.filter((pic) => pic.path !== winner.path)
   const loosers = loosersObjs.map((v) => v.path)
-  _ws.send(JSON.stringify({ event: 'rate', winner: winner.path, loosers, is_random: isRandom }))
+  return sendMsg({ event: 'rate', winner: winner.path, loosers, is_random: isRandom })
 }
 
-export const toggleSetting = (name: string) => {
-  _ws.send(JSON.stringify({ event: 'toggle_setting', name: name }))
-}
+export const toggleSetting = (name: string) => sendMsg({ event: 'toggle_setting', name: name })
 
-export const sendMsg = (msg: { event: string }) => {
-  _ws.send(JSON.stringify(msg))
+// resolves with reply of server, commands are handled concurrently
+export const sendMsg = (msg: { event: string; [key: string]: any }) => {
+  connectWS()
+  const id = nextId++
+  const reply = new Promise((resolve, reject) => pending.set(id, { resolve, reject }))
+  _ws.send(JSON.stringify({ ...msg, id }))
+  return reply
 }
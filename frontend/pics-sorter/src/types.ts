@@ -1,6 +1,9 @@
 export interface Image {
   path: string
   link: string
+  // resized renditions, `link` is the original
+  src: string
+  srcset: string
   id: number
   elo_rating: number
   extra_count: number
@@ -26,6 +26,14 @@ target_metadata = SQLModel.metadata
 # ... etc.
 
 
+def get_app_config():
+    """`alembic -x library=<id> upgrade head` migrates one of `LIBRARIES`"""
+    from pics_sorter.const import AppConfig, DEFAULT_LIBRARY
+
+    library = context.get_x_argument(as_dictionary=True).get('library', DEFAULT_LIBRARY)
+    return AppConfig().library_configs()[library]
+
+
 def run_migrations_offline() -> None:
     """Run migrations in 'offline' mode.
 
@@ -38,10 +46,9 @@ def run_migrations_offline() -> None:
     script output.
 
     """
-    from pics_sorter.const import AppConfig
     from pics_sorter.models import get_connection_string
 
-    url = get_connection_string(AppConfig(), is_async=False)
+    url = get_connection_string(get_app_config(), is_async=False)
 
     context.configure(
         url=url,
@@ -68,10 +75,9 @@ def run_migrations_online() -> None:
     and associate a connection with the context.
 
     """
-    from pics_sorter.const import AppConfig
     from pics_sorter.models import get_connection_string
 
-    connectable = create_engine(get_connection_string(AppConfig(), is_async=False))
+    connectable = create_engine(get_connection_string(get_app_config(), is_async=False))
     # engine_from_config(
     #    #config.get_section(config.config_ini_section),
     #    {'url': get_connection_string(AppConfig())},
@@ -0,0 +1,323 @@
+#!/usr/bin/env python3
+"""
+benchmarks of indexing and pair selection on synthetic libraries
+
+    PYTHONPATH=backend scripts/benchmark.py --images 100000 --files 2000 -o after.json
+    PYTHONPATH=backend scripts/benchmark.py --compare before.json after.json
+
+`setup` indexes generated image files, `scan_*` walk deep tree of `--tree` empty files,
+the rest runs against `images` table populated with `--images` rows with skewed rating
+history (and empty files, so moves are real)
+"""
+import argparse
+import asyncio
+import json
+import logging
+import platform
+import random
+import stat
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from itertools import islice
+from pathlib import Path
+
+from generate_pics import DUPLICATE_RATE, generate_library, NEAR_DUPLICATE_RATE, pick, SIZES
+from pics_sorter.const import AppConfig, CACHE_DIR, HIDDEN_DIR, PICS_SUFFIX
+from pics_sorter.controller import PicsController
+from pics_sorter.layout import target_tier
+from pics_sorter.models import create_database, get_connection_string, Image
+from pics_sorter.phash import to_db
+from pics_sorter.scanner import scan, SCAN_WORKERS
+from pics_sorter.scheduler import SCHEDULERS
+from sqlalchemy import insert
+from sqlmodel import create_engine, SQLModel
+
+
+logging.basicConfig(
+    level=logging.WARNING, format='%(asctime)s [%(levelname)s] %(name)s: %(message)s', force=True
+)
+log = logging.getLogger('benchmark')
+log.setLevel(logging.INFO)
+INSERT_CHUNK = 10000
+HIDDEN_RATE = 0.02
+EXTRA_RATE = 0.01
+# duplicates are picked among this number of last rows
+DUPLICATE_WINDOW = 1000
+# subdirs per dir and files per leaf dir of `--tree`
+TREE_FANOUT = 6
+TREE_LEAF = 50
+# other files next to images, sidecars and thumbnails dbs
+TREE_OTHER_RATE = 0.2
+
+
+def rating_history(rnd: random.Random) -> tuple[int, int]:
+    """
+    (shown_times, elo_rating): most images were shown a few times and stay close to
+    initial rating, long tail was shown a lot and spread far from it
+    """
+    shown_times = min(int(rnd.paretovariate(1.2)) - 1, 1000)
+    return shown_times, round(1200 + rnd.gauss(0, 12) * shown_times**0.5)
+
+
+def make_rows(count: int, seed: int):
+    rnd = random.Random(seed)
+    recent = []
+    for i in range(count):
+        width, height = pick(rnd, SIZES)
+        shown_times, elo_rating = rating_history(rnd)
+        hidden = rnd.random() < HIDDEN_RATE
+        name = f'img_{i:07d}.jpg'
+        rel_dir = HIDDEN_DIR if hidden else target_tier(name, elo_rating) or ''
+        row = {
+            'path': f'{rel_dir}/{name}' if rel_dir else name,
+            'width': width,
+            'height': height,
+            'orientation': 'landscape' if width > height else 'portrait',
+            'shown_times': shown_times,
+            'elo_rating': elo_rating,
+            'hidden': hidden,
+            'extra_count': rnd.randint(1, 3) if rnd.random() < EXTRA_RATE else 0,
+            'fingerprint': f'{rnd.getrandbits(128):032x}',
+            'content_hash': None,
+            'phash': rnd.getrandbits(64),
+            'size': rnd.randint(50_000, 5_000_000),
+            'mtime': time.time(),
+            'inode': i + 1,
+        }
+        roll = rnd.random()
+        if recent and roll < DUPLICATE_RATE:
+            orig = rnd.choice(recent)
+            orig['content_hash'] = orig['content_hash'] or f'blake2b:{orig["fingerprint"]}'
+            for field in ('fingerprint', 'content_hash', 'phash', 'size'):
+                row[field] = orig[field]
+        elif recent and roll < DUPLICATE_RATE + NEAR_DUPLICATE_RATE:
+            row['phash'] = rnd.choice(recent)['phash'] ^ (1 << rnd.randrange(64))
+        recent.append(row)
+        if len(recent) > DUPLICATE_WINDOW:
+            yield recent.pop(0)
+    yield from recent
+
+
+def populate_db(root: Path, count: int, seed: int):
+    """rows and empty files for them"""
+    root.mkdir(parents=True, exist_ok=True)
+    config = AppConfig(pics_dir=root, static_dir=root)
+    engine = create_engine(get_connection_string(config, is_async=False))
+    SQLModel.metadata.create_all(engine)
+    rows = make_rows(count, seed)
+    with engine.begin() as conn:
+        while chunk := list(islice(rows, INSERT_CHUNK)):
+            for row in chunk:
+                path = root / row['path']
+                path.parent.mkdir(exist_ok=True)
+                path.touch()
+                row['phash'] = to_db(row['phash'])
+            conn.execute(insert(Image.__table__), chunk)
+    engine.dispose()
+
+
+def summary(timings: list[float]) -> dict:
+    result = {
+        'n': len(timings),
+        'mean_ms': statistics.fmean(timings) * 1000,
+        'min_ms': min(timings) * 1000,
+        'max_ms': max(timings) * 1000,
+    }
+    if len(timings) > 1:
+        percentiles = statistics.quantiles(timings, n=100, method='inclusive')
+        for p in (50, 95, 99):
+            result[f'p{p}_ms'] = percentiles[p - 1] * 1000
+    return {k: round(v, 3) for k, v in result.items()}
+
+
+async def measure(results: dict, name: str, func, iterations: int = 1):
+    timings = []
+    for _ in range(iterations):
+        started = time.perf_counter()
+        await func()
+        timings.append(time.perf_counter() - started)
+    results[name] = summary(timings)
+    log.info(f'{name}: {results[name]}')
+
+
+def make_controller(
+    root: Path, write_behind: bool, scheduler: str = 'pivot'
+) -> tuple[PicsController, object]:
+    config = AppConfig(pics_dir=root, static_dir=root, write_behind=write_behind)
+    db = create_database(config)
+    controller = PicsController(
+        root,
+        db.session,
+        index_workers=config.index_workers,
+        write_behind=write_behind,
+        read_db=db.read_session,
+        scheduler=scheduler,
+    )
+    return controller, db
+
+
+async def close(controller: PicsController, db):
+    await controller.stop_indexing()
+    await controller.db.close()
+    await db.dispose()
+
+
+def make_tree(root: Path, count: int, seed: int):
+    """dirs get TREE_FANOUT subdirs until leaves can hold `count` files"""
+    rnd = random.Random(seed)
+    depth = 1
+    while TREE_FANOUT**depth * TREE_LEAF < count:
+        depth += 1
+    for i in range(count):
+        leaf = i // TREE_LEAF
+        parts = [f'd{(leaf // TREE_FANOUT**x) % TREE_FANOUT}' for x in range(depth)]
+        leaf_dir = root.joinpath(*parts)
+        leaf_dir.mkdir(parents=True, exist_ok=True)
+        (leaf_dir / f'img_{i:07d}.jpg').touch()
+        if rnd.random() < TREE_OTHER_RATE:
+            (leaf_dir / f'img_{i:07d}.xmp').touch()
+
+
+def rglob_images(root: Path):
+    """`PicsController.get_images` before scanner"""
+    for fpath in root.rglob('*'):
+        if fpath.suffix.lower() not in PICS_SUFFIX:
+            continue
+        rel_path = fpath.relative_to(root)
+        if rel_path.parts[0] == CACHE_DIR:
+            continue
+        try:
+            st = fpath.stat()
+        except OSError:
+            continue
+        if stat.S_ISREG(st.st_mode):
+            yield (str(rel_path), st.st_size, st.st_mtime, st.st_ino)
+
+
+async def bench_scan(results: dict, root: Path, args):
+    make_tree(root, args.tree, args.seed)
+    walkers = {
+        'scan_rglob': lambda: rglob_images(root),
+        'scan_scandir_1': lambda: scan(root, workers=1),
+        f'scan_scandir_{SCAN_WORKERS}': lambda: scan(root),
+    }
+    for name, walk in walkers.items():
+
+        async def run():
+            found = await asyncio.to_thread(lambda: sum(1 for _ in walk()))
+            assert found == args.tree, found
+
+        await measure(results, name, run, 3)
+
+
+async def bench_setup(results: dict, root: Path, args):
+    root.mkdir(parents=True, exist_ok=True)
+    generate_library(root, args.files, args.seed, args.scale)
+    config = AppConfig(pics_dir=root, static_dir=root)
+    SQLModel.metadata.create_all(create_engine(get_connection_string(config, is_async=False)))
+    for name in ('setup', 'setup_unchanged'):
+        controller, db = make_controller(root, args.write_behind)
+        await measure(results, name, controller.setup)
+        await close(controller, db)
+
+
+async def bench_selection(results: dict, root: Path, args):
+    started = time.perf_counter()
+    populate_db(root, args.images, args.seed)
+    log.info(f'Populated: {args.images} rows in {time.perf_counter() - started:.1f}s')
+
+    controller, db = make_controller(root, args.write_behind, args.scheduler)
+    if controller.ratings:
+        await controller.ratings.recover()
+    await measure(results, 'load_rating_index', controller.load_rating_index)
+    await measure(results, 'load_phash_index', controller.load_phash_index)
+
+    async def rate():
+        images = await controller.get_relative_images(3)
+        winner, *loosers = [x.path for x in images]
+        await controller.rate(winner, loosers)
+
+    n = args.iterations
+    await measure(results, 'get_relative_images', lambda: controller.get_relative_images(3), n)
+    await measure(results, 'get_random_images', lambda: controller.get_random_images(3), n)
+    await measure(results, 'rate', rate, n)
+    await measure(results, 'get_duplicated_images', lambda: controller.get_duplicated_images(50))
+    # first build moves whole top 10%, next one only images that changed places
+    await measure(results, 'build_top10', controller.build_top10)
+    await measure(results, 'build_top10_again', controller.build_top10)
+    await close(controller, db)
+
+
+def git_commit() -> str | None:
+    try:
+        out = subprocess.run(
+            ['git', 'describe', '--always', '--dirty'], capture_output=True, text=True, check=True
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return out.stdout.strip()
+
+
+async def run(args) -> dict:
+    results = {}
+    with tempfile.TemporaryDirectory(dir=args.tmp) as tmp:
+        if args.tree:
+            await bench_scan(results, Path(tmp) / 'tree', args)
+        if args.files:
+            await bench_setup(results, Path(tmp) / 'files', args)
+        if args.images:
+            await bench_selection(results, Path(tmp) / 'rows', args)
+    return {
+        'meta': {
+            'commit': git_commit(),
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'args': {k: v for k, v in vars(args).items() if k not in ('output', 'compare')},
+        },
+        'results': results,
+    }
+
+
+def compare(before: dict, after: dict):
+    print(f'{"benchmark":<24}{"before ms":>12}{"after ms":>12}{"ratio":>8}')
+    for name, stats in after['results'].items():
+        key = 'p50_ms' if 'p50_ms' in stats else 'mean_ms'
+        old = before['results'].get(name, {}).get(key)
+        ratio = f'{stats[key] / old:.2f}' if old else '-'
+        print(f'{name:<24}{old if old is not None else "-":>12}{stats[key]:>12}{ratio:>8}')
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument('--images', type=int, default=10_000, help='rows in images table')
+    parser.add_argument('--files', type=int, default=1000, help='image files to index')
+    parser.add_argument('--tree', type=int, default=20_000, help='files in tree to scan')
+    parser.add_argument('--scale', type=float, default=0.1, help='scale of generated images')
+    parser.add_argument('--iterations', type=int, default=200)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--write-behind', action=argparse.BooleanOptionalAction, default=True)
+    parser.add_argument('--scheduler', choices=SCHEDULERS, default='pivot')
+    parser.add_argument('--tmp', type=Path, help='dir for generated libraries')
+    parser.add_argument('-o', '--output', type=Path, help='json file, stdout by default')
+    parser.add_argument('--compare', nargs=2, type=Path, metavar=('BEFORE', 'AFTER'))
+    args = parser.parse_args()
+
+    if args.compare:
+        before, after = (json.loads(x.read_text()) for x in args.compare)
+        compare(before, after)
+        return
+    result = json.dumps(asyncio.run(run(args)), indent=2)
+    if args.output:
+        args.output.write_text(result)
+    else:
+        print(result)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
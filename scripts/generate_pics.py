@@ -1,6 +1,12 @@
 #!/usr/bin/env python3
+"""
+synthetic library: sizes, formats and duplicates are drawn from distributions close to
+a real photo collection, `--scale` shrinks dimensions to make generation cheaper
+"""
 import argparse
 import logging
+import random
+import shutil
 from pathlib import Path
 
 from PIL import Image, ImageDraw
@@ -12,27 +18,90 @@ logging.basicConfig(level=logging.DEBUG, format='%(asctime)s [%(levelname)s] %(n
 log = logging.getLogger('generate_pics')
 logging.getLogger('PIL').setLevel(logging.INFO)
 
+# (width, height) => weight: phone photos, screenshots, wallpapers, old cameras
+SIZES = {
+    (4032, 3024): 25,
+    (3024, 4032): 20,
+    (1920, 1080): 12,
+    (1080, 1920): 12,
+    (1280, 720): 6,
+    (1080, 1080): 8,
+    (3000, 2000): 7,
+    (800, 600): 6,
+    (640, 480): 4,
+}
+# suffix => (PIL format, weight)
+FORMATS = {'.jpg': ('JPEG', 70), '.png': ('PNG', 20), '.webp': ('WEBP', 10)}
+# '' is library root, tier dirs are the ones sorter moves images into
+DIRS = {'': 40, '1_good': 10, '3_lower': 20, '9_bad': 10, 'import/2021': 10, 'import/2022': 10}
+# byte-exact copies in another dir
+DUPLICATE_RATE = 0.05
+# resized and re-encoded copies, only perceptual hash matches
+NEAR_DUPLICATE_RATE = 0.03
 
-def generate_image(path: Path, text: str):
-    img = Image.new('RGB', (100, 100), color='red')
+
+def pick(rnd: random.Random, weights: dict):
+    keys = list(weights)
+    values = [x[-1] if isinstance(x, tuple) else x for x in weights.values()]
+    return rnd.choices(keys, values)[0]
+
+
+def generate_image(path: Path, text: str, size=(100, 100), rnd: random.Random | None = None):
+    rnd = rnd or random.Random(text)
+    img = Image.new('RGB', size, color=tuple(rnd.randrange(256) for _ in range(3)))
     draw = ImageDraw.Draw(img)
+    width, height = size
+    for _ in range(rnd.randint(3, 12)):
+        x, y = rnd.randrange(width), rnd.randrange(height)
+        box = (x, y, x + rnd.randrange(1, width // 2 + 2), y + rnd.randrange(1, height // 2 + 2))
+        draw.rectangle(box, fill=tuple(rnd.randrange(256) for _ in range(3)))
     draw.text((10, 10), text, fill='black')
-    img.save(path)
+    img.save(path, FORMATS.get(path.suffix, ('PNG',))[0])
 
 
-def gen_in_dir(path: Path):
-    path.mkdir(exist_ok=True)
+def near_duplicate(src: Path, dst: Path):
+    with Image.open(src) as img:
+        width, height = img.size
+        img.convert('RGB').resize((max(width * 3 // 4, 1), max(height * 3 // 4, 1))).save(
+            dst, 'JPEG', quality=70
+        )
 
-    for i in range(10):
-        pic = path / f'img_{i}.png'
-        generate_image(pic, f'{path.name}_{i}')
+
+def generate_library(root: Path, count: int, seed: int = 0, scale: float = 1.0) -> list[Path]:
+    """`count` images under `root` including duplicates, returns paths of all files"""
+    rnd = random.Random(seed)
+    paths = []
+    for i in range(count):
+        rel_dir = pick(rnd, DIRS)
+        (root / rel_dir).mkdir(parents=True, exist_ok=True)
+        path = root / rel_dir / f'img_{i:07d}{pick(rnd, FORMATS)}'
+        roll = rnd.random()
+        if paths and roll < DUPLICATE_RATE:
+            shutil.copyfile(rnd.choice(paths), path)
+        elif paths and roll < DUPLICATE_RATE + NEAR_DUPLICATE_RATE:
+            path = path.with_suffix('.jpg')
+            near_duplicate(rnd.choice(paths), path)
+        else:
+            width, height = pick(rnd, SIZES)
+            size = (max(int(width * scale), 16), max(int(height * scale), 16))
+            generate_image(path, f'{rel_dir}_{i}', size, rnd)
+        paths.append(path)
+        if i and i % 1000 == 0:
+            log.debug(f'Generated: {i}/{count}')
+    return paths
 
 
 def main():
-    base = rel_path('../test_pics')
-    base.mkdir(exist_ok=True)
-    for x in ['0_picked', '1_good', '2_bad']:
-        gen_in_dir(base/x)
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('dest', nargs='?', type=Path, default=rel_path('../test_pics'))
+    parser.add_argument('-n', '--count', type=int, default=30)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--scale', type=float, default=0.1)
+    args = parser.parse_args()
+
+    args.dest.mkdir(exist_ok=True)
+    generate_library(args.dest, args.count, args.seed, args.scale)
+    log.info(f'Generated: {args.count} images in {args.dest}')
 
 
 if __name__ == '__main__':